@@ -0,0 +1,228 @@
+import argparse
+import csv
+import math
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+
+import numpy as np
+
+import main
+from glicko import rate_match
+from main import E, TAU, _update_volatility, from_mu, from_phi, g, to_mu, to_phi
+
+# Equivalence checks behind the rating engine's claims. Each check returns a
+# dict of numbers and whether it passed; run the module to see them all and
+# exit non-zero on any failure.
+#
+#   engine     glicko.rate_match against the original scalar per-player loop
+#   recompute  recompute.recompute_dirty after retroactive edits against a
+#              full replay.replay of the edited history
+#   stats      player_stats and player_pairs as a chunked import and later
+#              edits leave them against stats.check_stats's rebuild
+
+ENGINE_TOLERANCE = 1e-9  # rating points
+RECOMPUTE_TOLERANCE = 1e-9
+
+#region ENGINE
+
+def scalar_rate_match(players, winners, losers, tau=TAU):
+    # The per-player update main.update_glicko2 used before the batch engine,
+    # kept here as the reference. players maps id -> (rating, rd, vol).
+    result = {}
+    for pid in winners + losers:
+        rating, rd, sigma = players[pid]
+        mu, phi = to_mu(rating), to_phi(rd)
+        won = pid in winners
+        opponents = [(to_mu(players[opp][0]), to_phi(players[opp][1])) for opp in (losers if won else winners)]
+        score = 1 if won else 0
+
+        v = 1 / sum(g(phi_j)**2 * E(mu, mu_j, phi_j) * (1 - E(mu, mu_j, phi_j)) for mu_j, phi_j in opponents)
+        delta_sum = sum(g(phi_j) * (score - E(mu, mu_j, phi_j)) for mu_j, phi_j in opponents)
+        sigma_prime = _update_volatility(v * delta_sum, phi, sigma, v, tau)
+        phi_star = math.sqrt(phi**2 + sigma_prime**2)
+        phi_prime = 1 / math.sqrt(1 / phi_star**2 + 1 / v)
+        result[pid] = (from_mu(mu + phi_prime**2 * delta_sum), from_phi(phi_prime), sigma_prime)
+    return result
+
+def check_engine(matches=2000, seed=0):
+    # Random rosters of 1 to 8 a side with ratings, RDs and volatilities
+    # across the ranges a league produces
+    rng = np.random.default_rng(seed)
+    worst = 0.0
+    compared = skipped = 0
+    for _ in range(matches):
+        n_w, n_l = rng.integers(1, 9, size=2)
+        pids = list(range(n_w + n_l))
+        players = {pid: (float(rng.normal(1500, 300)), float(rng.uniform(30, 350)), float(rng.uniform(0.03, 0.1)))
+                   for pid in pids}
+        try:
+            expected = scalar_rate_match(players, pids[:n_w], pids[n_w:])
+        except (OverflowError, ZeroDivisionError, ValueError):
+            skipped += 1
+            continue
+        got, _ = rate_match(players, pids[:n_w], pids[n_w:])
+        for pid, values in expected.items():
+            worst = max(worst, max(abs(a - b) for a, b in zip(values, got[pid])))
+        compared += 1
+    return {"matches": compared, "scalar_failures": skipped, "max_abs_diff": worst,
+            "passed": worst <= ENGINE_TOLERANCE}
+
+#endregion
+
+#region RECOMPUTE
+
+def _ratings(conn):
+    players = conn.execute("SELECT id, rating, rd, vol FROM players ORDER BY id").fetchall()
+    history = conn.execute("""
+        SELECT player_id, match_id, rating_after, rd_after, vol_after FROM rating_history ORDER BY player_id, match_id
+    """).fetchall()
+    return players, history
+
+def _max_diff(a, b):
+    # largest difference between matching rows; inf when the rows differ in keys
+    worst = 0.0
+    for x, y in zip(a, b):
+        if x[:-3] != y[:-3]:
+            return math.inf
+        worst = max(worst, max(abs(p - q) for p, q in zip(x[-3:], y[-3:])))
+    return worst if len(a) == len(b) else math.inf
+
+def check_recompute(matches=3000, edits=20, seed=0):
+    # A synthetic league replayed with snapshots, then flipped results and
+    # swapped players in rated matches from its second half, all marked dirty
+    # and re-rated together. The result must be what replaying the edited
+    # history from scratch gives.
+    import recompute
+    import replay
+    from bench.synth import build_league
+
+    rng = np.random.default_rng(seed)
+    saved = main.DB, main.AUTO_RECOMPUTE
+    with tempfile.TemporaryDirectory() as tmp:
+        main.DB = build_league(os.path.join(tmp, "league.db"), players=200, matches=matches, pending=0, seed=seed)
+        main.AUTO_RECOMPUTE = False
+        try:
+            conn = main.get_connection()
+            replay.replay(checkpoint_every=250)
+            for match_id in rng.choice(np.arange(matches // 2, matches) + 1, size=edits, replace=False).tolist():
+                (team1, won1), (team2, _) = conn.execute(
+                    "SELECT id, is_winner FROM teams WHERE match_id = ? ORDER BY id", (match_id,)
+                ).fetchall()
+                if rng.random() < 0.5:
+                    main.set_match_result(match_id, team2 if won1 else team1)
+                else:
+                    playing = {pid for (pid,) in conn.execute(
+                        "SELECT player_id FROM team_players WHERE team_id IN (?, ?)", (team1, team2)
+                    )}
+                    roster = [pid for (pid,) in conn.execute(
+                        "SELECT player_id FROM team_players WHERE team_id = ?", (team1,)
+                    )]
+                    roster[int(rng.integers(len(roster)))] = int(rng.choice(sorted(set(range(1, 201)) - playing)))
+                    main.set_team_players(team1, roster)
+            rerated = recompute.recompute_dirty()
+            incremental = _ratings(conn)
+            replay.replay()
+            full = _ratings(conn)
+        finally:
+            main.close_connections()
+            main.DB, main.AUTO_RECOMPUTE = saved
+    diff = max(_max_diff(incremental[0], full[0]), _max_diff(incremental[1], full[1]))
+    return {"matches": matches, "edits": edits, "rerated": rerated, "max_abs_diff": diff,
+            "passed": diff <= RECOMPUTE_TOLERANCE}
+
+#endregion
+
+#region STATS
+
+def check_stats(matches=3000, edits=40, seed=0):
+    # A CSV of uneven rosters, some results pending and some dates out of
+    # order, imported in small chunks; then results flipped, pending ones
+    # decided, players swapped and back-dated matches recorded. The
+    # maintained tables must equal a rebuild from the history.
+    import importer
+    import stats
+    from setup.db_setup import create_db
+
+    rng = np.random.default_rng(seed)
+    players = [f"p{i}" for i in range(100)]
+    days = np.sort(rng.integers(0, matches // 4, size=matches))
+    late = rng.random(matches) < 0.02
+    days[late] = rng.integers(0, matches // 4, size=int(late.sum()))
+    saved = main.DB, main.AUTO_RECOMPUTE
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "matches.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            out = csv.writer(f)
+            out.writerow(["date", "team1", "team2", "winner"])
+            for day in days.tolist():
+                n_1, n_2 = rng.integers(1, 7, size=2)
+                roster = rng.choice(players, size=n_1 + n_2, replace=False).tolist()
+                winner = "" if rng.random() < 0.1 else int(rng.integers(1, 3))
+                out.writerow([(date(2000, 1, 1) + timedelta(days=day)).isoformat(),
+                              ";".join(roster[:n_1]), ";".join(roster[n_1:]), winner])
+
+        main.DB = os.path.join(tmp, "league.db")
+        main.AUTO_RECOMPUTE = False
+        create_db(main.DB)
+        try:
+            conn = main.get_connection()
+            importer.import_matches(path, batch_size=250, recompute=False)
+            imported = stats.check_stats()
+            for match_id in rng.choice(np.arange(matches) + 1, size=edits, replace=False).tolist():
+                (team1, won1), (team2, _) = conn.execute(
+                    "SELECT id, is_winner FROM teams WHERE match_id = ? ORDER BY id", (match_id,)
+                ).fetchall()
+                playing = {pid for (pid,) in conn.execute(
+                    "SELECT player_id FROM team_players WHERE team_id IN (?, ?)", (team1, team2)
+                )}
+                everyone = [pid for (pid,) in conn.execute("SELECT id FROM players ORDER BY id")]
+                edit = rng.integers(3)
+                if edit == 0:
+                    main.set_match_result(match_id, team2 if won1 else team1)
+                elif edit == 1:
+                    roster = [pid for (pid,) in conn.execute(
+                        "SELECT player_id FROM team_players WHERE team_id = ?", (team1,)
+                    )]
+                    roster[int(rng.integers(len(roster)))] = int(rng.choice(sorted(set(everyone) - playing)))
+                    main.set_team_players(team1, roster)
+                else:
+                    day = (date(2000, 1, 1) + timedelta(days=int(rng.integers(matches // 4)))).isoformat()
+                    roster = rng.choice(everyone, size=6, replace=False).tolist()
+                    main.record_match(day, roster[:3], roster[3:], int(rng.integers(1, 3)))
+            edited = stats.check_stats()
+        finally:
+            main.close_connections()
+            main.DB, main.AUTO_RECOMPUTE = saved
+    wrong = sum(imported.values()) + sum(edited.values())
+    return {"matches": matches, "edits": edits, "wrong_after_import": imported, "wrong_after_edits": edited,
+            "passed": wrong == 0}
+
+#endregion
+
+CHECKS = {
+    "engine": check_engine,
+    "recompute": check_recompute,
+    "stats": check_stats,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the rating engine against its reference implementations.")
+    parser.add_argument("checks", nargs="*", help=f"any of {', '.join(CHECKS)} (default: all)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    unknown = set(args.checks) - CHECKS.keys()
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(sorted(unknown))}")
+    failed = []
+    for name in args.checks or CHECKS:
+        result = CHECKS[name](seed=args.seed)
+        print(f"{name}:")
+        for key, value in result.items():
+            print(f"  {key:18} {value}")
+        if not result["passed"]:
+            failed.append(name)
+    if failed:
+        print(f"FAILED: {', '.join(failed)}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+from bench.run import summarize
+
+# Load test for server.py: many keep-alive clients polling read endpoints,
+# each replaying the ETag it last saw the way a phone would.
+
+DEFAULT_PATHS = "/leaderboard?limit=50,/matches?pending=1&limit=20,/players"
+
+async def _client(host, port, paths, deadline, results, revalidate):
+    reader, writer = await asyncio.open_connection(host, port)
+    etags = {}
+    try:
+        i = 0
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            headers = f"GET {path} HTTP/1.1\r\nHost: {host}\r\n"
+            if revalidate and path in etags:
+                headers += f"If-None-Match: {etags[path]}\r\n"
+            start = time.perf_counter()
+            writer.write((headers + "\r\n").encode())
+            head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+            status = int(head[0].split(" ")[1])
+            fields = dict(line.split(": ", 1) for line in head[1:] if ": " in line)
+            await reader.readexactly(int(fields.get("Content-Length", 0)))
+            results.append((status, time.perf_counter() - start))
+            if "ETag" in fields:
+                etags[path] = fields["ETag"]
+    finally:
+        writer.close()
+
+async def run_load(url, clients, seconds, paths, revalidate=True):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    results = []
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    outcomes = await asyncio.gather(
+        *(_client(host, port, paths, deadline, results, revalidate) for _ in range(clients)),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - started
+    failed = [o for o in outcomes if isinstance(o, Exception)]
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    report = {
+        "clients": clients,
+        "failed_clients": len(failed),
+        "requests": len(results),
+        "requests_per_s": len(results) / elapsed,
+        "statuses": statuses,
+    }
+    if results:
+        report["latency"] = summarize([t for _, t in results])
+    return report
+
+def wait_for(url, timeout=10):
+    parts = urlsplit(url)
+    deadline = time.time() + timeout
+
+    async def probe():
+        while True:
+            try:
+                _, writer = await asyncio.open_connection(parts.hostname, parts.port)
+                writer.close()
+                return
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+    asyncio.run(probe())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test a running league server.")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--paths", default=DEFAULT_PATHS, help="comma-separated paths to poll")
+    parser.add_argument("--no-etag", action="store_true", help="never send If-None-Match")
+    parser.add_argument("--spawn", metavar="DB", help="start server.py on DB for the run")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        port = str(urlsplit(args.url).port or 8080)
+        server = subprocess.Popen([sys.executable, "-m", "server", "--db", args.spawn, "--port", port])
+    try:
+        wait_for(args.url)
+        report = asyncio.run(run_load(args.url, args.clients, args.seconds, args.paths.split(","), not args.no_etag))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    print(json.dumps(report, indent=2))
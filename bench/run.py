@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import main
+import replay
+from bench.synth import build_league
+
+DEFAULT_SCALES = "100x1000,1000x10000"
+REPEAT = 50
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UI_TIMEOUT = 60
+
+#region TIMING
+
+def summarize(times):
+    times = sorted(times)
+    pick = lambda q: times[min(len(times) - 1, int(q * len(times)))]
+    return {
+        "calls": len(times),
+        "total_s": sum(times),
+        "mean_ms": 1000 * sum(times) / len(times),
+        "p50_ms": 1000 * pick(0.5),
+        "p95_ms": 1000 * pick(0.95),
+        "max_ms": 1000 * times[-1],
+    }
+
+def timed(fn, repeat=1):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def ui_startup(path):
+    # Start the Tk app on the league and let it report how long it took to
+    # build and draw its first page (see LEAGUE_UI_STARTUP in ui/app.py).
+    # Needs a display.
+    with tempfile.TemporaryDirectory() as workdir:
+        out = os.path.join(workdir, "startup.json")
+        env = dict(os.environ, LEAGUE_DB=path, LEAGUE_UI_STARTUP=out)
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-m", "ui.app"], cwd=ROOT, env=env,
+                              capture_output=True, text=True, timeout=UI_TIMEOUT)
+        process_s = time.perf_counter() - start
+        if proc.returncode or not os.path.exists(out):
+            lines = proc.stderr.strip().splitlines()
+            raise RuntimeError(lines[-1] if lines else f"exit status {proc.returncode}")
+        with open(out) as f:
+            timings = json.load(f)
+    # mean_ms is the whole process, interpreter start to exit, for compare()
+    return {"calls": 1, "mean_ms": 1000 * process_s, **timings}
+
+#endregion
+
+#region BENCHMARKS
+
+def bench_scale(path, players, repeat=REPEAT, seed=0):
+    # Each benchmark is timed on its own; a failure is recorded, not raised
+    main.DB = path
+    main.invalidate_player_cache(path)
+    conn = main.get_connection()
+    rng = random.Random(seed)
+    results = {}
+
+    def run(name, fn, n=repeat):
+        try:
+            results[name] = timed(fn, n)
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+
+    pending = [mid for (mid,) in conn.execute(
+        "SELECT match_id FROM teams WHERE is_winner IS NULL GROUP BY match_id ORDER BY match_id LIMIT ?", (repeat,)
+    )]
+    pending_iter = iter(pending)
+
+    def set_result():
+        match_id = next(pending_iter)
+        team_id, = conn.execute("SELECT MIN(id) FROM teams WHERE match_id = ?", (match_id,)).fetchone()
+        main.set_match_result(match_id, team_id)
+
+    def glicko_update():
+        ids = rng.sample(range(1, players + 1), 12)
+        main.update_glicko2(ids[:6], ids[6:])
+
+    def players_cold():
+        main.invalidate_player_cache(path)
+        main.get_players()
+
+    def view_matches_walk():
+        after = None
+        while True:
+            rows = main.get_matches_page(after, 100)
+            if len(rows) < 100:
+                return
+            after = (rows[-1][1], rows[-1][0])
+
+    first_match, = conn.execute("SELECT MIN(id) FROM matches").fetchone()
+
+    run("replay", lambda: replay.replay(), n=1)
+    run("set_match_result", set_result, n=len(pending))
+    run("update_glicko2", glicko_update)
+    run("get_players_cold", players_cold)
+    run("get_players_warm", main.get_players)
+    run("get_leaderboard_warm", main.get_leaderboard)
+    run("view_matches_first_page", lambda: main.get_matches_page(None, 100))
+    run("view_matches_all_pages", view_matches_walk, n=1)
+    run("match_teams", lambda: main.get_match_teams(first_match))
+    try:
+        results["ui_startup"] = ui_startup(path)
+    except Exception as e:
+        results["ui_startup"] = {"error": f"{type(e).__name__}: {e}"}
+    return results
+
+def run_benchmarks(scales, workdir, repeat=REPEAT, seed=0):
+    report = {
+        "commit": _git_commit(),
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "scales": [],
+    }
+    for players, matches in scales:
+        path = os.path.join(workdir, f"bench_{players}x{matches}.db")
+        if os.path.exists(path):
+            os.remove(path)
+        start = time.perf_counter()
+        build_league(path, players, matches, pending=repeat, seed=seed)
+        build_s = time.perf_counter() - start
+        print(f"{players} players x {matches} matches (built in {build_s:.1f}s)", file=sys.stderr)
+        results = bench_scale(path, players, repeat, seed)
+        for name, stats in results.items():
+            print(f"  {name:26} {stats.get('mean_ms', 0):10.3f} ms  {stats.get('error', '')}", file=sys.stderr)
+        report["scales"].append({"players": players, "matches": matches, "build_s": build_s, "results": results})
+    return report
+
+#endregion
+
+#region COMPARE
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    old_scales = {(s["players"], s["matches"]): s["results"] for s in old["scales"]}
+    print(f"{old['commit']} -> {new['commit']}")
+    for scale in new["scales"]:
+        key = (scale["players"], scale["matches"])
+        if key not in old_scales:
+            continue
+        print(f"{key[0]} players x {key[1]} matches")
+        for name, stats in scale["results"].items():
+            before = old_scales[key].get(name, {})
+            if "mean_ms" in stats and "mean_ms" in before:
+                ratio = stats["mean_ms"] / before["mean_ms"] if before["mean_ms"] else float("inf")
+                print(f"  {name:26} {before['mean_ms']:10.3f} -> {stats['mean_ms']:10.3f} ms  x{ratio:.2f}")
+
+#endregion
+
+def parse_scales(text):
+    return [tuple(int(n) for n in item.split("x")) for item in text.split(",") if item]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the rating and query paths on synthetic leagues.")
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="comma-separated PLAYERSxMATCHES, e.g. 100x1000,100000x1000000")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="calls per timed operation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--keep", metavar="DIR", help="build the databases in DIR and keep them")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    if args.keep:
+        os.makedirs(args.keep, exist_ok=True)
+        report = run_benchmarks(parse_scales(args.scales), args.keep, args.repeat, args.seed)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            report = run_benchmarks(parse_scales(args.scales), workdir, args.repeat, args.seed)
+            main.close_connections()
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}", file=sys.stderr)
@@ -0,0 +1,87 @@
+import argparse
+import sqlite3
+from datetime import date, timedelta
+
+import numpy as np
+
+from setup.db_setup import create_db
+from stats import fill
+
+CHUNK = 20000
+MATCHES_PER_DAY = 20
+
+#region SYNTHETIC LEAGUE
+
+def _rosters(rng, n_players, n_matches, team_size):
+    # (n_matches, 2 * team_size) distinct player indexes per row
+    rosters = rng.integers(0, n_players, size=(n_matches, 2 * team_size))
+    while True:
+        ordered = np.sort(rosters, axis=1)
+        clash = (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+        if not clash.any():
+            return rosters
+        rosters[clash] = rng.integers(0, n_players, size=(clash.sum(), 2 * team_size))
+
+def build_league(path, players=1000, matches=10000, pending=200, team_size=6, seed=0, start=date(2000, 1, 1)):
+    # A league.db with hidden true skills: each match is won by team 1 with
+    # probability logistic(sum of skill differences). The last `pending`
+    # matches have no result yet. Ratings are left at their defaults.
+    if players < 2 * team_size:
+        raise ValueError(f"need at least {2 * team_size} players")
+    create_db(path)
+    rng = np.random.default_rng(seed)
+    skill = rng.normal(0, 0.5, size=players)
+
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO players (id, name, full_name) VALUES (?, ?, ?)",
+            ((i + 1, f"p{i + 1}", f"Player {i + 1}") for i in range(players))
+        )
+
+    for first in range(0, matches, CHUNK):
+        n = min(CHUNK, matches - first)
+        ids = np.arange(first, first + n)
+        rosters = _rosters(rng, players, n, team_size)
+        diff = skill[rosters[:, :team_size]].sum(axis=1) - skill[rosters[:, team_size:]].sum(axis=1)
+        team1_wins = rng.random(n) < 1 / (1 + np.exp(-diff))
+        decided = ids < matches - pending
+
+        with conn:
+            conn.executemany(
+                "INSERT INTO matches (id, date) VALUES (?, ?)",
+                ((int(m) + 1, str(start + timedelta(days=int(m) // MATCHES_PER_DAY))) for m in ids)
+            )
+            conn.executemany(
+                "INSERT INTO teams (id, match_id, is_winner) VALUES (?, ?, ?)",
+                (
+                    (int(m) * 2 + side + 1, int(m) + 1, (int(win) if side == 0 else int(not win)) if done else None)
+                    for m, win, done in zip(ids, team1_wins, decided)
+                    for side in (0, 1)
+                )
+            )
+            conn.executemany(
+                "INSERT INTO team_players (team_id, player_id) VALUES (?, ?)",
+                (
+                    (int(m) * 2 + (slot >= team_size) + 1, int(pid) + 1)
+                    for m, row in zip(ids, rosters)
+                    for slot, pid in enumerate(row)
+                )
+            )
+    with conn:
+        fill(conn.cursor())
+    conn.close()
+    return path
+
+#endregion
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a synthetic league database.")
+    parser.add_argument("path")
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--matches", type=int, default=10000)
+    parser.add_argument("--pending", type=int, default=200, help="matches left without a result")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    build_league(args.path, args.players, args.matches, args.pending, seed=args.seed)
+    print(f"Wrote {args.path}: {args.players} players, {args.matches} matches.")
@@ -0,0 +1,71 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from glicko import solve_volatility
+from main import TAU, _update_volatility
+
+# Reference check for glicko.solve_volatility: the array solver must agree
+# with the scalar main._update_volatility wherever the scalar one finishes.
+
+def corpus(n=20000, seed=0):
+    # (delta, phi, sigma, v) drawn around the values real matches produce,
+    # plus the edges: tiny and huge deltas, fresh and settled players
+    rng = np.random.default_rng(seed)
+    phi = rng.uniform(0.05, 2.1, n)
+    v = rng.uniform(0.05, 20.0, n)
+    delta = rng.normal(0, 1, n) * np.sqrt(v)
+    sigma = rng.uniform(0.01, 0.2, n)
+    edges = np.array([
+        (0.0, 2.0147, 0.06, 1.0),
+        (1e-9, 0.05, 0.06, 0.05),
+        (25.0, 0.05, 0.06, 0.05),
+        (-25.0, 2.0147, 0.2, 20.0),
+        (3.0, 1.0, 0.01, 0.5),
+    ])
+    return (
+        np.concatenate([delta, edges[:, 0]]), np.concatenate([phi, edges[:, 1]]),
+        np.concatenate([sigma, edges[:, 2]]), np.concatenate([v, edges[:, 3]]),
+    )
+
+def check(n=20000, seed=0, tau=TAU):
+    delta, phi, sigma, v = corpus(n, seed)
+
+    start = time.perf_counter()
+    expected = []
+    for args in zip(delta.tolist(), phi.tolist(), sigma.tolist(), v.tolist()):
+        try:
+            expected.append(_update_volatility(*args, tau))
+        except (OverflowError, ZeroDivisionError, ValueError):
+            expected.append(np.nan)
+    scalar_s = time.perf_counter() - start
+    expected = np.array(expected)
+
+    start = time.perf_counter()
+    got, iterations, converged = solve_volatility(delta, phi, sigma, v, tau)
+    array_s = time.perf_counter() - start
+
+    both = np.isfinite(expected) & converged
+    return {
+        "cases": len(delta),
+        "max_abs_diff": float(np.abs(got[both] - expected[both]).max()),
+        "scalar_failures": int((~np.isfinite(expected)).sum()),
+        "fallbacks": int((~converged).sum()),
+        "mean_iterations": float(iterations.mean()),
+        "max_iterations": int(iterations.max()),
+        "scalar_s": scalar_s,
+        "array_s": array_s,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the array volatility solver with the scalar one.")
+    parser.add_argument("--cases", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tolerance", type=float, default=1e-12, help="largest allowed difference")
+    args = parser.parse_args()
+    result = check(args.cases, args.seed)
+    for key, value in result.items():
+        print(f"{key:18} {value}")
+    sys.exit(0 if result["max_abs_diff"] <= args.tolerance else 1)
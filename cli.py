@@ -0,0 +1,301 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+import instrument
+import main
+
+# Keep this module free of tkinter and NumPy: commands import what they need
+# (replay, importer, glicko through main) only when they run.
+
+def _player_ids(text, conn):
+    # Comma-separated player ids or names
+    ids = []
+    for token in (t.strip() for t in text.split(",")):
+        if not token:
+            continue
+        if token.isdigit():
+            row = conn.execute("SELECT id FROM players WHERE id = ?", (int(token),)).fetchone()
+        else:
+            row = conn.execute("SELECT id FROM players WHERE name = ?", (token,)).fetchone()
+        if row is None:
+            raise ValueError(f"unknown player {token!r}")
+        ids.append(row[0])
+    return ids
+
+#region COMMANDS
+
+def cmd_add_player(args):
+    pid = main.add_player(args.name, args.full_name)
+    print(pid)
+
+def cmd_record_match(args):
+    conn = main.get_connection()
+    team1, team2 = _player_ids(args.team1, conn), _player_ids(args.team2, conn)
+    if not team1 or not team2:
+        raise ValueError("both teams need at least one player")
+    match_id, _, _ = main.record_match(args.date, team1, team2, args.winner)
+    print(match_id)
+
+def cmd_set_result(args):
+    teams = main.get_match_teams(args.match_id)
+    if len(teams) < 2:
+        raise ValueError(f"match {args.match_id} has no teams")
+    main.set_match_result(args.match_id, teams[args.winner - 1][0])
+
+def _rows_json(rows):
+    return [{"id": pid, "name": name, "rating": rating} for pid, name, rating in rows]
+
+def _print_leaderboard(rows):
+    for rank, (pid, name, rating) in enumerate(rows, start=1):
+        print(f"{rank:4}  {rating:7.1f}  {name} ({pid})")
+
+def cmd_leaderboard(args):
+    if args.all_leagues:
+        import leagues
+        boards = leagues.run_all("leaderboard", args.limit, workers=args.workers)
+        if args.json:
+            json.dump({name: _rows_json(rows) for name, rows in boards.items()}, sys.stdout)
+            print()
+            return
+        for name, rows in boards.items():
+            print(f"{name}:")
+            _print_leaderboard(rows)
+        return
+    rows = main.get_leaderboard()[:args.limit]
+    if args.json:
+        json.dump(_rows_json(rows), sys.stdout)
+        print()
+        return
+    _print_leaderboard(rows)
+
+def cmd_recompute(args):
+    if args.all_leagues:
+        import leagues
+        for name, count in leagues.run_all("recompute", workers=args.workers).items():
+            print(f"{name}: replayed {count} matches.")
+        return
+    if args.dirty:
+        import recompute
+        print(f"Re-rated {recompute.recompute_dirty()} matches.")
+        return
+    import replay
+    print(f"Replayed {replay.replay(args.every, args.resume)} matches.")
+
+def cmd_import(args):
+    import importer
+    matches, players = importer.import_matches(args.path, args.batch, not args.no_recompute)
+    print(f"Imported {matches} matches and {players} new players.")
+
+def cmd_export_columns(args):
+    import columnar
+    meta = columnar.export_columns(args.path)
+    print(f"Exported {meta['matches']} matches and {meta['players']} players to {args.path}.")
+
+def cmd_import_leagues(args):
+    import leagues
+    tasks = []
+    for item in args.files:
+        name, sep, path = item.partition("=")
+        if not sep:
+            raise ValueError(f"expected LEAGUE=PATH, got {item!r}")
+        tasks.append((name, "import", (path, not args.no_recompute)))
+    for (name, _, _), (matches, players) in zip(tasks, leagues.run_jobs(tasks, args.workers)):
+        print(f"{name}: imported {matches} matches and {players} new players.")
+
+def cmd_init(args):
+    from setup.db_setup import migrate
+    print(f"{args.db}: schema version {migrate(args.db, verbose=True)}")
+
+def cmd_leagues(args):
+    import leagues
+    current = leagues.current_league()
+    for name in leagues.list_leagues():
+        print(f"{'*' if name == current else ' '} {name}")
+
+def cmd_create_league(args):
+    import leagues
+    print(leagues.create_league(args.name))
+
+def cmd_export(args):
+    import importer
+    print(f"Exported {importer.export_matches(args.path)} matches.")
+
+def cmd_record(args):
+    import stats
+    conn = main.get_connection()
+    pid, = _player_ids(args.player, conn)
+    wins, losses, streak, best = stats.get_player_stats(conn).get(pid, (0, 0, 0, 0))
+    print(f"{wins}-{losses} in {wins + losses} games, streak {stats.format_streak(streak) or '-'}, best W{best}")
+    rows = stats.get_pair_stats(pid, conn)[:args.limit]
+    if rows:
+        print(f"{'':20} {'with':>9} {'against':>9}")
+    for _, name, games_with, wins_with, games_against, wins_against in rows:
+        print(f"{name[:20]:20} {wins_with:4}-{games_with - wins_with:<4} {wins_against:4}-{games_against - wins_against:<4}")
+
+def cmd_rebuild_stats(args):
+    import stats
+    if args.check:
+        counts = stats.check_stats()
+        for table, count in counts.items():
+            print(f"{table}: {count} rows differ from a rebuild")
+        if any(counts.values()):
+            sys.exit(1)
+        return
+    players, pairs = stats.rebuild_stats()
+    print(f"Rebuilt stats for {players} players and {pairs} player pairs.")
+
+def cmd_period(args):
+    if args.period is not None:
+        main.set_rating_period(args.period)
+    period = main.get_rating_period()
+    print(f"Rating period: {period or 'off (each match is rated when its result is set)'}")
+
+def cmd_simulate(args):
+    import simulate
+    conn = main.get_connection()
+    pool = _player_ids(args.players, conn) if args.players else None
+    overtakes = [tuple(_player_ids(f"{a},{b}", conn)) for a, b in args.overtake] or None
+    result = simulate.simulate_season(pool, args.seasons, args.matches, args.team_size, overtakes,
+                                      seed=args.seed, workers=args.workers, conn=conn)
+    names = dict(conn.execute("SELECT id, name FROM players").fetchall())
+    first, podium, place = simulate.finish_odds(result), simulate.finish_odds(result, 3), simulate.expected_place(result)
+    print(f"{result['seasons']} seasons of {args.matches} matches")
+    print(f"{'':20} {'1st':>6} {'top 3':>6} {'place':>6} {'rating':>7}")
+    for i, pid in enumerate(result["ids"][:args.top]):
+        print(f"{names[pid][:20]:20} {first[pid]:6.1%} {podium[pid]:6.1%} {place[pid]:6.1f} {result['mean_rating'][i]:7.1f}")
+    rows = result["overtakes"] if args.overtake else result["overtakes"][:args.top - 1]
+    if rows:
+        print("Overtakes:")
+    for chaser, leader, p, median in rows:
+        when = f", median match {median}" if median is not None else ""
+        print(f"  {names[chaser]} passes {names[leader]}: {p:.1%}{when}")
+
+#endregion
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Manage the league from the command line.")
+    parser.add_argument("--db", default=main.DB, help="league database (default: %(default)s)")
+    parser.add_argument("--league", help="use the named league from the leagues directory instead of --db")
+    parser.add_argument("--stats", metavar="FILE", help="record timings and SQL counts and write them to FILE as JSON")
+    # commands work on the --db/--league database unless they set uses_db=False
+    parser.set_defaults(uses_db=True)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("init", aliases=["migrate"], help="create the --db database or upgrade its schema")
+    p.set_defaults(run=cmd_init, uses_db=False)
+
+    p = commands.add_parser("add-player", help="add a player and print their id")
+    p.add_argument("name")
+    p.add_argument("--full-name")
+    p.set_defaults(run=cmd_add_player)
+
+    p = commands.add_parser("record-match", help="record a match and print its id")
+    p.add_argument("date")
+    p.add_argument("--team1", required=True, help="comma-separated player names or ids")
+    p.add_argument("--team2", required=True, help="comma-separated player names or ids")
+    p.add_argument("--winner", type=int, choices=(1, 2), help="also set the result")
+    p.set_defaults(run=cmd_record_match)
+
+    p = commands.add_parser("set-result", help="set the winner of a recorded match")
+    p.add_argument("match_id", type=int)
+    p.add_argument("winner", type=int, choices=(1, 2))
+    p.set_defaults(run=cmd_set_result)
+
+    p = commands.add_parser("leaderboard", help="print players by rating")
+    p.add_argument("--limit", type=int)
+    p.add_argument("--json", action="store_true")
+    p.add_argument("--all-leagues", action="store_true", help="print every league's leaderboard")
+    p.add_argument("--workers", type=int, help="processes for --all-leagues")
+    p.set_defaults(run=cmd_leaderboard)
+
+    p = commands.add_parser("recompute", help="rebuild all ratings from the match history")
+    p.add_argument("--every", type=int, default=500, help="save a rating snapshot every N matches")
+    p.add_argument("--resume", action="store_true", help="continue from the latest snapshot")
+    p.add_argument("--dirty", action="store_true", help="only re-rate what edits to rated matches affected")
+    p.add_argument("--all-leagues", action="store_true", help="recompute every league in parallel")
+    p.add_argument("--workers", type=int, help="processes for --all-leagues")
+    p.set_defaults(run=cmd_recompute)
+
+    p = commands.add_parser("import", help="import matches from CSV or JSONL")
+    p.add_argument("path")
+    p.add_argument("--batch", type=int, default=5000, help="matches per transaction")
+    p.add_argument("--no-recompute", action="store_true", help="skip the rating replay after importing")
+    p.set_defaults(run=cmd_import)
+
+    p = commands.add_parser("export-columns", help="export the league as memory-mappable column files")
+    p.add_argument("path", help="directory to write")
+    p.set_defaults(run=cmd_export_columns)
+
+    p = commands.add_parser("import-leagues", help="import into several leagues in parallel")
+    p.add_argument("files", nargs="+", metavar="LEAGUE=PATH")
+    p.add_argument("--no-recompute", action="store_true", help="skip the rating replay after importing")
+    p.add_argument("--workers", type=int)
+    p.set_defaults(run=cmd_import_leagues, uses_db=False)
+
+    p = commands.add_parser("leagues", help="list the leagues; * marks the one in use")
+    p.set_defaults(run=cmd_leagues, uses_db=False)
+
+    p = commands.add_parser("create-league", help="create a league database and print its path")
+    p.add_argument("name")
+    p.set_defaults(run=cmd_create_league, uses_db=False)
+
+    p = commands.add_parser("export", help="export all matches to CSV or JSONL")
+    p.add_argument("path")
+    p.set_defaults(run=cmd_export)
+
+    p = commands.add_parser("record", help="print a player's record and who they played with and against")
+    p.add_argument("player", help="player name or id")
+    p.add_argument("--limit", type=int, default=10, help="teammates and opponents to list")
+    p.set_defaults(run=cmd_record)
+
+    p = commands.add_parser("rebuild-stats", help="recount win/loss stats from the match history")
+    p.add_argument("--check", action="store_true", help="only report rows that differ from a rebuild")
+    p.set_defaults(run=cmd_rebuild_stats)
+
+    p = commands.add_parser("period", help="show or set the league's rating period")
+    p.add_argument("period", nargs="?", help="day, week, a match count, or off; switching off rates anything queued")
+    p.set_defaults(run=cmd_period)
+
+    p = commands.add_parser("simulate", help="forecast the rest of the season by Monte Carlo")
+    p.add_argument("--seasons", type=int, default=10000)
+    p.add_argument("--matches", type=int, default=200, help="matches left in the season")
+    p.add_argument("--team-size", type=int, default=6)
+    p.add_argument("--players", help="comma-separated names or ids to draw teams from (default: everyone)")
+    p.add_argument("--overtake", nargs=2, action="append", default=[], metavar=("CHASER", "LEADER"),
+                   help="report the chance CHASER passes LEADER; repeatable")
+    p.add_argument("--top", type=int, default=10, help="players to list")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--workers", type=int, help="processes to use (default: one per CPU)")
+    p.set_defaults(run=cmd_simulate)
+    return parser
+
+def run(argv=None):
+    args = build_parser().parse_args(argv)
+    main.DB = args.db
+    # existing databases only, brought up to the current schema; `init`
+    # creates one
+    main.CREATE_MISSING = False
+    if args.stats:
+        instrument.enable()
+    try:
+        if args.league:
+            import leagues
+            leagues.use_league(args.league)
+        elif args.uses_db and not getattr(args, "all_leagues", False):
+            if not os.path.exists(args.db):
+                raise ValueError(f"no league database at {args.db}; create it with `init`")
+            from setup.db_setup import migrate
+            migrate(args.db)
+        args.run(args)
+    except (ValueError, OSError, sqlite3.Error) as e:
+        sys.exit(f"error: {e}")
+    finally:
+        main.close_connections()
+        if args.stats:
+            instrument.dump(args.stats)
+
+if __name__ == "__main__":
+    run()
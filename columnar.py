@@ -0,0 +1,162 @@
+import json
+import os
+from datetime import date
+
+import numpy as np
+
+import main
+from instrument import measured
+
+# A league flattened into one .npy file per column under a directory, so
+# every column can be memory-mapped and read without copying:
+#
+#   match_id (M,)            int64, matches in (date, id) order
+#   match_date (M,)          int32, days since 1970-01-01
+#   team_id (M, 2)           int64, team 1 is the lower team id
+#   roster (M, 2, W)         int64 player ids, padded with 0
+#   roster_size (M, 2)       int16
+#   winner (M,)              int8, 1 or 2, 0 while pending
+#   queued (M,)              bool, result waiting for its rating period
+#   player_id (P,)           int64, with rating/rd/vol (P,) float64
+#   history_player/history_match (H,) int64, history_before/after (H, 3)
+#
+# meta.json holds the counts and the schema version the export came from.
+
+EPOCH = date(1970, 1, 1).toordinal()
+CHUNK = 10000  # matches decoded per read in iter_results
+
+def to_day(iso_date):
+    return date.fromisoformat(iso_date).toordinal() - EPOCH
+
+def from_day(day):
+    return date.fromordinal(int(day) + EPOCH).isoformat()
+
+def _column(path, name, dtype, shape):
+    return np.lib.format.open_memmap(os.path.join(path, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape)
+
+#region EXPORT
+
+@measured
+def export_columns(path, conn=None):
+    # Write the snapshot directory. Rows are streamed straight into the
+    # memory-mapped columns, so the export never holds the league in memory.
+    # Every query reads the same snapshot: a write committed between the
+    # count and the rows would not fit the columns.
+    conn = conn or main.get_connection()
+    os.makedirs(path, exist_ok=True)
+    own = not conn.in_transaction
+    if own:
+        conn.execute("BEGIN")
+    try:
+        return _write_columns(path, conn)
+    finally:
+        if own:
+            conn.execute("COMMIT")
+
+def _write_columns(path, conn):
+    n_matches, width = conn.execute("""
+        SELECT (SELECT COUNT(*) FROM matches),
+               COALESCE((SELECT MAX(n) FROM (SELECT COUNT(*) AS n FROM team_players GROUP BY team_id)), 0)
+    """).fetchone()
+
+    match_id = _column(path, "match_id", np.int64, (n_matches,))
+    match_date = _column(path, "match_date", np.int32, (n_matches,))
+    team_id = _column(path, "team_id", np.int64, (n_matches, 2))
+    roster = _column(path, "roster", np.int64, (n_matches, 2, width))
+    roster_size = _column(path, "roster_size", np.int16, (n_matches, 2))
+    winner = _column(path, "winner", np.int8, (n_matches,))
+    queued = _column(path, "queued", np.bool_, (n_matches,))
+
+    pending = {mid for (mid,) in conn.execute("SELECT match_id FROM pending_results")}
+    rows = conn.execute("""
+        SELECT m.id, m.date, t.id, t.is_winner, tp.player_id
+        FROM matches m
+        LEFT JOIN teams t ON t.match_id = m.id
+        LEFT JOIN team_players tp ON tp.team_id = t.id
+        ORDER BY m.date, m.id, t.id, tp.player_id
+    """)
+    row_index, last_match, side, last_team = -1, None, -1, None
+    for mid, iso_date, tid, is_winner, pid in rows:
+        if mid != last_match:
+            row_index, last_match, side, last_team = row_index + 1, mid, -1, None
+            match_id[row_index], match_date[row_index] = mid, to_day(iso_date)
+            queued[row_index] = mid in pending
+        if tid is None:
+            continue
+        if tid != last_team:
+            side, last_team = side + 1, tid
+            if side > 1:
+                continue
+            team_id[row_index, side] = tid
+            if is_winner:
+                winner[row_index] = side + 1
+        if side > 1 or pid is None:
+            continue
+        roster[row_index, side, roster_size[row_index, side]] = pid
+        roster_size[row_index, side] += 1
+
+    players = np.array(conn.execute("SELECT id, rating, rd, vol FROM players ORDER BY id").fetchall(), dtype=float).reshape(-1, 4)
+    np.save(os.path.join(path, "player_id.npy"), players[:, 0].astype(np.int64))
+    for i, name in enumerate(("rating", "rd", "vol"), start=1):
+        np.save(os.path.join(path, f"{name}.npy"), players[:, i])
+
+    history = np.array(conn.execute("SELECT * FROM rating_history ORDER BY match_id, player_id").fetchall(), dtype=float).reshape(-1, 8)
+    np.save(os.path.join(path, "history_player.npy"), history[:, 0].astype(np.int64))
+    np.save(os.path.join(path, "history_match.npy"), history[:, 1].astype(np.int64))
+    np.save(os.path.join(path, "history_before.npy"), history[:, 2:5])
+    np.save(os.path.join(path, "history_after.npy"), history[:, 5:8])
+
+    for column in (match_id, match_date, team_id, roster, roster_size, winner, queued):
+        column.flush()
+    meta = {
+        "schema_version": conn.execute("PRAGMA user_version").fetchone()[0],
+        "matches": n_matches,
+        "players": len(players),
+        "history": len(history),
+        "roster_width": width,
+    }
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+#endregion
+
+#region READ
+
+def load_columns(path):
+    # {column: read-only memory-mapped array} plus "meta"
+    with open(os.path.join(path, "meta.json")) as f:
+        columns = {"meta": json.load(f)}
+    for name in os.listdir(path):
+        if name.endswith(".npy"):
+            columns[name[:-4]] = np.load(os.path.join(path, name), mmap_mode="r")
+    return columns
+
+def iter_results(columns, skip_queued=True):
+    # Decided matches as (match_id, date, winners, losers), the same stream
+    # replay.iter_results reads from SQLite. Rows are pulled from the mapped
+    # columns a chunk at a time.
+    decided = np.flatnonzero((columns["winner"] != 0) & ~(skip_queued & columns["queued"]))
+    for start in range(0, len(decided), CHUNK):
+        rows = decided[start:start + CHUNK]
+        ids = columns["match_id"][rows].tolist()
+        days = columns["match_date"][rows].tolist()
+        wins = (columns["winner"][rows] - 1).tolist()
+        rosters = columns["roster"][rows].tolist()
+        sizes = columns["roster_size"][rows].tolist()
+        for match_id, day, win, roster, size in zip(ids, days, wins, rosters, sizes):
+            winners, losers = roster[win][:size[win]], roster[1 - win][:size[1 - win]]
+            if winners and losers:
+                yield match_id, from_day(day), winners, losers
+
+@measured
+def replay_columns(columns, period=None):
+    # Every player's (rating, rd, vol) rebuilt from the snapshot alone, as
+    # replay.replay would compute them, without touching SQLite
+    from replay import rate_batches
+    state = {}
+    for _ in rate_batches(iter_results(columns, skip_queued=bool(period)), period, state):
+        pass
+    return state
+
+#endregion
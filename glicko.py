@@ -0,0 +1,210 @@
+import numpy as np
+
+import instrument
+from instrument import measured
+from main import TAU, from_mu, from_phi, to_mu, to_phi
+
+MAX_RD = 350.0
+VOL_TOL = 1e-6        # same convergence test as main._update_volatility
+VOL_MAX_ITER = 10000  # Illinois steps before giving up on a player
+VOL_MAX_BRACKET = 100 # tau steps searched for the lower bracket
+
+#region ARRAY GLICKO-2
+
+def g(phi):
+    return 1 / np.sqrt(1 + 3 * phi * phi / np.pi**2)
+
+
+def E(mu, mu_j, phi_j):
+    # exp overflowing to inf gives the right limit, 0
+    with np.errstate(over="ignore"):
+        return 1 / (1 + np.exp(-g(phi_j) * (mu - mu_j)))
+
+
+def expected_matrix(mu, phi):
+    # E[i, j]: expected score of player i against player j
+    return E(mu[:, None], mu[None, :], phi[None, :])
+
+
+def _f(x, delta, phi, v, a, tau):
+    exp_x = np.exp(x)
+    return exp_x * (delta**2 - phi**2 - v - exp_x) / (2 * (phi**2 + v + exp_x)**2) - (x - a) / tau**2
+
+
+def solve_volatility(delta, phi, sigma, v, tau=TAU, tol=VOL_TOL, max_iter=VOL_MAX_ITER):
+    # main._update_volatility (Glickman's Illinois iteration) for every player
+    # at once. Players whose bracket or iteration fails, or who hit max_iter,
+    # keep their current volatility. Returns (sigma', iterations, converged).
+    delta, phi, sigma, v = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (delta, phi, sigma, v)))
+    with np.errstate(all="ignore"):
+        a = np.log(sigma**2)
+        spread = delta**2 - phi**2 - v
+
+        # Lower bracket: log of the spread when positive, else step down by tau
+        # until f turns non-negative
+        A = a.copy()
+        B = np.log(np.where(spread > 0, spread, 1.0))
+        search = ~(spread > 0)
+        k = np.ones_like(a)
+        for _ in range(VOL_MAX_BRACKET):
+            if not search.any():
+                break
+            search &= _f(a - k * tau, delta, phi, v, a, tau) < 0
+            k += search
+        B = np.where(spread > 0, B, a - k * tau)
+        ok = ~search
+
+        fA = _f(A, delta, phi, v, a, tau)
+        fB = _f(B, delta, phi, v, a, tau)
+        iterations = np.zeros(a.shape, dtype=np.int64)
+        # Iterate on the still-open players only; most finish in a few steps
+        idx = np.flatnonzero(ok & (np.abs(B - A) > tol))
+        for _ in range(max_iter):
+            if not idx.size:
+                break
+            Ai, Bi, fAi, fBi = A[idx], B[idx], fA[idx], fB[idx]
+            C = Ai + (Ai - Bi) * fAi / (fBi - fAi)
+            fC = _f(C, delta[idx], phi[idx], v[idx], a[idx], tau)
+            swap = fC * fBi < 0
+            A[idx] = np.where(swap, Bi, Ai)
+            fA[idx] = np.where(swap, fBi, fAi / 2)
+            B[idx], fB[idx] = C, fC
+            iterations[idx] += 1
+            idx = idx[np.abs(C - A[idx]) > tol]
+        active = np.zeros(a.shape, dtype=bool)
+        active[idx] = True
+
+        converged = ok & ~active & np.isfinite(A) & np.isfinite(B)
+        sigma_prime = np.where(converged, np.exp(A / 2), sigma)
+    return sigma_prime, iterations, converged
+
+
+@measured
+def volatility(delta, phi, sigma, v, tau=TAU, tol=VOL_TOL, max_iter=VOL_MAX_ITER):
+    # solve_volatility with its counts recorded; returns (sigma', converged)
+    sigma_prime, iterations, converged = solve_volatility(delta, phi, sigma, v, tau, tol, max_iter)
+    instrument.count("volatility_solves", iterations.size)
+    instrument.count("volatility_iterations", int(iterations.sum()))
+    instrument.count("volatility_fallbacks", int(iterations.size - converged.sum()))
+    return sigma_prime, converged
+
+
+@measured
+def rate(mu, phi, sigma, opp_mu, opp_phi, scores, mask=None, tau=TAU):
+    # mu/phi/sigma are (N,), opponent arrays and scores broadcast to (N, K).
+    # mask zeroes out padding when players faced different numbers of opponents.
+    # Returns (mu', phi', sigma', kept): players whose v, delta or result is
+    # not finite, or whose volatility solve failed, keep all three values and
+    # are flagged in kept.
+    with np.errstate(all="ignore"):
+        g_j = g(opp_phi)
+        e = 1 / (1 + np.exp(-g_j * (mu[:, None] - opp_mu)))
+        if mask is not None:
+            g_j = g_j * mask
+        v = 1 / np.sum(g_j * g_j * e * (1 - e), axis=1)
+        delta_sum = np.sum(g_j * (scores - e), axis=1)
+        delta = v * delta_sum
+
+        sigma_prime, converged = volatility(delta, phi, sigma, v, tau)
+        phi_star = np.sqrt(phi**2 + sigma_prime**2)
+        phi_prime = 1 / np.sqrt(1 / phi_star**2 + 1 / v)
+        mu_prime = mu + phi_prime**2 * delta_sum
+
+    kept = ~(converged & np.isfinite(v) & np.isfinite(delta) & np.isfinite(mu_prime) & np.isfinite(phi_prime))
+    instrument.count("rating_fallbacks", int(kept.sum()))
+    return (np.where(kept, mu, mu_prime), np.where(kept, phi, phi_prime), np.where(kept, sigma, sigma_prime),
+            kept)
+
+
+def rate_teams(winners, losers, tau=TAU):
+    # winners/losers are (ratings, rds, vols) sequences. Every winner played
+    # every loser once, so one padded (W + L, K) matrix covers both sides.
+    # Returns (winners', losers', fallbacks), fallbacks counting the players
+    # rate() left unchanged.
+    w_mu, w_phi, w_sigma = _to_arrays(winners)
+    l_mu, l_phi, l_sigma = _to_arrays(losers)
+    n_w, n_l = len(w_mu), len(l_mu)
+    k = max(n_w, n_l)
+
+    opp_mu = np.zeros((n_w + n_l, k))
+    opp_phi = np.ones((n_w + n_l, k))
+    scores = np.zeros((n_w + n_l, k))
+    mask = np.zeros((n_w + n_l, k))
+    opp_mu[:n_w, :n_l], opp_phi[:n_w, :n_l] = l_mu, l_phi
+    scores[:n_w, :n_l] = mask[:n_w, :n_l] = 1
+    opp_mu[n_w:, :n_w], opp_phi[n_w:, :n_w] = w_mu, w_phi
+    mask[n_w:, :n_w] = 1
+
+    mu_p, phi_p, sigma_p, kept = rate(
+        np.concatenate([w_mu, l_mu]), np.concatenate([w_phi, l_phi]), np.concatenate([w_sigma, l_sigma]),
+        opp_mu, opp_phi, scores, mask, tau,
+    )
+    rating, rd = from_mu(mu_p), from_phi(phi_p)
+    return (rating[:n_w], rd[:n_w], sigma_p[:n_w]), (rating[n_w:], rd[n_w:], sigma_p[n_w:]), int(kept.sum())
+
+
+@measured
+def rate_match(players, winners, losers, tau=TAU):
+    # players maps id -> (rating, rd, vol); returns the same shape for everyone
+    # who played, and how many of them kept their old values (see rate). A
+    # player listed on both sides keeps the winner's result.
+    new_winners, new_losers, fallbacks = rate_teams(
+        zip(*(players[pid] for pid in winners)),
+        zip(*(players[pid] for pid in losers)),
+        tau,
+    )
+    result = {}
+    for pids, (ratings, rds, vols) in ((losers, new_losers), (winners, new_winners)):
+        for pid, r, rd, vol in zip(pids, ratings.tolist(), rds.tolist(), vols.tolist()):
+            result[pid] = (r, rd, vol)
+    return result, fallbacks
+
+
+@measured
+def rate_period(players, results, tau=TAU):
+    # results is a list of (winners, losers) from one rating period. Everyone
+    # who played is rated once, from their pre-period rating, against every
+    # opponent they faced in the period. Returns the new ratings as rate_match
+    # does, with the fallback count.
+    games = {}
+    for winners, losers in results:
+        for pid in losers:
+            if pid not in winners:
+                games.setdefault(pid, []).extend((opp, 0) for opp in winners)
+        for pid in winners:
+            games.setdefault(pid, []).extend((opp, 1) for opp in losers)
+    if not games:
+        return {}, 0
+
+    index = {pid: i for i, pid in enumerate(players)}
+    base = np.array([players[pid] for pid in index], dtype=float)
+    mu_all, phi_all = to_mu(base[:, 0]), to_phi(base[:, 1])
+
+    active = list(games)
+    k = max(len(played) for played in games.values())
+    opp_idx = np.zeros((len(active), k), dtype=int)
+    scores = np.zeros((len(active), k))
+    mask = np.zeros((len(active), k))
+    for row, pid in enumerate(active):
+        n = len(games[pid])
+        opp_idx[row, :n] = [index[opp] for opp, _ in games[pid]]
+        scores[row, :n] = [score for _, score in games[pid]]
+        mask[row, :n] = 1
+
+    rows = [index[pid] for pid in active]
+    mu_p, phi_p, sigma_p, kept = rate(
+        mu_all[rows], phi_all[rows], base[rows, 2], mu_all[opp_idx], phi_all[opp_idx], scores, mask, tau
+    )
+    return dict(zip(active, zip(from_mu(mu_p).tolist(), from_phi(phi_p).tolist(), sigma_p.tolist()))), int(kept.sum())
+
+
+def inflate_rd(rd, vol):
+    # RD growth for a player who sat out a rating period, capped at the starting RD
+    return np.minimum(from_phi(np.sqrt(to_phi(np.asarray(rd, dtype=float))**2 + np.asarray(vol, dtype=float)**2)), MAX_RD)
+
+
+def _to_arrays(side):
+    rating, rd, vol = (np.asarray(col, dtype=float) for col in side)
+    return to_mu(rating), to_phi(rd), vol
+
+#endregion
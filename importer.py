@@ -0,0 +1,168 @@
+import argparse
+import csv
+import json
+from itertools import groupby, islice
+
+import main
+import stats
+from instrument import measured
+
+BATCH_SIZE = 5000
+ROSTER_SEPARATOR = ";"
+
+#region READERS
+
+def _names(value):
+    if isinstance(value, str):
+        value = value.split(ROSTER_SEPARATOR)
+    return [name.strip() for name in value if name and name.strip()]
+
+def _winner(value):
+    value = str(value).strip().lower() if value is not None else ""
+    if value in ("", "none", "null", "pending"):
+        return None
+    if value in ("1", "team1", "team 1"):
+        return 1
+    if value in ("2", "team2", "team 2"):
+        return 2
+    raise ValueError(f"unknown winner {value!r}")
+
+def read_matches(path):
+    # Stream (date, team1 names, team2 names, winner) from a CSV file with
+    # date/team1/team2/winner columns (rosters separated by ';') or from JSONL
+    # objects with the same keys (rosters as lists).
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for line, row in enumerate(rows, start=1):
+            try:
+                team1, team2 = _names(row["team1"]), _names(row["team2"])
+                main.check_rosters(team1, team2)
+                yield main.check_date(row["date"]), team1, team2, _winner(row.get("winner"))
+            except (KeyError, ValueError) as e:
+                raise ValueError(f"{path}: match {line}: {e}") from None
+
+#endregion
+
+#region IMPORT
+
+def _next_id(conn, table):
+    # Ids are assigned up front so a whole chunk can go in with executemany.
+    # Safe because the chunk runs inside a write transaction.
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    top, = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()
+    return max(top, seq[0] if seq else 0) + 1
+
+def _insert_chunk(conn, chunk, ids, stale):
+    next_player = _next_id(conn, "players")
+    next_match = _next_id(conn, "matches")
+    next_team = _next_id(conn, "teams")
+
+    new_players, matches, teams, roster, results = [], [], [], [], []
+    for match_date, team1, team2, winner in chunk:
+        match_id, next_match = next_match, next_match + 1
+        matches.append((match_id, match_date))
+        sides = {}
+        for side, names in ((1, team1), (2, team2)):
+            team_id, next_team = next_team, next_team + 1
+            teams.append((team_id, match_id, None if winner is None else int(winner == side)))
+            sides[side] = []
+            for name in names:
+                pid = ids.get(name)
+                if pid is None:
+                    pid = ids[name] = next_player
+                    next_player += 1
+                    # same defaults as add_player: full name falls back to name
+                    new_players.append((pid, name, name))
+                roster.append((team_id, pid))
+                sides[side].append(pid)
+        if winner is not None:
+            results.append((match_id, match_date, sides[winner], sides[3 - winner]))
+
+    conn.executemany("INSERT INTO players (id, name, full_name) VALUES (?, ?, ?)", new_players)
+    conn.executemany("INSERT INTO matches (id, date) VALUES (?, ?)", matches)
+    conn.executemany("INSERT INTO teams (id, match_id, is_winner) VALUES (?, ?, ?)", teams)
+    conn.executemany("INSERT OR IGNORE INTO team_players (team_id, player_id) VALUES (?, ?)", roster)
+    stats.add_results(conn.cursor(), results, stale)
+    if new_players:
+        main.on_commit(conn, lambda path=main.DB: main.invalidate_player_cache(path))
+        main.on_commit(conn, lambda path=main.DB: main.invalidate_search_index(path))
+    return len(new_players)
+
+@measured
+def import_matches(path, batch_size=BATCH_SIZE, recompute=True, conn=None):
+    # Each chunk of batch_size matches is its own transaction, so memory stays
+    # flat however large the file is. Ratings are rebuilt once at the end, and
+    # so are the streaks of players with results out of date order, which
+    # would otherwise be re-read from their whole history chunk after chunk.
+    conn = conn or main.get_connection()
+    ids = {name: pid for pid, name in conn.execute("SELECT id, name FROM players")}
+
+    matches = players = 0
+    stale = set()
+    rows = read_matches(path)
+    while chunk := list(islice(rows, batch_size)):
+        with main.transaction(conn):
+            players += _insert_chunk(conn, chunk, ids, stale)
+        matches += len(chunk)
+    if stale:
+        with main.transaction(conn):
+            stats.reread_streaks(conn.cursor(), stale)
+
+    if recompute and matches:
+        import replay
+        replay.replay(conn=conn)
+    return matches, players
+
+#endregion
+
+#region EXPORT
+
+def iter_matches(conn=None):
+    # (date, team1 names, team2 names, winner) for every match in (date, id)
+    # order, the shape read_matches yields
+    conn = conn or main.get_connection()
+    rows = conn.execute("""
+        SELECT m.id, m.date, t.id, t.is_winner, p.name
+        FROM matches m
+        JOIN teams t ON t.match_id = m.id
+        LEFT JOIN team_players tp ON tp.team_id = t.id
+        LEFT JOIN players p ON p.id = tp.player_id
+        ORDER BY m.date, m.id, t.id, p.name
+    """)
+    for (_, match_date), match_rows in groupby(rows, key=lambda row: row[:2]):
+        teams = [
+            (is_winner, [row[4] for row in team_rows if row[4] is not None])
+            for (_, is_winner), team_rows in groupby(match_rows, key=lambda row: (row[2], row[3]))
+        ]
+        (won1, team1), (won2, team2) = (teams + [(None, [])] * 2)[:2]
+        yield match_date, team1, team2, 1 if won1 else 2 if won2 else None
+
+@measured
+def export_matches(path, conn=None):
+    # Write every match to CSV or JSONL (by extension) in the format
+    # import_matches reads back. Returns the number of matches written.
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for count, (match_date, team1, team2, winner) in enumerate(iter_matches(conn), start=1):
+                f.write(json.dumps({"date": match_date, "team1": team1, "team2": team2, "winner": winner}) + "\n")
+        else:
+            writer = csv.writer(f)
+            writer.writerow(["date", "team1", "team2", "winner"])
+            for count, (match_date, team1, team2, winner) in enumerate(iter_matches(conn), start=1):
+                writer.writerow([match_date, ROSTER_SEPARATOR.join(team1), ROSTER_SEPARATOR.join(team2), winner or ""])
+    return count
+
+#endregion
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import matches from a CSV or JSONL file.")
+    parser.add_argument("path")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="matches per transaction")
+    parser.add_argument("--no-recompute", action="store_true", help="skip the rating replay after importing")
+    args = parser.parse_args()
+    matches, players = import_matches(args.path, args.batch, not args.no_recompute)
+    print(f"Imported {matches} matches and {players} new players.")
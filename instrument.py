@@ -0,0 +1,190 @@
+import atexit
+import functools
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+# Opt-in instrumentation for main.py and the rating engine. Off by default;
+# turn it on with enable(), or set LEAGUE_INSTRUMENT=stats.json to record a
+# whole run (the UI included) and write the stats there on exit. While off, a
+# measured function costs one global check on top of the call.
+
+enabled = False
+active = False  # set once enabled, so connections can be unhooked after disable()
+
+TOP_STATEMENTS = 5
+
+_lock = threading.Lock()
+_local = threading.local()
+_ops = {}
+_counters = Counter()
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?(?:e[-+]?\d+)?\b", re.IGNORECASE)
+
+#region RECORDING
+
+def _new_op():
+    return {"calls": 0, "errors": 0, "total_s": 0.0, "max_s": 0.0, "histogram": Counter(),
+            "sql": 0, "rows_read": 0, "rows_written": 0, "statements": Counter()}
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+def _changes():
+    return sum(conn.total_changes for conn in getattr(_local, "conns", {}).values())
+
+def measured(fn=None, name=None):
+    # Decorator recording calls, latency, SQL statements and rows for a
+    # function. Counts are inclusive: a statement run inside update_glicko2
+    # called from set_match_result is counted for both.
+    if fn is None:
+        return lambda fn: measured(fn, name)
+    key = name or f"{fn.__module__}.{fn.__qualname__}"
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return fn(*args, **kwargs)
+        return _call(key, fn, args, kwargs)
+    return wrapper
+
+def _call(key, fn, args, kwargs):
+    frame = {"sql": 0, "rows_read": 0, "statements": Counter()}
+    stack = _stack()
+    stack.append(frame)
+    changes = _changes()
+    error = False
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    except BaseException:
+        error = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        _add(key, elapsed, error, frame, _changes() - changes)
+
+def _add(key, elapsed, error=False, frame=None, written=0):
+    with _lock:
+        op = _ops.get(key)
+        if op is None:
+            op = _ops[key] = _new_op()
+        op["calls"] += 1
+        op["errors"] += error
+        op["total_s"] += elapsed
+        op["max_s"] = max(op["max_s"], elapsed)
+        # log2 buckets in microseconds: bucket b holds calls under 2**b us
+        op["histogram"][int(elapsed * 1e6).bit_length()] += 1
+        op["rows_written"] += written
+        if frame is not None:
+            op["sql"] += frame["sql"]
+            op["rows_read"] += frame["rows_read"]
+            op["statements"].update(frame["statements"])
+
+def record(name, seconds):
+    # A duration timed by the caller, e.g. the UI's startup, reported like
+    # a measured function
+    if enabled:
+        _add(name, seconds)
+
+def count(name, n=1):
+    # Free-form counters, e.g. volatility solver iterations
+    if enabled:
+        with _lock:
+            _counters[name] += n
+
+#endregion
+
+#region SQLITE HOOKS
+
+def _on_sql(statement):
+    stack = getattr(_local, "stack", None)
+    if not enabled or not stack:
+        return
+    statement = _literals.sub("?", statement)
+    for frame in stack:
+        frame["sql"] += 1
+        frame["statements"][statement] += 1
+
+def _on_row(cursor, row):
+    stack = getattr(_local, "stack", None)
+    if enabled and stack:
+        for frame in stack:
+            frame["rows_read"] += 1
+    return row
+
+def watch(conn):
+    # Called by main.get_connection while instrumentation is or was on. Hooks
+    # the connection's statement trace and row factory, or unhooks them
+    # after disable().
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    if enabled and id(conn) not in conns:
+        conn.set_trace_callback(_on_sql)
+        conn.row_factory = _on_row
+        conns[id(conn)] = conn
+    elif not enabled and id(conn) in conns:
+        forget(conn)
+        conn.set_trace_callback(None)
+        conn.row_factory = None
+
+def forget(conn):
+    # Stop counting a connection's writes, e.g. before it is closed
+    getattr(_local, "conns", {}).pop(id(conn), None)
+
+#endregion
+
+#region STATS API
+
+def enable():
+    global enabled, active
+    enabled = active = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    with _lock:
+        _ops.clear()
+        _counters.clear()
+
+def stats():
+    # Snapshot of everything recorded so far, ready for json.dump
+    with _lock:
+        ops = {}
+        for key, op in sorted(_ops.items()):
+            calls = op["calls"]
+            ops[key] = {
+                "calls": calls,
+                "errors": op["errors"],
+                "total_ms": 1000 * op["total_s"],
+                "mean_ms": 1000 * op["total_s"] / calls,
+                "max_ms": 1000 * op["max_s"],
+                "histogram_us": {f"<{2 ** b}": n for b, n in sorted(op["histogram"].items())},
+                "sql": op["sql"],
+                "sql_per_call": op["sql"] / calls,
+                "rows_read": op["rows_read"],
+                "rows_written": op["rows_written"],
+                "top_statements": [
+                    {"sql": sql, "count": n} for sql, n in op["statements"].most_common(TOP_STATEMENTS)
+                ],
+            }
+        return {"operations": ops, "counters": dict(_counters)}
+
+def dump(path):
+    with open(path, "w") as f:
+        json.dump(stats(), f, indent=2)
+
+#endregion
+
+if os.environ.get("LEAGUE_INSTRUMENT"):
+    enable()
+    atexit.register(dump, os.environ["LEAGUE_INSTRUMENT"])
@@ -0,0 +1,103 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import main
+from setup.db_setup import create_db, migrate
+
+# Each league is its own SQLite file, LEAGUES_DIR/<name>.db. use_league()
+# points main.DB at one; jobs across leagues run one process per league.
+# DEFAULT_DB is the database in use before any switch (LEAGUE_DB or
+# league.db), which use_default() goes back to.
+LEAGUES_DIR = os.environ.get("LEAGUES_DIR", "leagues")
+DEFAULT_DB = main.DB
+
+#region LEAGUES
+
+def league_path(name):
+    if not name or os.sep in name or name.startswith("."):
+        raise ValueError(f"bad league name {name!r}")
+    return os.path.join(LEAGUES_DIR, f"{name}.db")
+
+def list_leagues():
+    if not os.path.isdir(LEAGUES_DIR):
+        return []
+    return sorted(f[:-3] for f in os.listdir(LEAGUES_DIR) if f.endswith(".db"))
+
+def create_league(name):
+    path = league_path(name)
+    if os.path.exists(path):
+        raise ValueError(f"league {name!r} already exists")
+    os.makedirs(LEAGUES_DIR, exist_ok=True)
+    create_db(path)
+    return path
+
+def use_league(name):
+    # Make `name` the league every main.py call defaults to. Connections and
+    # caches are per file, so switching back and forth is cheap.
+    path = league_path(name)
+    if not os.path.exists(path):
+        raise ValueError(f"unknown league {name!r}")
+    migrate(path)
+    main.DB = path
+    return path
+
+def use_default():
+    migrate(DEFAULT_DB)
+    main.DB = DEFAULT_DB
+    return DEFAULT_DB
+
+def current_league():
+    if os.path.dirname(os.path.abspath(main.DB)) != os.path.abspath(LEAGUES_DIR):
+        return None
+    return os.path.basename(main.DB)[:-3]
+
+#endregion
+
+#region JOBS
+
+def _recompute():
+    import replay
+    return replay.replay()
+
+def _leaderboard(limit=None):
+    return main.get_leaderboard()[:limit]
+
+def _import(path, recompute=True):
+    import importer
+    return importer.import_matches(path, recompute=recompute)
+
+JOBS = {"recompute": _recompute, "leaderboard": _leaderboard, "import": _import}
+
+def _run(task):
+    path, job, args = task
+    migrate(path)
+    main.DB = path
+    try:
+        return JOBS[job](*args)
+    finally:
+        main.close_connections()
+
+def process_pool(workers):
+    # The process pool every parallel job uses. Workers are spawned rather
+    # than forked so no SQLite connection or Tk state crosses into them.
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+def run_jobs(tasks, workers=None):
+    # tasks are (league, job, args) with job a JOBS key; results come back in
+    # task order. Leagues are separate files, so their writers never contend.
+    tasks = [(league_path(name), job, tuple(args)) for name, job, args in tasks]
+    missing = [path for path, _, _ in tasks if not os.path.exists(path)]
+    if missing:
+        raise ValueError(f"unknown leagues: {missing}")
+    if not tasks:
+        return []
+    with process_pool(min(workers or os.cpu_count() or 1, len(tasks))) as pool:
+        return list(pool.map(_run, tasks))
+
+def run_all(job, *args, leagues=None, workers=None):
+    # The same job on every league (or the named ones): {league: result}
+    leagues = list(leagues or list_leagues())
+    return dict(zip(leagues, run_jobs([(name, job, args) for name in leagues], workers)))
+
+#endregion
@@ -1,56 +1,487 @@
+import datetime
+import itertools
 import math
+import os
+import pathlib
 import sqlite3
+import threading
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+
+import instrument
+from instrument import measured
+from search import PlayerIndex
+
+# The database every call uses unless given a connection. LEAGUE_DB sets the
+# default; leagues.use_league() switches it at run time.
+DB = os.environ.get("LEAGUE_DB", "league.db")
+
+# Whether get_connection may create a missing database file. The CLI turns
+# this off so a mistyped --db is an error rather than an empty league.
+CREATE_MISSING = True
+
+# Editing the roster or result of a match that was already rated re-rates the
+# matches it affects straight away. With False the edits are only marked and
+# wait for recompute.recompute_dirty().
+AUTO_RECOMPUTE = True
+
+#region CONNECTIONS
+
+_local = threading.local()
+
+def get_connection(path=None):
+    # One connection per thread per database file, reused across calls.
+    # Autocommit mode: writes go through transaction() below.
+    path = path or DB
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        if CREATE_MISSING:
+            conn = sqlite3.connect(path, isolation_level=None, timeout=30)
+        else:
+            uri = pathlib.Path(path).resolve().as_uri() + "?mode=rw"
+            conn = sqlite3.connect(uri, uri=True, isolation_level=None, timeout=30)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        conns[path] = conn
+    if instrument.active:
+        instrument.watch(conn)
+    return conn
+
+def _path_of(conn):
+    for path, cached in getattr(_local, "conns", {}).items():
+        if cached is conn:
+            return path
+    return DB
+
+def close_connections():
+    # Close this thread's cached connections
+    for conn in getattr(_local, "conns", {}).values():
+        instrument.forget(conn)
+        conn.close()
+    _local.conns = {}
+
+# Held from COMMIT until the commit callbacks have run, so this process's
+# caches see its writes in the order they committed
+_commit_lock = threading.Lock()
+
+@contextmanager
+def transaction(conn=None):
+    # Unit of work: commits on success, rolls back on error. Nested calls on
+    # the same connection become savepoints inside the outer transaction.
+    # A transaction that changed anything also moves the league's write
+    # generation on (see write_generation).
+    conn = conn or get_connection()
+    callbacks = _commit_callbacks(conn)
+    if conn.in_transaction:
+        mark = len(callbacks)
+        conn.execute("SAVEPOINT unit_of_work")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK TO unit_of_work")
+            conn.execute("RELEASE unit_of_work")
+            del callbacks[mark:]
+            raise
+        conn.execute("RELEASE unit_of_work")
+    else:
+        conn.execute("BEGIN IMMEDIATE")
+        changes = conn.total_changes
+        try:
+            yield conn
+            generation = _next_generation(conn) if conn.total_changes != changes else None
+        except BaseException:
+            conn.execute("ROLLBACK")
+            callbacks.clear()
+            raise
+        with _commit_lock:
+            conn.execute("COMMIT")
+            pending = callbacks[:]
+            callbacks.clear()
+            if generation is not None:
+                _cache_committed(_path_of(conn), generation)
+            for callback in pending:
+                callback()
+
+def on_commit(conn, callback):
+    # Run callback once the transaction open on conn commits; dropped on rollback
+    if conn.in_transaction:
+        _commit_callbacks(conn).append(callback)
+    else:
+        callback()
+
+def _commit_callbacks(conn):
+    callbacks = getattr(_local, "callbacks", None)
+    if callbacks is None:
+        callbacks = _local.callbacks = {}
+    return callbacks.setdefault(conn, [])
+
+def write_generation(conn=None):
+    # A counter in the database bumped by every transaction that changes the
+    # league, in any process; caches are only served while it matches
+    conn = conn or get_connection()
+    row = conn.execute("SELECT value FROM settings WHERE key = 'generation'").fetchone()
+    return int(row[0]) if row else 0
+
+def _next_generation(conn):
+    value, = conn.execute("""
+        INSERT INTO settings (key, value) VALUES ('generation', 1)
+        ON CONFLICT (key) DO UPDATE SET value = value + 1
+        RETURNING value
+    """).fetchone()
+    return int(value)
+
+#endregion
+
+#region SETTINGS
+
+# League-wide options live in the settings table, so the UI, the CLI and the
+# server all rate a league the same way.
+
+def get_setting(key, default=None, conn=None):
+    conn = conn or get_connection()
+    row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+    return default if row is None or row[0] is None else row[0]
+
+def set_setting(key, value, conn=None):
+    with transaction(conn) as conn:
+        conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                     (key, None if value is None else str(value)))
+
+def parse_rating_period(value):
+    # "day", "week" or a match count; None, "" or "off" for per-match rating
+    if value is None or str(value).strip().lower() in ("", "off", "none"):
+        return None
+    value = str(value).strip().lower()
+    if value in ("day", "week"):
+        return value
+    if value.isdigit() and int(value) > 0:
+        return int(value)
+    raise ValueError(f"rating period must be day, week, a match count or off, not {value!r}")
+
+def get_rating_period(conn=None):
+    # None rates each match as soon as its result is set. "day", "week" or a
+    # match count queues results and rates them together when the period closes.
+    return parse_rating_period(get_setting("rating_period", conn=conn))
+
+@measured
+def set_rating_period(period, conn=None):
+    # Switching to per-match rating first rates whatever is still queued, so
+    # no result is left waiting for a period that will never close. Ratings
+    # already applied stay; a replay re-rates all history the new way.
+    period = parse_rating_period(period)
+    with transaction(conn) as conn:
+        if period is None:
+            import periods
+            periods.close_periods(conn.cursor())
+        set_setting("rating_period", period, conn)
+    return period
+
+#endregion
+
+#region PLAYER CACHE
+
+# Per database file: rows by id plus name- and rating-sorted keys, kept up to
+# date after each commit. Every change gets a new version number.
+#
+# A cache belongs to one write generation. This process's commits move it to
+# the next one and apply their changes (write-through); a read that finds the
+# database at any other generation, because another process wrote to it,
+# reloads.
+_player_cache = {}
+_cache_lock = threading.Lock()
+_cache_versions = itertools.count(1)
+
+def _load_player_cache(conn=None):
+    path = DB
+    conn = conn or get_connection()
+    with _cache_lock:
+        cache = _player_cache.get(path)
+        if cache is not None and cache["generation"] == write_generation(conn):
+            return cache
+
+        # generation and rows from one snapshot; inside a caller's write
+        # transaction they may include uncommitted changes, so that load
+        # serves this call only
+        own = not conn.in_transaction
+        if own:
+            conn.execute("BEGIN")
+        try:
+            generation = write_generation(conn)
+            rows = conn.execute("SELECT id, name, rating FROM players").fetchall()
+        finally:
+            if own:
+                conn.execute("COMMIT")
+        cache = {
+            "version": next(_cache_versions),
+            "generation": generation,
+            "rows": {row[0]: row for row in rows},
+            "by_name": sorted((name, pid) for pid, name, _ in rows),
+            "by_rating": sorted((-rating, pid) for pid, _, rating in rows),
+            "lists": {},
+        }
+        if own:
+            _player_cache[path] = cache
+        return cache
+
+def _cache_committed(path, generation):
+    # Runs at COMMIT, before that transaction's callbacks update the cache.
+    # A cache one generation behind is exactly the state they apply to;
+    # any other has missed a write and is dropped.
+    with _cache_lock:
+        cache = _player_cache.get(path)
+        if cache is None:
+            return
+        if cache["generation"] == generation - 1:
+            cache["generation"] = generation
+        else:
+            del _player_cache[path]
+
+def _cached_list(key, conn=None):
+    cache = _load_player_cache(conn)
+    with _cache_lock:
+        rows = cache["lists"].get(key)
+        if rows is None:
+            rows = cache["lists"][key] = [cache["rows"][pid] for _, pid in cache[key]]
+        return cache["version"], rows
+
+def _touch(cache):
+    cache["version"] = next(_cache_versions)
+    cache["lists"] = {}
+
+def _cache_add_player(path, row):
+    with _cache_lock:
+        cache = _player_cache.get(path)
+        if cache is None:
+            return
+        pid, name, rating = row
+        cache["rows"][pid] = row
+        insort(cache["by_name"], (name, pid))
+        insort(cache["by_rating"], (-rating, pid))
+        _touch(cache)
+
+def _cache_set_ratings(path, ratings):
+    with _cache_lock:
+        cache = _player_cache.get(path)
+        if cache is None:
+            return
+        by_rating = cache["by_rating"]
+        for pid, rating in ratings.items():
+            old = cache["rows"].get(pid)
+            if old is None:
+                del _player_cache[path]
+                return
+            del by_rating[bisect_left(by_rating, (-old[2], pid))]
+            insort(by_rating, (-rating, pid))
+            cache["rows"][pid] = (pid, old[1], rating)
+        _touch(cache)
+
+def _cache_touch(path):
+    with _cache_lock:
+        cache = _player_cache.get(path)
+        if cache is not None:
+            _touch(cache)
+
+def invalidate_player_cache(path=None):
+    # For bulk writers (replay, import, rating periods): reload on next read
+    with _cache_lock:
+        _player_cache.pop(path or DB, None)
+
+def player_cache_version(conn=None):
+    # Changes with every player, rating or roster change; cheap to poll
+    return _load_player_cache(conn)["version"]
 
-DB = "league.db"
+#endregion
+
+#region PLAYER SEARCH
+
+# Per database file: a search.PlayerIndex over names and full names, with
+# the write generation it has caught up to and the highest id read for it
+# from the database (PlayerIndex.add skips players it already has). Names
+# change far less often than ratings, so the index lives apart from the
+# player cache and outlasts its invalidations: add_player extends it in
+# place, players other processes add are indexed at the next search after
+# their commit, and bulk imports drop it. Building one takes seconds on a
+# large league, so warm_search_index() starts that when a league opens.
+_search_indexes = {}
+_search_locks = {}
+# Held while an index is searched or extended; apart from _cache_lock, so a
+# search does not hold up reads of the player cache
+_search_index_lock = threading.Lock()
+
+def _load_search_index(conn=None, path=None):
+    path = path or DB
+    conn = conn or get_connection(path)
+    with _cache_lock:
+        lock = _search_locks.setdefault(path, threading.Lock())
+    # one build per file: a search during warm_search_index waits for it
+    with lock:
+        entry = _search_indexes.get(path)
+        if entry is not None and entry["generation"] == write_generation(conn):
+            return entry["index"]
+        own = not conn.in_transaction
+        if own:
+            conn.execute("BEGIN")
+        try:
+            generation = write_generation(conn)
+            after = entry["last"] if entry is not None else 0
+            rows = conn.execute(
+                "SELECT id, name, full_name FROM players WHERE id > ? ORDER BY id", (after,)
+            ).fetchall()
+        finally:
+            if own:
+                conn.execute("COMMIT")
+        if entry is None:
+            entry = {"index": PlayerIndex(rows), "generation": generation, "last": rows[-1][0] if rows else 0}
+            with _cache_lock:
+                _search_indexes[path] = entry
+        else:
+            with _search_index_lock:
+                for row in rows:
+                    entry["index"].add(*row)
+                entry["last"] = max(entry["last"], rows[-1][0] if rows else 0)
+                entry["generation"] = generation
+        return entry["index"]
+
+def warm_search_index(path=None):
+    # Build the index for `path` (default: the current league) on a
+    # background thread, so the first keystroke in a picker finds it ready
+    path = path or DB
+
+    def build():
+        try:
+            _load_search_index(path=path)
+        except sqlite3.Error:
+            pass  # the first search reports it
+        finally:
+            close_connections()
+
+    threading.Thread(target=build, name="search-index", daemon=True).start()
+
+def _search_add_player(path, pid, name, full_name):
+    with _cache_lock:
+        entry = _search_indexes.get(path)
+    if entry is not None:
+        with _search_index_lock:
+            entry["index"].add(pid, name, full_name)
+
+def invalidate_search_index(path=None):
+    with _cache_lock:
+        _search_indexes.pop(path or DB, None)
+
+@measured
+def search_players(query, limit=50, conn=None):
+    # (id, name, rating) for players matching `query` by prefix, substring or
+    # near spelling of their name or full name, best match first. A blank
+    # query lists everyone by name, like get_players().
+    if not query.strip():
+        return get_players(conn)
+    index = _load_search_index(conn)
+    with _search_index_lock:
+        pids = index.search(query, limit)
+    rows = _load_player_cache(conn)["rows"]
+    return [rows[pid] for pid in pids if pid in rows]
+
+#endregion
 
 #region PLAYER FUNCTIONS
 
-def add_player(name, full_name=None):
+@measured
+def add_player(name, full_name=None, conn=None):
     full = full_name if full_name else name
-    with sqlite3.connect(DB) as conn:
-        conn.execute(
+    with transaction(conn) as conn:
+        cur = conn.execute(
             "INSERT INTO players (name, full_name) VALUES (?, ?)",
             (name, full)
         )
-
-def get_players():
-    with sqlite3.connect(DB) as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT id, name, rating FROM players ORDER BY name")
-        return cur.fetchall()
+        pid = cur.lastrowid
+        rating, = conn.execute("SELECT rating FROM players WHERE id = ?", (pid,)).fetchone()
+        on_commit(conn, lambda path=DB: _cache_add_player(path, (pid, name, rating)))
+        on_commit(conn, lambda path=DB: _search_add_player(path, pid, name, full))
+        return pid
+
+@measured
+def get_players(conn=None):
+    # (id, name, rating) ordered by name, served from the player cache
+    return list(_cached_list("by_name", conn)[1])
+
+@measured
+def get_leaderboard(conn=None):
+    # (id, name, rating) ordered by rating, highest first
+    return list(_cached_list("by_rating", conn)[1])
+
+@measured
+def get_leaderboard_snapshot(since=None, conn=None):
+    # (version, rows). rows is None when nothing changed since version `since`,
+    # so a view can skip redrawing.
+    version, rows = _cached_list("by_rating", conn)
+    return version, (None if version == since else list(rows))
+
+@measured
+def get_player_names(player_ids, conn=None):
+    rows = _load_player_cache(conn)["rows"]
+    return [rows[pid][1] for pid in player_ids if pid in rows]
 #endregion
 
 #region MATCH + TEAM CREATION
 
-def create_match(date):
-    with sqlite3.connect(DB) as conn:
-        cur = conn.cursor()
-        cur.execute("INSERT INTO matches (date) VALUES (?)", (date,))
+@measured
+def create_match(date, conn=None):
+    date = check_date(date)
+    with transaction(conn) as conn:
+        cur = conn.execute("INSERT INTO matches (date) VALUES (?)", (date,))
         return cur.lastrowid
 
-def create_team(match_id, is_winner):
-    with sqlite3.connect(DB) as conn:
-        cur = conn.cursor()
-        cur.execute(
+@measured
+def create_team(match_id, is_winner, conn=None):
+    with transaction(conn) as conn:
+        cur = conn.execute(
             "INSERT INTO teams (match_id, is_winner) VALUES (?, ?)",
             (match_id, is_winner)
         )
         return cur.lastrowid
 
-def add_player_to_team(team_id, player_id):
-    with sqlite3.connect(DB) as conn:
+@measured
+def add_player_to_team(team_id, player_id, conn=None):
+    with transaction(conn) as conn:
         conn.execute(
             "INSERT OR IGNORE INTO team_players (team_id, player_id) VALUES (?, ?)",
             (team_id, player_id)
         )
 
-def set_match_result(match_id, winning_team_id):
-    with sqlite3.connect(DB) as conn:
+@measured
+def set_match_result(match_id, winning_team_id, conn=None):
+    with transaction(conn) as conn:
         cur = conn.cursor()
+        import recompute
+        import stats
+        rated = recompute.is_rated(cur, match_id)
+        if rated and cur.execute("SELECT is_winner FROM teams WHERE id = ?", (winning_team_id,)).fetchone() == (1,):
+            return  # same result again: already applied
+        counted = stats.before(cur, match_id)
         # mark winner
         cur.execute("UPDATE teams SET is_winner = 1 WHERE id = ?", (winning_team_id,))
         # mark loser
         cur.execute("UPDATE teams SET is_winner = 0 WHERE match_id = ? AND id != ?", (match_id, winning_team_id))
+        if stats.update(cur, match_id, counted):
+            on_commit(conn, lambda path=DB: _cache_touch(path))
+
+        # A changed result undoes the old rating update rather than stacking on it
+        if rated:
+            _mark_dirty(cur, match_id)
+            return
+
+        # A result is either queued for its period or rated now, never both;
+        # a queued one is rated from whatever result it has when the period closes
+        import periods
+        period = get_rating_period(conn)
+        if period:
+            periods.queue_result(cur, match_id, period)
+            return
+        cur.execute("DELETE FROM pending_results WHERE match_id = ?", (match_id,))
 
         # get player IDs
         winners = [pid for (pid,) in cur.execute(
@@ -61,40 +492,153 @@ def set_match_result(match_id, winning_team_id):
             (winning_team_id, match_id)
         )]
 
-        update_glicko2(winners, losers, conn, cur)
-
-def get_team_players(team_id):
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-
-    c.execute("""
+        update_glicko2(winners, losers, conn, cur, match_id)
+
+def check_date(value):
+    # Match dates are stored as YYYY-MM-DD, which sorts by date and which
+    # rating periods and column exports parse; returns that form
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except (TypeError, ValueError):
+        raise ValueError(f"match date must be YYYY-MM-DD, not {value!r}") from None
+
+def check_rosters(*rosters):
+    # A player appears at most once across the teams of a match
+    seen = set()
+    for roster in rosters:
+        for pid in roster:
+            if pid in seen:
+                raise ValueError(f"player {pid} is listed more than once in the match")
+            seen.add(pid)
+
+@measured
+def record_match(date, team1_ids, team2_ids, winner=None, conn=None):
+    # Match, both teams and their rosters in one transaction. winner is 1 or 2
+    # to also apply the result (and rating update) inside that transaction.
+    date = check_date(date)
+    check_rosters(team1_ids, team2_ids)
+    with transaction(conn) as conn:
+        match_id = conn.execute("INSERT INTO matches (date) VALUES (?)", (date,)).lastrowid
+        conn.executemany(
+            "INSERT INTO teams (match_id, is_winner) VALUES (?, ?)",
+            [(match_id, None), (match_id, None)]
+        )
+        team1_id, team2_id = [tid for (tid,) in conn.execute(
+            "SELECT id FROM teams WHERE match_id = ? ORDER BY id", (match_id,)
+        )]
+        conn.executemany(
+            "INSERT OR IGNORE INTO team_players (team_id, player_id) VALUES (?, ?)",
+            [(team1_id, pid) for pid in team1_ids] + [(team2_id, pid) for pid in team2_ids]
+        )
+        if winner:
+            set_match_result(match_id, team1_id if winner == 1 else team2_id, conn)
+        return match_id, team1_id, team2_id
+
+@measured
+def close_rating_period(conn=None):
+    # Rate every queued result now instead of waiting for the period to end
+    import periods
+    with transaction(conn) as conn:
+        return periods.close_periods(conn.cursor())
+
+@measured
+def get_team_players(team_id, conn=None):
+    conn = conn or get_connection()
+    return conn.execute("""
         SELECT players.id, players.name
         FROM players
         JOIN team_players ON players.id = team_players.player_id
         WHERE team_players.team_id = ?
         ORDER BY players.name
-    """, (team_id,))
-
-    result = c.fetchall()
-    conn.close()
-    return result
-
-def set_team_players(team_id, player_ids):
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-
-    # delete old
-    c.execute("DELETE FROM team_players WHERE team_id = ?", (team_id,))
-
-    # insert new
-    for pid in player_ids:
-        c.execute(
-            "INSERT INTO team_players (team_id, player_id) VALUES (?, ?)",
-            (team_id, pid)
+    """, (team_id,)).fetchall()
+
+@measured
+def get_matches(conn=None):
+    conn = conn or get_connection()
+    return conn.execute("SELECT id, date FROM matches ORDER BY date").fetchall()
+
+@measured
+def get_match_teams(match_id, conn=None):
+    # (team_id, "name, name, ...") for each team in the match
+    conn = conn or get_connection()
+    return conn.execute("""
+        SELECT t.id, COALESCE(group_concat(p.name, ', '), '')
+        FROM teams t
+        LEFT JOIN team_players tp ON tp.team_id = t.id
+        LEFT JOIN players p ON p.id = tp.player_id
+        WHERE t.match_id = ?
+        GROUP BY t.id
+        ORDER BY t.id
+    """, (match_id,)).fetchall()
+
+@measured
+def get_matches_page(after=None, limit=100, pending=False, conn=None):
+    # One page of matches in (date, id) order, each with both rosters, in a
+    # single query. Pass the (date, id) of the last row to get the next page.
+    # Rows are (match_id, date, team1_id, team1_names, team2_id, team2_names, winner)
+    # where winner is 1, 2 or None while pending. pending=True lists only
+    # matches still waiting for a result.
+    conn = conn or get_connection()
+    only_pending = """
+              AND NOT EXISTS (SELECT 1 FROM teams WHERE match_id = matches.id AND is_winner IS NOT NULL)""" if pending else ""
+    rows = conn.execute(f"""
+        WITH page AS (
+            SELECT id, date FROM matches
+            WHERE (date, id) > (?, ?){only_pending}
+            ORDER BY date, id
+            LIMIT ?
         )
-
-    conn.commit()
-    conn.close()
+        SELECT page.id, page.date, t.id, t.is_winner, group_concat(p.name, ', ')
+        FROM page
+        LEFT JOIN teams t ON t.match_id = page.id
+        LEFT JOIN team_players tp ON tp.team_id = t.id
+        LEFT JOIN players p ON p.id = tp.player_id
+        GROUP BY page.id, t.id
+        ORDER BY page.date, page.id, t.id
+    """, (*(after or ("", 0)), limit)).fetchall()
+
+    matches = {}
+    for match_id, match_date, team_id, is_winner, names in rows:
+        match = matches.setdefault(match_id, [match_id, match_date, None, "", None, "", None])
+        if team_id is None:
+            continue
+        side = 2 if match[2] is not None else 0
+        match[side + 2], match[side + 3] = team_id, names or ""
+        if is_winner:
+            match[6] = side // 2 + 1
+    return [tuple(match) for match in matches.values()]
+
+def _mark_dirty(cur, match_id):
+    import recompute
+    recompute.mark_dirty(cur, match_id)
+    if AUTO_RECOMPUTE:
+        recompute.recompute_dirty(cur.connection)
+
+@measured
+def set_team_players(team_id, player_ids, conn=None):
+    with transaction(conn) as conn:
+        import recompute
+        import stats
+        match_id, = conn.execute("SELECT match_id FROM teams WHERE id = ?", (team_id,)).fetchone()
+        others = [pid for (pid,) in conn.execute("""
+            SELECT tp.player_id FROM team_players tp JOIN teams t ON t.id = tp.team_id
+            WHERE t.match_id = ? AND t.id != ?
+        """, (match_id, team_id))]
+        check_rosters(player_ids, others)
+        rated = recompute.is_rated(conn, match_id)
+        counted = stats.before(conn, match_id)
+        # delete old
+        conn.execute("DELETE FROM team_players WHERE team_id = ?", (team_id,))
+        # insert new
+        conn.executemany(
+            "INSERT OR IGNORE INTO team_players (team_id, player_id) VALUES (?, ?)",
+            [(team_id, pid) for pid in player_ids]
+        )
+        stats.update(conn, match_id, counted)
+        # rosters feed player views, so cached snapshots get a new version
+        on_commit(conn, lambda path=DB: _cache_touch(path))
+        if rated:
+            _mark_dirty(conn.cursor(), match_id)
 
 #endregion
 
@@ -151,7 +695,9 @@ def _update_volatility(delta, phi, sigma, v, tau=TAU):
     fA = _f(A, delta, phi, v, sigma, tau)
     fB = _f(B, delta, phi, v, sigma, tau)
 
+    iterations = 0
     while abs(B - A) > eps:
+        iterations += 1
         C = A + (A - B) * fA / (fB - fA)
         fC = _f(C, delta, phi, v, sigma, tau)
         if fC * fB < 0:
@@ -161,85 +707,92 @@ def _update_volatility(delta, phi, sigma, v, tau=TAU):
             fA = fA / 2
         B = C
         fB = fC
+    instrument.count("volatility_solves")
+    instrument.count("volatility_iterations", iterations)
     return math.exp(A / 2)
 
-def update_glicko2(winners, losers, conn=None, cur=None):
+@measured
+def update_glicko2(winners, losers, conn=None, cur=None, match_id=None):
     if not winners or not losers:
-        return
+        return 0
 
-    close_conn = False
-    if conn is None or cur is None:
-        conn = sqlite3.connect(DB)
-        cur = conn.cursor()
-        close_conn = True
-
-    all_players = winners + losers
-
-    # Load all relevant players
-    q = f"SELECT id, rating, rd, vol FROM players WHERE id IN ({','.join(['?']*len(all_players))})"
-    rows = cur.execute(q, all_players).fetchall()
-    players = {pid: {'rating': r, 'rd': rd, 'vol': vol} for pid, r, rd, vol in rows}
-
-    # Separate winners and losers
-    winner_objs = [players[pid] for pid in winners]
-    loser_objs = [players[pid] for pid in losers]
-
-    # For each player, update against each opponent
-    for pid, player in players.items():
-        mu = to_mu(player['rating'])
-        phi = to_phi(player['rd'])
-        sigma = player['vol']
-
-        opponents = []
-        scores = []
-        if pid in winners:
-            # opponents are losers
-            for opp in loser_objs:
-                opponents.append((to_mu(opp['rating']), to_phi(opp['rd'])))
-                scores.append(1)  # win
-        else:
-            # opponents are winners
-            for opp in winner_objs:
-                opponents.append((to_mu(opp['rating']), to_phi(opp['rd'])))
-                scores.append(0)  # loss
-
-        # Step 1: compute v
-        v = 0
-        for (mu_j, phi_j), score in zip(opponents, scores):
-            E_ij = E(mu, mu_j, phi_j)
-            v += (g(phi_j)**2) * E_ij * (1 - E_ij)
-        v = 1 / v
-
-        # Step 2: compute delta
-        delta = 0
-        for (mu_j, phi_j), score in zip(opponents, scores):
-            delta += g(phi_j) * (score - E(mu, mu_j, phi_j))
-        delta *= v
-
-        # Step 3: update volatility
-        sigma_prime = _update_volatility(delta, phi, sigma, v, TAU)
-
-        # Step 4: update phi*
-        phi_star = math.sqrt(phi**2 + sigma_prime**2)
-
-        # Step 5: new phi
-        phi_prime = 1 / math.sqrt(1 / phi_star**2 + 1 / v)
-
-        # Step 6: new mu
-        mu_prime = mu + phi_prime**2 * sum(
-            g(phi_j) * (score - E(mu, mu_j, phi_j)) for (mu_j, phi_j), score in zip(opponents, scores)
-        )
+    import glicko
+
+    with transaction(conn) as conn:
+        cur = cur or conn.cursor()
+        all_players = winners + losers
 
-        # Step 7: convert back
-        new_rating = from_mu(mu_prime)
-        new_rd = from_phi(phi_prime)
-        new_vol = sigma_prime
+        # Load all relevant players
+        q = f"SELECT id, rating, rd, vol FROM players WHERE id IN ({','.join(['?']*len(all_players))})"
+        rows = cur.execute(q, all_players).fetchall()
+        players = {pid: (r, rd, vol) for pid, r, rd, vol in rows}
+
+        # Rate both rosters against each other in one array pass
+        updated, fallbacks = glicko.rate_match(players, winners, losers)
 
         # Save
-        cur.execute("UPDATE players SET rating=?, rd=?, vol=? WHERE id=?", (new_rating, new_rd, new_vol, pid))
+        cur.executemany(
+            "UPDATE players SET rating=?, rd=?, vol=? WHERE id=?",
+            [(r, rd, vol, pid) for pid, (r, rd, vol) in updated.items()]
+        )
+        ratings = {pid: after[0] for pid, after in updated.items()}
+        on_commit(conn, lambda path=DB: _cache_set_ratings(path, ratings))
+        if match_id is not None:
+            save_rating_history(cur, [(pid, match_id, players[pid], after) for pid, after in updated.items()])
+    # players left at their old rating because the update did not converge
+    return fallbacks
 
-    if close_conn:
-        conn.commit()
-        conn.close()
+#endregion
+
+#region RATING HISTORY
+
+def save_rating_history(cur, rows):
+    # rows are (player_id, match_id, (rating, rd, vol) before, (rating, rd, vol) after)
+    cur.executemany(
+        "INSERT OR REPLACE INTO rating_history VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(pid, match_id, *before, *after) for pid, match_id, before, after in rows]
+    )
+
+@measured
+def get_rating_curve(player_id, conn=None):
+    # (match_id, date, rating, rd, vol) after each rated match, oldest first
+    conn = conn or get_connection()
+    return conn.execute("""
+        SELECT m.id, m.date, rh.rating_after, rh.rd_after, rh.vol_after
+        FROM rating_history rh
+        JOIN matches m ON m.id = rh.match_id
+        WHERE rh.player_id = ?
+        ORDER BY m.date, m.id
+    """, (player_id,)).fetchall()
+
+@measured
+def get_rating_as_of(player_id, date, conn=None):
+    # (rating, rd, vol) after the player's last rated match on or before date,
+    # or None if they had not played yet
+    conn = conn or get_connection()
+    return conn.execute("""
+        SELECT rh.rating_after, rh.rd_after, rh.vol_after
+        FROM rating_history rh
+        JOIN matches m ON m.id = rh.match_id
+        WHERE rh.player_id = ? AND m.date <= ?
+        ORDER BY m.date DESC, m.id DESC
+        LIMIT 1
+    """, (player_id, date)).fetchone()
+
+@measured
+def get_biggest_movers(start, end, limit=10, conn=None):
+    # (player_id, name, net rating change, matches) over matches dated
+    # start..end inclusive, largest absolute change first
+    conn = conn or get_connection()
+    return conn.execute("""
+        SELECT p.id, p.name, SUM(rh.rating_after - rh.rating_before) AS change, COUNT(*)
+        FROM matches m
+        JOIN rating_history rh ON rh.match_id = m.id
+        JOIN players p ON p.id = rh.player_id
+        WHERE m.date BETWEEN ? AND ?
+        GROUP BY p.id
+        ORDER BY ABS(change) DESC
+        LIMIT ?
+    """, (start, end, limit)).fetchall()
 
 #endregion
\ No newline at end of file
@@ -0,0 +1,235 @@
+import os
+from itertools import combinations
+from math import comb
+
+import numpy as np
+
+import main
+from glicko import expected_matrix, to_mu, to_phi
+
+EXHAUSTIVE_LIMIT = 16  # pools up to this size are scored split by split
+CANDIDATES = 4096      # splits kept per pass for exact scoring on larger pools
+WINDOW = 16
+SPLIT_BUDGET = 1 << 18 # splits scored per worker and pass when choosing who sits out
+SUBSET_CHUNK = 256     # line-ups scored together in one task
+ROUNDS = 8             # passes over fresh line-ups while constraints rule too many out
+PARALLEL_MIN = 40      # smaller everyone-plays pools finish before worker processes start
+
+# Every split is a row of sides: 1 for team 1, -1 for team 2 and 0 for
+# sitting out. With a pool larger than two teams the search is over line-ups
+# (who plays) as well as splits: every line-up of a small pool, or a random
+# sample of them, each scored over every split of its players.
+
+#region SCORING
+
+def _expected_scores(X, E):
+    # Team 1's expected score for each split: the mean of E(mu_i, mu_j, phi_j)
+    # over every team 1 / team 2 pair, as update_glicko2 would use them.
+    t1, t2 = (X == 1).astype(float), (X == -1).astype(float)
+    return np.einsum("ki,ij,kj->k", t1, E, t2) / (t1.sum(axis=1) * t2.sum(axis=1))
+
+def _allowed(X, together, apart):
+    # together: same team or both sitting out; apart: never on the same team
+    ok = np.ones(len(X), dtype=bool)
+    for i, j in together:
+        ok &= X[:, i] == X[:, j]
+    for i, j in apart:
+        ok &= (X[:, i] != X[:, j]) | (X[:, i] == 0)
+    return ok
+
+#endregion
+
+#region SEARCH
+
+def _exhaustive(n, a):
+    # When both teams are the same size, player 0 stays on team 1 so each
+    # split is listed once rather than once per side.
+    if 2 * a == n:
+        combos = ((0, *rest) for rest in combinations(range(1, n), a - 1))
+    else:
+        combos = combinations(range(n), a)
+    idx = np.array(list(combos))
+    X = np.zeros((len(idx), n), dtype=bool)
+    X[np.arange(len(idx))[:, None], idx] = True
+    return X
+
+def _half_sums(values):
+    # Every subset of one half: bitmask, size and sum of values
+    h = len(values)
+    masks = np.arange(1 << h)
+    bits = (masks[:, None] >> np.arange(h)) & 1
+    return masks, bits.sum(axis=1), bits @ values
+
+def _match_halves(task):
+    # Meet in the middle for one left-half subset size: pair each left subset
+    # with the right subsets whose strength sum lands nearest the target.
+    l_masks, l_sums, r_masks, r_sums, target, window, keep = task
+    if not len(l_masks) or not len(r_masks):
+        return np.empty(0), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    order = np.argsort(r_sums)
+    r_masks, r_sums = r_masks[order], r_sums[order]
+    pos = np.searchsorted(r_sums, target - l_sums)
+    idx = pos[:, None] + np.arange(-window, window)
+    valid = (idx >= 0) & (idx < len(r_sums))
+    idx = np.clip(idx, 0, len(r_sums) - 1)
+    err = np.where(valid, np.abs(l_sums[:, None] + r_sums[idx] - target), np.inf).ravel()
+    best = np.argpartition(err, min(keep, err.size - 1))[:keep] if err.size > keep else np.arange(err.size)
+    best = best[np.isfinite(err[best])]
+    return err[best], l_masks[best // idx.shape[1]], r_masks[idx.ravel()[best]]
+
+def _meet_in_middle(mu, a, window, executor=None):
+    # Candidate team 1 sets whose summed mu is closest to a's share of the pool
+    n = len(mu)
+    h = n // 2
+    target = mu.sum() * a / n
+    l_masks, l_sizes, l_sums = _half_sums(mu[:h])
+    r_masks, r_sizes, r_sums = _half_sums(mu[h:])
+    if 2 * a == n:
+        keep_left = (l_masks & 1) == 1
+        l_masks, l_sizes, l_sums = l_masks[keep_left], l_sizes[keep_left], l_sums[keep_left]
+
+    tasks = []
+    for k in range(max(0, a - (n - h)), min(a, h) + 1):
+        left, right = l_sizes == k, r_sizes == a - k
+        tasks.append((l_masks[left], l_sums[left], r_masks[right], r_sums[right], target, window, CANDIDATES))
+    parts = list(executor.map(_match_halves, tasks) if executor else map(_match_halves, tasks))
+
+    err = np.concatenate([p[0] for p in parts])
+    lm = np.concatenate([p[1] for p in parts])
+    rm = np.concatenate([p[2] for p in parts])
+    best = np.argsort(err)[:CANDIDATES]
+    X = np.zeros((len(best), n), dtype=bool)
+    X[:, :h] = (lm[best, None] >> np.arange(h)) & 1
+    X[:, h:] = (rm[best, None] >> np.arange(n - h)) & 1
+    return X
+
+def _splits(width, a, rng):
+    # Splits of `width` line-up places into a and width - a: all of them, or
+    # CANDIDATES random ones once that is too many
+    if width <= EXHAUSTIVE_LIMIT:
+        return _exhaustive(width, a)
+    keys = rng.random((CANDIDATES, width))
+    keys[:, 0] = 0 if 2 * a == width else keys[:, 0]
+    X = np.zeros((CANDIDATES, width), dtype=bool)
+    X[np.arange(CANDIDATES)[:, None], np.argpartition(keys, a - 1, axis=1)[:, :a]] = True
+    return X
+
+def _lineups(n, width, limit, rng):
+    # (L, width) sorted player indexes: every line-up when there are at most
+    # `limit`, otherwise `limit` random ones
+    if comb(n, width) <= limit:
+        return np.array(list(combinations(range(n), width)))
+    return np.sort(np.argpartition(rng.random((limit, n)), width - 1, axis=1)[:, :width], axis=1)
+
+def _score_lineups(task):
+    # Every split of every line-up: returns the sides (k, n) of the `keep`
+    # nearest a coin flip among those the constraints allow
+    E, lineups, S, together, apart, keep = task
+    n = len(E)
+    count, width = lineups.shape
+    sides = S.astype(float)
+    sub = E[lineups[:, :, None], lineups[:, None, :]]
+    a = sides[0].sum()
+    p = np.einsum("ki,lij,kj->lk", sides, sub, 1 - sides) / (a * (width - a))
+
+    pos = np.full((count, n), -1)
+    pos[np.arange(count)[:, None], lineups] = np.arange(width)
+    ok = np.ones(p.shape, dtype=bool)
+    for i, j in together:
+        pi, pj = pos[:, i], pos[:, j]
+        same = (S[:, pi] == S[:, pj]).T
+        ok &= np.where(((pi >= 0) & (pj >= 0))[:, None], same, ((pi < 0) & (pj < 0))[:, None])
+    for i, j in apart:
+        pi, pj = pos[:, i], pos[:, j]
+        same = (S[:, pi] == S[:, pj]).T
+        ok &= ~(((pi >= 0) & (pj >= 0))[:, None] & same)
+    err = np.where(ok, np.abs(p - 0.5), np.inf).ravel()
+    best = np.argpartition(err, keep)[:keep] if err.size > keep else np.arange(err.size)
+    best = best[np.isfinite(err[best])]
+    rows, splits = np.divmod(best, len(S))
+    X = np.zeros((len(best), n), dtype=np.int8)
+    X[np.arange(len(best))[:, None], lineups[rows]] = np.where(S[splits], 1, -1)
+    return X
+
+#endregion
+
+def balanced_teams(player_ids, team_size=None, count=5, together=(), apart=(), workers=None, seed=0, conn=None):
+    # Pick two teams from the available players whose predicted result is
+    # closest to a coin flip. Returns up to `count` candidates, best first, as
+    # (team 1 expected score, team 1 ids, team 2 ids). Without team_size
+    # everyone plays, split in half; with it, two teams of team_size are
+    # chosen and the rest sit out. together/apart are pairs of player ids.
+    player_ids = list(dict.fromkeys(player_ids))
+    n = len(player_ids)
+    if team_size is None:
+        a, width = n // 2, n
+    else:
+        a, width = team_size, 2 * team_size
+    if a < 1 or width > n or (team_size is None and n < 2):
+        raise ValueError(f"need at least {max(2, width)} players for two teams")
+
+    conn = conn or main.get_connection()
+    rows = dict((pid, (r, rd)) for pid, r, rd in conn.execute(
+        f"SELECT id, rating, rd FROM players WHERE id IN ({','.join('?' * n)})", player_ids
+    ))
+    missing = [pid for pid in player_ids if pid not in rows]
+    if missing:
+        raise ValueError(f"unknown players: {missing}")
+
+    mu = to_mu(np.array([rows[pid][0] for pid in player_ids]))
+    phi = to_phi(np.array([rows[pid][1] for pid in player_ids]))
+    E = expected_matrix(mu, phi)
+    index = {pid: i for i, pid in enumerate(player_ids)}
+    together = [(index[x], index[y]) for x, y in together]
+    apart = [(index[x], index[y]) for x, y in apart]
+
+    if workers is None:
+        # Starting worker processes costs about a second. Only the
+        # everyone-plays search, fourfold longer for every two players, gets
+        # that long; the sampled search scores a fixed budget in a fraction.
+        workers = (os.cpu_count() or 1) if width == n and n >= PARALLEL_MIN else 1
+    executor = None
+    if workers > 1:
+        from leagues import process_pool
+        executor = process_pool(workers)
+    try:
+        if width < n:
+            # more workers sample more line-ups in the same time
+            rng = np.random.default_rng(seed)
+            S = _splits(width, a, rng)
+            limit = max(1, SPLIT_BUDGET * workers // len(S))
+            found = []
+            for _ in range(ROUNDS):
+                lineups = _lineups(n, width, limit, rng)
+                tasks = [(E, lineups[i:i + SUBSET_CHUNK], S, together, apart, count)
+                         for i in range(0, len(lineups), SUBSET_CHUNK)]
+                found.extend(executor.map(_score_lineups, tasks) if executor else map(_score_lineups, tasks))
+                # constraints can rule out most line-ups; draw more until enough remain
+                if sum(map(len, found)) >= count or len(lineups) < limit:
+                    break
+            X = np.concatenate(found)
+        elif n <= EXHAUSTIVE_LIMIT:
+            X = np.where(_exhaustive(n, a), 1, -1).astype(np.int8)
+            X = X[_allowed(X, together, apart)]
+        else:
+            window = WINDOW
+            while True:
+                X = np.where(_meet_in_middle(mu, a, window, executor), 1, -1).astype(np.int8)
+                X = X[_allowed(X, together, apart)]
+                # constraints can rule out every near split; widen until enough remain
+                if len(X) >= count or window >= 1 << (n - n // 2):
+                    break
+                window *= 4
+    finally:
+        if executor:
+            executor.shutdown()
+
+    # line-ups drawn twice give the same split twice
+    X = np.unique(X, axis=0)
+    p = _expected_scores(X, E)
+    best = np.argsort(np.abs(p - 0.5), kind="stable")[:count]
+    return [
+        (float(p[k]), [pid for pid, side in zip(player_ids, X[k]) if side == 1],
+         [pid for pid, side in zip(player_ids, X[k]) if side == -1])
+        for k in best
+    ]
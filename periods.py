@@ -0,0 +1,107 @@
+from datetime import date
+from itertools import groupby, islice
+
+import main
+from glicko import inflate_rd, rate_period
+from instrument import measured
+
+#region PERIOD KEYS
+
+def period_key(match_date, period):
+    if period in ("day", "week"):
+        try:
+            day = date.fromisoformat(match_date)
+        except ValueError:
+            # free-text dates from before they were checked: "" sorts before
+            # every period, so the next one to close takes these results too
+            return ""
+        if period == "day":
+            return match_date
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    # N-match periods are closed by count, not by date
+    return ""
+
+
+def iter_periods(results, period):
+    # Group (match_id, date, winners, losers) tuples, already in date order,
+    # into rating periods. Without a period every match is its own batch.
+    results = iter(results)
+    if not period:
+        for result in results:
+            yield [result]
+    elif isinstance(period, int):
+        while batch := list(islice(results, period)):
+            yield batch
+    else:
+        for _, batch in groupby(results, key=lambda r: period_key(r[1], period)):
+            yield list(batch)
+
+#endregion
+
+#region PENDING RESULTS
+
+def queue_result(cur, match_id, period=None):
+    # Hold a decided match until its rating period closes. A result from a new
+    # day/week closes every earlier period; N-match periods close on count.
+    period = main.get_rating_period(cur.connection) if period is None else period
+    match_date, = cur.execute("SELECT date FROM matches WHERE id = ?", (match_id,)).fetchone()
+    key = period_key(match_date, period)
+    cur.execute("INSERT OR REPLACE INTO pending_results (match_id, period) VALUES (?, ?)", (match_id, key))
+
+    if isinstance(period, int):
+        count, = cur.execute("SELECT COUNT(*) FROM pending_results").fetchone()
+        if count >= period:
+            close_periods(cur)
+    else:
+        close_periods(cur, before=key)
+
+
+def close_periods(cur, before=None):
+    # Rate every pending period, oldest first, or only those before `before`
+    query, params = "SELECT DISTINCT period FROM pending_results", ()
+    if before is not None:
+        query, params = query + " WHERE period < ?", (before,)
+    keys = [key for (key,) in cur.execute(query + " ORDER BY period", params).fetchall()]
+
+    for key in keys:
+        apply_period(cur, key)
+        cur.execute("DELETE FROM pending_results WHERE period = ?", (key,))
+    return len(keys)
+
+
+@measured
+def apply_period(cur, key):
+    results, last_match = {}, {}
+    for match_id, is_winner, pid in cur.execute("""
+        SELECT t.match_id, t.is_winner, tp.player_id
+        FROM teams t
+        JOIN team_players tp ON tp.team_id = t.id
+        JOIN matches m ON m.id = t.match_id
+        WHERE t.is_winner IS NOT NULL
+          AND t.match_id IN (SELECT match_id FROM pending_results WHERE period = ?)
+        ORDER BY m.date, m.id
+    """, (key,)).fetchall():
+        results.setdefault(match_id, ([], []))[0 if is_winner else 1].append(pid)
+        last_match[pid] = match_id
+
+    players = {pid: (r, rd, vol) for pid, r, rd, vol in cur.execute("SELECT id, rating, rd, vol FROM players")}
+    updated, _ = rate_period(players, [(w, l) for w, l in results.values() if w and l])
+    # one history row per player, against their last match of the period
+    history = [(pid, last_match[pid], players[pid], after) for pid, after in updated.items()]
+
+    # Everyone who sat the period out only gains RD
+    idle = [pid for pid in players if pid not in updated]
+    rds = inflate_rd([players[pid][1] for pid in idle], [players[pid][2] for pid in idle]).tolist()
+    for pid, rd in zip(idle, rds):
+        if rd != players[pid][1]:
+            updated[pid] = (players[pid][0], rd, players[pid][2])
+
+    cur.executemany(
+        "UPDATE players SET rating=?, rd=?, vol=? WHERE id=?",
+        [(r, rd, vol, pid) for pid, (r, rd, vol) in updated.items()]
+    )
+    main.save_rating_history(cur, history)
+    main.on_commit(cur.connection, lambda path=main.DB: main.invalidate_player_cache(path))
+
+#endregion
@@ -0,0 +1,60 @@
+import numpy as np
+
+import glicko
+import main
+
+BLOCK_ROWS = 2048  # rows of the player matrix computed per pass
+
+def _load_players(ids, conn):
+    rows = conn.execute(
+        f"SELECT id, rating, rd, vol FROM players WHERE id IN ({','.join('?' * len(ids))})", list(ids)
+    ).fetchall()
+    players = {pid: (r, rd, vol) for pid, r, rd, vol in rows}
+    missing = [pid for pid in ids if pid not in players]
+    if missing:
+        raise ValueError(f"unknown players: {missing}")
+    return players
+
+def player_matrix(path=None, conn=None):
+    # Returns (ids, M) where M[i, j] is player i's expected score against
+    # player j, ids in players.id order. With a path the matrix is written to
+    # a .npy file in row blocks and returned memory-mapped, so N can exceed RAM.
+    conn = conn or main.get_connection()
+    rows = np.array(conn.execute("SELECT id, rating, rd FROM players ORDER BY id").fetchall(), dtype=float).reshape(-1, 3)
+    ids = rows[:, 0].astype(np.int64)
+    mu, phi = glicko.to_mu(rows[:, 1]), glicko.to_phi(rows[:, 2])
+    if path is None:
+        return ids, glicko.expected_matrix(mu, phi)
+
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float64, shape=(len(ids), len(ids)))
+    g_j = glicko.g(phi)[None, :]
+    for start in range(0, len(ids), BLOCK_ROWS):
+        block = mu[start:start + BLOCK_ROWS, None]
+        out[start:start + BLOCK_ROWS] = 1 / (1 + np.exp(-g_j * (block - mu[None, :])))
+    out.flush()
+    return ids, out
+
+def _win_probability(players, team1, team2):
+    r1 = np.array([players[pid] for pid in team1], dtype=float)
+    r2 = np.array([players[pid] for pid in team2], dtype=float)
+    return float(glicko.E(
+        glicko.to_mu(r1[:, 0])[:, None], glicko.to_mu(r2[:, 0])[None, :], glicko.to_phi(r2[:, 1])[None, :]
+    ).mean())
+
+def team_win_probability(team1, team2, conn=None):
+    # Team 1's expected score: the mean over every team 1 / team 2 pair, the
+    # same pairing update_glicko2 rates the match with
+    players = _load_players(list(dict.fromkeys(team1 + team2)), conn or main.get_connection())
+    return _win_probability(players, team1, team2)
+
+def predict_match(team1, team2, conn=None):
+    # Win probability plus the rating change each player would see for either
+    # result, from the same rate_match call update_glicko2 makes. Under a
+    # rating period these are the per-match changes, not the period's.
+    conn = conn or main.get_connection()
+    players = _load_players(list(dict.fromkeys(team1 + team2)), conn)
+    outcomes = {}
+    for key, winners, losers in (("team1_wins", team1, team2), ("team2_wins", team2, team1)):
+        updated, _ = glicko.rate_match(players, winners, losers)
+        outcomes[key] = {pid: after[0] - players[pid][0] for pid, after in updated.items()}
+    return {"team1": _win_probability(players, team1, team2), **outcomes}
@@ -0,0 +1,105 @@
+import main
+from glicko import rate_match
+from instrument import measured
+from replay import clear_snapshots, iter_results, replay
+
+# Retroactive edits. A rated match whose roster or result changes is marked
+# dirty; recompute_dirty() then rolls the affected players back to where they
+# stood before the earliest dirty match and re-rates, in (date, id) order,
+# only the later matches that involve a player whose rating changed.
+
+class _NeedsReplay(Exception):
+    pass
+
+def is_rated(cur, match_id):
+    # Decided and not waiting in a rating period
+    return cur.execute("""
+        SELECT 1 FROM teams WHERE match_id = ? AND is_winner IS NOT NULL
+        AND match_id NOT IN (SELECT match_id FROM pending_results) LIMIT 1
+    """, (match_id,)).fetchone() is not None
+
+def mark_dirty(cur, match_id):
+    cur.execute("INSERT OR IGNORE INTO dirty_matches (match_id) VALUES (?)", (match_id,))
+
+def _base_rating(cur, pid, start):
+    # The player's rating going into their first match after `start`, or
+    # their current rating when they have not played since
+    row = cur.execute("""
+        SELECT rh.rating_before, rh.rd_before, rh.vol_before
+        FROM rating_history rh JOIN matches m ON m.id = rh.match_id
+        WHERE rh.player_id = ? AND (m.date, m.id) > (?, ?)
+        ORDER BY m.date, m.id LIMIT 1
+    """, (pid, *start)).fetchone()
+    return row or cur.execute("SELECT rating, rd, vol FROM players WHERE id = ?", (pid,)).fetchone()
+
+def _recompute_from(cur, start, dirty):
+    changed = {pid for (pid,) in cur.execute(
+        f"SELECT player_id FROM rating_history WHERE match_id IN ({','.join('?' * len(dirty))})", dirty
+    )}
+    changed.update(pid for (pid,) in cur.execute(f"""
+        SELECT tp.player_id FROM team_players tp JOIN teams t ON t.id = tp.team_id
+        WHERE t.match_id IN ({','.join('?' * len(dirty))})
+    """, dirty))
+    state = {pid: _base_rating(cur, pid, start) for pid in changed}
+
+    dirty, count, history = set(dirty), 0, []
+    for match_id, _, winners, losers in iter_results(cur.connection.cursor(), start):
+        if match_id not in dirty and changed.isdisjoint(winners + losers):
+            continue
+        # Players untouched so far still have this match's recorded rating
+        recorded = {pid: before for pid, *before in cur.execute(
+            "SELECT player_id, rating_before, rd_before, vol_before FROM rating_history WHERE match_id = ?", (match_id,)
+        )}
+        players = {}
+        for pid in winners + losers:
+            if pid in state:
+                players[pid] = state[pid]
+            elif pid in recorded:
+                players[pid] = tuple(recorded[pid])
+            else:
+                raise _NeedsReplay(f"no rating history for player {pid} in match {match_id}")
+        updated, _ = rate_match(players, winners, losers)
+        state.update(updated)
+        changed.update(updated)
+        history.extend((pid, match_id, players[pid], after) for pid, after in updated.items())
+        count += 1
+
+    cur.execute(f"DELETE FROM rating_history WHERE match_id IN ({','.join('?' * len(dirty))})", list(dirty))
+    main.save_rating_history(cur, history)
+    cur.executemany(
+        "UPDATE players SET rating=?, rd=?, vol=? WHERE id=?",
+        [(r, rd, vol, pid) for pid, (r, rd, vol) in state.items()]
+    )
+    return count
+
+@measured
+def recompute_dirty(conn=None):
+    # Bring ratings back in line after retroactive edits. Returns the number
+    # of matches re-rated. Under a rating period, or when rating_history is
+    # incomplete, everyone is replayed from the last snapshot before the
+    # earliest dirty match instead.
+    with main.transaction(conn) as conn:
+        cur = conn.cursor()
+        dirty = cur.execute("""
+            SELECT m.id, m.date FROM dirty_matches d JOIN matches m ON m.id = d.match_id
+            ORDER BY m.date, m.id
+        """).fetchall()
+        if not dirty:
+            return 0
+        # just before the earliest dirty match, in iter_results' (date, id) terms
+        start = (dirty[0][1], dirty[0][0] - 1)
+        clear_snapshots(cur, after=start)
+
+        count = None
+        if not main.get_rating_period(conn):
+            try:
+                with main.transaction(conn):
+                    count = _recompute_from(cur, start, [match_id for match_id, _ in dirty])
+            except _NeedsReplay:
+                pass
+        if count is None:
+            count = replay(resume=True, conn=conn)
+
+        cur.execute("DELETE FROM dirty_matches")
+        main.on_commit(conn, lambda path=main.DB: main.invalidate_player_cache(path))
+    return count
@@ -0,0 +1,177 @@
+import argparse
+from itertools import groupby
+
+import main
+from glicko import inflate_rd, rate_match, rate_period
+from instrument import measured
+from periods import iter_periods
+
+DEFAULT_RATING = (1500.0, 350.0, 0.06)
+CHECKPOINT_EVERY = 500
+HISTORY_FLUSH = 10000
+
+#region MATCH HISTORY
+
+def iter_results(cur, after=None):
+    # Decided matches in (date, id) order as (match_id, date, winners, losers).
+    # `after` is a (date, match_id) position; only later matches are returned.
+    query = """
+        SELECT m.id, m.date, t.is_winner, tp.player_id
+        FROM matches m
+        JOIN teams t ON t.match_id = m.id
+        JOIN team_players tp ON tp.team_id = t.id
+        WHERE t.is_winner IS NOT NULL
+    """
+    params = ()
+    if after is not None:
+        query += " AND (m.date, m.id) > (?, ?)"
+        params = after
+    query += " ORDER BY m.date, m.id"
+
+    rows = cur.execute(query, params)
+    for (match_id, match_date), group in groupby(rows, key=lambda row: (row[0], row[1])):
+        winners, losers = [], []
+        for _, _, is_winner, pid in group:
+            (winners if is_winner else losers).append(pid)
+        if winners and losers:
+            yield match_id, match_date, sorted(winners), sorted(losers)
+
+#endregion
+
+#region SNAPSHOTS
+
+# A snapshot stores only the players whose rating changed since the snapshot
+# before it, so the rows written grow with the matches played rather than
+# with league size x snapshot count. The full state at a snapshot is each
+# player's most recent row at or before it.
+
+def latest_snapshot(cur):
+    return cur.execute("""
+        SELECT id, match_id, match_date, match_count FROM rating_snapshots
+        ORDER BY match_date DESC, match_id DESC LIMIT 1
+    """).fetchone()
+
+
+def load_snapshot(cur, snapshot_id):
+    # Later snapshots overwrite earlier ones as the rows come in
+    return {pid: (r, rd, vol) for pid, r, rd, vol in cur.execute("""
+        SELECT v.player_id, v.rating, v.rd, v.vol
+        FROM rating_snapshots s
+        JOIN rating_snapshot_values v ON v.snapshot_id = s.id
+        WHERE (s.match_date, s.match_id) <= (SELECT match_date, match_id FROM rating_snapshots WHERE id = ?)
+        ORDER BY s.match_date, s.match_id
+    """, (snapshot_id,))}
+
+
+def save_snapshot(cur, match_id, match_date, match_count, state, changed):
+    # `changed` holds the ids whose entry in state moved since the last snapshot
+    cur.execute(
+        "INSERT INTO rating_snapshots (match_id, match_date, match_count) VALUES (?, ?, ?)",
+        (match_id, match_date, match_count)
+    )
+    snapshot_id = cur.lastrowid
+    cur.executemany(
+        "INSERT INTO rating_snapshot_values (snapshot_id, player_id, rating, rd, vol) VALUES (?, ?, ?, ?, ?)",
+        [(snapshot_id, pid, *state[pid]) for pid in changed]
+    )
+    return snapshot_id
+
+
+def clear_snapshots(cur, after=None):
+    # Drop every snapshot, or only those taken after a (date, match_id) position
+    where, params = "", ()
+    if after is not None:
+        where, params = " WHERE (match_date, match_id) > (?, ?)", after
+    cur.execute(
+        f"DELETE FROM rating_snapshot_values WHERE snapshot_id IN (SELECT id FROM rating_snapshots{where})", params
+    )
+    cur.execute(f"DELETE FROM rating_snapshots{where}", params)
+
+#endregion
+
+#region REPLAY
+
+def rate_batches(results, period, state, changed=None):
+    # Rate (match_id, date, winners, losers) results, in date order, one
+    # rating period at a time. `state` maps player id -> (rating, rd, vol) and
+    # is updated in place; yields (batch, ratings before, ratings after).
+    # Every id whose state moves is added to the `changed` set if one is given.
+    for batch in iter_periods(results, period):
+        players = {pid: state.get(pid, DEFAULT_RATING) for _, _, w, l in batch for pid in w + l}
+        if period:
+            updated, _ = rate_period(players, [(w, l) for _, _, w, l in batch])
+            idle = [pid for pid in state if pid not in updated]
+            rds = inflate_rd([state[pid][1] for pid in idle], [state[pid][2] for pid in idle]).tolist()
+            for pid, rd in zip(idle, rds):
+                if changed is not None and rd != state[pid][1]:
+                    changed.add(pid)
+                state[pid] = (state[pid][0], rd, state[pid][2])
+        else:
+            _, _, winners, losers = batch[0]
+            updated, _ = rate_match(players, winners, losers)
+        state.update(updated)
+        if changed is not None:
+            changed.update(updated)
+        yield batch, players, updated
+
+@measured
+def replay(checkpoint_every=CHECKPOINT_EVERY, resume=False, conn=None):
+    # Rebuild every rating from the match history. All state is held in memory,
+    # snapshots are saved every `checkpoint_every` matches and players are
+    # written back once at the end. With resume=True the replay starts from the
+    # latest snapshot instead of from default ratings. Under a rating period
+    # matches are rated period by period and results still queued are skipped.
+    # rating_history is rewritten for every replayed match.
+    with main.transaction(conn) as conn:
+        cur = conn.cursor()
+        period = main.get_rating_period(conn)
+
+        state, after, count = {}, None, 0
+        snapshot = latest_snapshot(cur) if resume else None
+        if snapshot:
+            snapshot_id, match_id, match_date, count = snapshot
+            state = load_snapshot(cur, snapshot_id)
+            after = (match_date, match_id)
+            cur.execute(
+                "DELETE FROM rating_history WHERE match_id IN (SELECT id FROM matches WHERE (date, id) > (?, ?))", after
+            )
+        else:
+            clear_snapshots(cur)
+            cur.execute("DELETE FROM rating_history")
+            cur.execute("DELETE FROM dirty_matches")
+
+        pending = {match_id for (match_id,) in cur.execute("SELECT match_id FROM pending_results")} if period else set()
+        results = (r for r in iter_results(conn.cursor(), after) if r[0] not in pending)
+
+        history, changed = [], set()
+        for batch, players, updated in rate_batches(results, period, state, changed):
+            last_match = {pid: match_id for match_id, _, w, l in batch for pid in w + l}
+            history.extend((pid, last_match[pid], players[pid], after) for pid, after in updated.items())
+            if len(history) >= HISTORY_FLUSH:
+                main.save_rating_history(cur, history)
+                history.clear()
+
+            previous, count = count, count + len(batch)
+            if checkpoint_every and count // checkpoint_every > previous // checkpoint_every:
+                match_id, match_date, _, _ = batch[-1]
+                save_snapshot(cur, match_id, match_date, count, state, changed)
+                changed.clear()
+
+        main.save_rating_history(cur, history)
+        cur.execute("UPDATE players SET rating = ?, rd = ?, vol = ?", DEFAULT_RATING)
+        cur.executemany(
+            "UPDATE players SET rating=?, rd=?, vol=? WHERE id=?",
+            [(r, rd, vol, pid) for pid, (r, rd, vol) in state.items()]
+        )
+        main.on_commit(conn, lambda path=main.DB: main.invalidate_player_cache(path))
+
+    return count
+
+#endregion
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild all player ratings from the match history.")
+    parser.add_argument("--every", type=int, default=CHECKPOINT_EVERY, help="save a rating snapshot every N matches")
+    parser.add_argument("--resume", action="store_true", help="continue from the latest snapshot")
+    args = parser.parse_args()
+    print(f"Replayed {replay(args.every, args.resume)} matches.")
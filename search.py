@@ -0,0 +1,246 @@
+from bisect import bisect_left, insort
+from heapq import heapify, heappop, merge, nsmallest
+from os.path import commonprefix
+
+# In-memory name search for the player pickers. A player is indexed under
+# their name, their full name and each word of the full name, and every
+# structure is keyed by those distinct terms rather than by player, so a
+# common first name costs one entry however many players share it:
+#   prefix     sorted term lists (names first, then the rest), walked from
+#              bisect and stopped as soon as `limit` players are found
+#   substring  trigram -> terms, intersected then checked, taken in order
+#              from a heap until `limit` players are found
+#   typos      only when nothing else matches, word by word: words whose
+#              first 4, 5 or 6 letters (as many as the query word has) are
+#              within one deletion of the query word's (symmetric delete),
+#              kept if the word, or its start, is within edit distance.
+#              Only words of a length in reach are compared whole, and
+#              starts are compared once however many words share them.
+#              Players are gathered one match level at a time, and only
+#              until `limit` of them are found.
+# Results come back name prefixes first, then other prefixes, substrings,
+# typos (fewest edits first, whole words before starts).
+
+FUZZY_PREFIXES = (4, 5, 6)
+
+def normalize(text):
+    return " ".join((text or "").lower().split())
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _osa_row(word, term, rows, limit):
+    # The next row of the optimal string alignment table between the term
+    # letters so far (rows) and word (columns). Only cells within `limit` of
+    # the diagonal can stay within it, so only that band is filled and
+    # everything outside counts as over.
+    i, over = len(rows), limit + 1
+    previous, before = rows[-1], rows[-2] if i > 1 else None
+    current = [over] * (len(word) + 1)
+    current[0] = i if i <= limit else over
+    letter = term[i - 1]
+    for j in range(max(1, i - limit), min(len(word), i + limit) + 1):
+        d = previous[j - 1] + (letter != word[j - 1])
+        if previous[j] + 1 < d:
+            d = previous[j] + 1
+        if current[j - 1] + 1 < d:
+            d = current[j - 1] + 1
+        if i > 1 and j > 1 and letter == word[j - 2] and term[i - 2] == word[j - 1] and before[j - 2] + 1 < d:
+            d = before[j - 2] + 1
+        current[j] = d
+    return current
+
+def _first_row(word, limit):
+    return [j if j <= limit else limit + 1 for j in range(len(word) + 1)]
+
+def edit_distance(a, b, limit):
+    # Optimal string alignment distance, giving up once it exceeds limit
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    rows = [_first_row(b, limit)]
+    for _ in a:
+        rows.append(_osa_row(b, a, rows, limit))
+        if min(rows[-1]) > limit:
+            return limit + 1
+    return min(rows[-1][-1], limit + 1)
+
+def _deletes(text):
+    return {text} | {text[:i] + text[i + 1:] for i in range(len(text))}
+
+class PlayerIndex:
+    def __init__(self, rows=()):
+        self.names = {}              # pid -> (name, full name, " name full name"), normalized
+        self.players = ({}, {})      # name -> [pid], other term -> [pid], by name
+        self.sorted = ([], [])       # the keys of each, sorted
+        self.grams = {}              # trigram -> {term}
+        self.deletes = {size: {} for size in FUZZY_PREFIXES}  # word start less up to one letter -> [word]
+        for pid, name, full_name in rows:
+            self._index(pid, name, full_name)
+        for terms in self.sorted:
+            terms.sort()
+        for players in self.players:
+            for pids in players.values():
+                pids.sort(key=self._order)
+
+    def _index(self, pid, name, full_name, insert=False):
+        name, full_name = normalize(name), normalize(full_name) or normalize(name)
+        self.names[pid] = (name, full_name, f" {name} {full_name}")
+        for kind, terms in ((0, {name}), (1, {full_name, *full_name.split()} - {name})):
+            for term in terms:
+                if term not in self.players[kind]:
+                    self.players[kind][term] = []
+                    if insert:
+                        insort(self.sorted[kind], term)
+                    else:
+                        self.sorted[kind].append(term)
+                    self._index_term(term)
+                if insert:
+                    insort(self.players[kind][term], pid, key=self._order)
+                else:
+                    self.players[kind][term].append(pid)
+
+    def _index_term(self, term):
+        if term in self.players[0] and term in self.players[1]:
+            return
+        for gram in trigrams(term):
+            self.grams.setdefault(gram, set()).add(term)
+        if " " not in term:
+            for size in FUZZY_PREFIXES:
+                for key in _deletes(term[:size]):
+                    self.deletes[size].setdefault(key, []).append(term)
+
+    def add(self, pid, name, full_name=None):
+        if pid not in self.names:
+            self._index(pid, name, full_name, insert=True)
+
+    def search(self, query, limit=50):
+        # Player ids, best match first
+        query = normalize(query)
+        if not query:
+            return []
+        found = {}
+
+        # prefixes
+        for kind, terms in enumerate(self.sorted):
+            i = bisect_left(terms, query)
+            while i < len(terms) and terms[i].startswith(query) and len(found) < limit:
+                self._take(found, self.players[kind][terms[i]], limit)
+                i += 1
+        if len(found) >= limit or len(query) < 3:
+            return list(found)
+
+        # substrings
+        postings = sorted((self.grams.get(gram, set()) for gram in trigrams(query)), key=len)
+        matches = [term for term in set.intersection(*postings) if query in term] if postings[0] else []
+        heapify(matches)
+        while matches and len(found) < limit:
+            self._take(found, self._players(heappop(matches)), limit)
+        if found:
+            return list(found)
+
+        # typos: every word of the query must be, or start, a word of the
+        # player's to within one edit (two past five letters); words too
+        # short for that must start one exactly
+        words = query.split()
+        close = [self._close(word) for word in words if len(word) >= FUZZY_PREFIXES[0]]
+        if not close:
+            return []
+        short = [word for word in words if len(word) < FUZZY_PREFIXES[0]]
+        # a short word starts the name or a word of the full name
+        marks = [f" {word}" for word in short]
+        starts = lambda pid: all(map(self.names[pid][2].__contains__, marks))
+        if len(close) == 1:
+            return self._ranked(close[0], limit, starts if short else None)
+        close = [self._by_player(terms) for terms in close]
+        edits = {
+            pid: tuple(map(sum, zip(*(matches[pid] for matches in close))))
+            for pid in set(close[0]).intersection(*close[1:])
+            if starts(pid)
+        }
+        return nsmallest(limit, edits, key=lambda pid: (edits[pid], *self._order(pid)))
+
+    def _close(self, word):
+        # {term: (edits, starts)} for indexed words within reach of `word`;
+        # starts is 1 when only the start of the term was. The candidates
+        # are walked in order so those sharing a start share the table rows
+        # for it, and a start already out of reach ends the rows.
+        allowed = 1 if len(word) <= 5 else 2
+        size = min(len(word), FUZZY_PREFIXES[-1])
+        candidates = set()
+        for key in _deletes(word[:size]):
+            candidates.update(self.deletes[size].get(key, ()))
+        # a term longer than `reach` can only be in reach by its start, and
+        # once a start is settled so is every later term that begins with it
+        reach = len(word) + allowed
+        rows, lowest, last, settled, terms = [_first_row(word, allowed)], [0], "", None, {}
+        for term in sorted(candidates):
+            if settled and term.startswith(settled[0]) and (settled[2] or len(term) > reach):
+                if settled[1]:
+                    terms[term] = settled[1]
+                continue
+            shared = len(commonprefix((term, last))) + 1
+            del rows[shared:], lowest[shared:]
+            last = term
+            depth = len(term) if len(term) <= reach else len(word)
+            while len(rows) <= depth and lowest[-1] <= allowed:
+                rows.append(_osa_row(word, term, rows, allowed))
+                lowest.append(min(rows[-1]))
+            # rows[k][-1]: edits between term[:k] and word
+            whole = rows[-1][-1] if len(rows) > len(term) else allowed + 1
+            start = min(len(term), len(word))
+            if whole <= allowed:
+                match = (whole, 0)
+            elif len(rows) > start and rows[start][-1] <= allowed:
+                match = (rows[start][-1], 1)
+            else:
+                match = None
+            if match:
+                terms[term] = match
+            # (start, its match, whether it rules out every term beginning with it)
+            if lowest[-1] > allowed:
+                settled = (term[:len(rows) - 1], match, True)
+            elif len(term) > reach:
+                settled = (term[:len(word)], match, False)
+            else:
+                settled = None
+        return terms
+
+    def _ranked(self, terms, limit, keep=None):
+        # Players of {term: match} that `keep` accepts, best match first and
+        # then by name: one match level at a time, each player at their best
+        # one, merging the level's player lists until `limit` are found
+        levels, found = {}, {}
+        for term, match in terms.items():
+            levels.setdefault(match, []).append(term)
+        for match in sorted(levels):
+            lists = [players[term] for term in levels[match] for players in self.players if term in players]
+            if keep:
+                # filtered first: most of a level can fail `keep`
+                level = [pid for pid in set().union(*lists).difference(found) if keep(pid)]
+                lists = [sorted(level, key=self._order)]
+            for pid in merge(*lists, key=self._order):
+                if pid in found:
+                    continue
+                found[pid] = None
+                if len(found) >= limit:
+                    return list(found)
+        return list(found)
+
+    def _by_player(self, terms):
+        # {pid: best match} from {term: match}
+        pids = {}
+        for term, match in terms.items():
+            for pid in self._players(term):
+                if pid not in pids or match < pids[pid]:
+                    pids[pid] = match
+        return pids
+
+    def _order(self, pid):
+        return self.names[pid][0], pid
+
+    def _players(self, term):
+        return {*self.players[0].get(term, ()), *self.players[1].get(term, ())}
+
+    def _take(self, found, pids, limit):
+        for pid in nsmallest(limit - len(found), set(pids).difference(found)):
+            found[pid] = None
@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import json
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import main
+
+# A small JSON service over main.py for phones and scripts, on asyncio and
+# the standard library only. Reads run on a bounded thread pool (each thread
+# keeps its own SQLite connection); every write goes through one writer
+# thread, so writes are serialized like the UI's DbWorker.
+#
+#   GET  /players                       [{id, name, rating}] by name
+#   GET  /leaderboard?limit=N           [{id, name, rating}] by rating
+#   GET  /matches?after=DATE,ID&limit=N&pending=1
+#   GET  /matches/ID                    {id, teams: [{id, players}]}
+#   POST /players                       {name, full_name?} -> {id}
+#   POST /matches                       {date, team1, team2, winner?} -> {id, team1_id, team2_id}
+#   POST /matches/ID/result             {winner: 1|2}
+#
+# GET responses carry an ETag built from the league's write generation, which
+# every committed change moves on whoever made it (this server, the UI, the
+# CLI); a matching If-None-Match gets 304 without a body.
+
+READERS = 8
+MAX_HEADER = 16384
+MAX_BODY = 65536
+PAGE_LIMIT = 500
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+REASONS = {200: "OK", 201: "Created", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+def _players_json(rows):
+    return [{"id": pid, "name": name, "rating": rating} for pid, name, rating in rows]
+
+def _match_json(row):
+    match_id, match_date, t1_id, t1_names, t2_id, t2_names, winner = row
+    return {"id": match_id, "date": match_date, "winner": winner,
+            "team1": {"id": t1_id, "players": t1_names}, "team2": {"id": t2_id, "players": t2_names}}
+
+def _int(value, name):
+    if isinstance(value, (bool, float)):
+        raise HttpError(400, f"{name} must be an integer")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HttpError(400, f"{name} must be an integer") from None
+
+def _limit(query, default=None):
+    if "limit" not in query:
+        return default
+    limit = _int(query["limit"][0], "limit")
+    if not 1 <= limit <= PAGE_LIMIT:
+        raise HttpError(400, f"limit must be between 1 and {PAGE_LIMIT}")
+    return limit
+
+class LeagueServer:
+    def __init__(self, readers=READERS):
+        self.reads = ThreadPoolExecutor(readers, thread_name_prefix="db-read")
+        self.writer = ThreadPoolExecutor(1, thread_name_prefix="db-write")
+
+    async def read(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.reads, fn, *args)
+
+    async def write(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.writer, fn, *args)
+
+    async def etag(self):
+        return f'"{await self.read(main.write_generation)}"'
+
+    #region ROUTES
+
+    async def route(self, method, path, query, body):
+        parts = [p for p in path.split("/") if p]
+        if parts == ["players"]:
+            if method == "GET":
+                return 200, _players_json(await self.read(main.get_players))
+            if method == "POST":
+                data = self._json(body)
+                if not isinstance(data.get("name"), str) or not data["name"].strip():
+                    raise HttpError(400, "name is required")
+                if not isinstance(data.get("full_name"), (str, type(None))):
+                    raise HttpError(400, "full_name must be a string")
+                return 201, {"id": await self.write(main.add_player, data["name"].strip(), data.get("full_name"))}
+        elif parts == ["leaderboard"]:
+            if method == "GET":
+                rows = await self.read(main.get_leaderboard)
+                return 200, _players_json(rows[:_limit(query)])
+        elif parts == ["matches"]:
+            if method == "GET":
+                after = None
+                if "after" in query:
+                    match_date, _, match_id = query["after"][0].rpartition(",")
+                    after = (match_date, _int(match_id, "after id"))
+                limit = _limit(query, 100)
+                pending = query.get("pending", ["0"])[0] not in ("0", "false", "")
+                rows = await self.read(main.get_matches_page, after, limit, pending)
+                return 200, [_match_json(row) for row in rows]
+            if method == "POST":
+                data = self._json(body)
+                team1, team2 = data.get("team1"), data.get("team2")
+                if not isinstance(data.get("date"), str) or not team1 or not team2:
+                    raise HttpError(400, "date, team1 and team2 are required")
+                try:
+                    match_date = main.check_date(data["date"])
+                except ValueError as e:
+                    raise HttpError(400, str(e)) from None
+                if not isinstance(team1, list) or not isinstance(team2, list):
+                    raise HttpError(400, "team1 and team2 must be lists of player ids")
+                team1 = [_int(pid, "player id") for pid in team1]
+                team2 = [_int(pid, "player id") for pid in team2]
+                try:
+                    main.check_rosters(team1, team2)
+                except ValueError as e:
+                    raise HttpError(400, str(e)) from None
+                winner = data.get("winner")
+                if winner not in (None, 1, 2) or isinstance(winner, bool):
+                    raise HttpError(400, "winner must be 1 or 2")
+                match_id, t1, t2 = await self.write(main.record_match, match_date, team1, team2, winner)
+                return 201, {"id": match_id, "team1_id": t1, "team2_id": t2}
+        elif len(parts) == 2 and parts[0] == "matches":
+            if method == "GET":
+                match_id = _int(parts[1], "match id")
+                teams = await self.read(main.get_match_teams, match_id)
+                if not teams:
+                    raise HttpError(404, f"no match {match_id}")
+                return 200, {"id": match_id, "teams": [{"id": tid, "players": names} for tid, names in teams]}
+        elif len(parts) == 3 and parts[0] == "matches" and parts[2] == "result":
+            if method == "POST":
+                match_id = _int(parts[1], "match id")
+                winner = self._json(body).get("winner")
+                if winner not in (1, 2) or isinstance(winner, bool):
+                    raise HttpError(400, "winner must be 1 or 2")
+                teams = await self.read(main.get_match_teams, match_id)
+                if len(teams) < 2:
+                    raise HttpError(404, f"no match {match_id}")
+                await self.write(main.set_match_result, match_id, teams[winner - 1][0])
+                return 200, {"id": match_id, "winner": winner}
+        else:
+            raise HttpError(404, f"no route {path}")
+        raise HttpError(405, f"{method} not allowed on {path}")
+
+    @staticmethod
+    def _json(body):
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            raise HttpError(400, "body is not JSON") from None
+        if not isinstance(data, dict):
+            raise HttpError(400, "body must be a JSON object")
+        return data
+
+    #endregion
+
+    #region HTTP
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self.respond(writer, 413, {"error": "headers too large"}, close=True)
+                    return
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = request_line.split(" ")
+                except ValueError:
+                    await self.respond(writer, 400, {"error": "bad request line"}, close=True)
+                    return
+                headers = {}
+                for line in header_lines:
+                    name, sep, value = line.partition(":")
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+
+                length = headers.get("content-length", "0")
+                length = int(length) if length.isdigit() else -1
+                if length < 0:
+                    await self.respond(writer, 400, {"error": "bad content-length"}, close=True)
+                    return
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {"error": "body too large"}, close=True)
+                    return
+                body = await reader.readexactly(length) if length else b""
+                close = headers.get("connection", "").lower() == "close" or version == "HTTP/1.0"
+
+                url = urlsplit(target)
+                etag = None
+                try:
+                    if method == "GET":
+                        etag = await self.etag()
+                        if headers.get("if-none-match") == etag:
+                            await self.respond(writer, 304, None, etag=etag, close=close)
+                            if close:
+                                return
+                            continue
+                    status, payload = await self.route(method, url.path, parse_qs(url.query), body)
+                except HttpError as e:
+                    status, payload, etag = e.status, {"error": str(e)}, None
+                except (ValueError, sqlite3.IntegrityError) as e:
+                    status, payload, etag = 400, {"error": str(e)}, None
+                except Exception as e:
+                    print(f"{method} {target}: {type(e).__name__}: {e}", file=sys.stderr)
+                    status, payload, etag = 500, {"error": "internal error"}, None
+                await self.respond(writer, status, payload, etag=etag, close=close)
+                if close:
+                    return
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer, status, payload, etag=None, close=False):
+        body = b"" if payload is None else json.dumps(payload).encode()
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Length: {len(body)}"]
+        if payload is not None:
+            head.append("Content-Type: application/json")
+        if etag:
+            head.append(f"ETag: {etag}")
+            head.append("Cache-Control: no-cache")
+        head.append("Connection: close" if close else "Connection: keep-alive")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    #endregion
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER, backlog=1024)
+        print(f"Serving {main.DB} on http://{host}:{server.sockets[0].getsockname()[1]}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the league as JSON over HTTP.")
+    parser.add_argument("--db", default=main.DB)
+    parser.add_argument("--league", help="serve the named league instead of --db")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--readers", type=int, default=READERS, help="threads for read queries")
+    args = parser.parse_args()
+    main.DB = args.db
+    if args.league:
+        import leagues
+        leagues.use_league(args.league)
+    else:
+        from setup.db_setup import migrate
+        migrate(main.DB)
+    try:
+        asyncio.run(LeagueServer(args.readers).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
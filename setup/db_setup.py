@@ -1,9 +1,12 @@
+import argparse
+import os
 import sqlite3
 
-def create_db():
-    conn = sqlite3.connect("league.db")
-    cursor = conn.cursor()
+DB = os.environ.get("LEAGUE_DB", "league.db")
+
+#region MIGRATIONS
 
+def _baseline(cursor):
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS players (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -40,8 +43,254 @@ def create_db():
     )
     """)
 
-    conn.commit()
-    conn.close()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS rating_snapshots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        match_id INTEGER NOT NULL,
+        match_date TEXT NOT NULL,
+        match_count INTEGER NOT NULL,
+        FOREIGN KEY(match_id) REFERENCES matches(id)
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS rating_snapshot_values (
+        snapshot_id INTEGER,
+        player_id INTEGER,
+        rating REAL,
+        rd REAL,
+        vol REAL,
+        FOREIGN KEY(snapshot_id) REFERENCES rating_snapshots(id),
+        FOREIGN KEY(player_id) REFERENCES players(id)
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS pending_results (
+        match_id INTEGER PRIMARY KEY,
+        period TEXT NOT NULL,
+        FOREIGN KEY(match_id) REFERENCES matches(id)
+    )
+    """)
+
+def _join_indexes(cursor):
+    # team_players is rebuilt so INSERT OR IGNORE has a constraint to hit;
+    # duplicate rows left by earlier versions are dropped on the way.
+    cursor.execute("""
+    CREATE TABLE team_players_new (
+        team_id INTEGER,
+        player_id INTEGER,
+        FOREIGN KEY(team_id) REFERENCES teams(id),
+        FOREIGN KEY(player_id) REFERENCES players(id),
+        UNIQUE(team_id, player_id)
+    )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO team_players_new (team_id, player_id) SELECT team_id, player_id FROM team_players")
+    cursor.execute("DROP TABLE team_players")
+    cursor.execute("ALTER TABLE team_players_new RENAME TO team_players")
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_team_players_player ON team_players(player_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_teams_match ON teams(match_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_matches_date ON matches(date, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_values ON rating_snapshot_values(snapshot_id)")
+
+def _rating_history(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS rating_history (
+        player_id INTEGER NOT NULL,
+        match_id INTEGER NOT NULL,
+        rating_before REAL,
+        rd_before REAL,
+        vol_before REAL,
+        rating_after REAL,
+        rd_after REAL,
+        vol_after REAL,
+        PRIMARY KEY(player_id, match_id),
+        FOREIGN KEY(player_id) REFERENCES players(id),
+        FOREIGN KEY(match_id) REFERENCES matches(id)
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_rating_history_match ON rating_history(match_id)")
+
+def _dirty_matches(cursor):
+    # Rated matches whose roster or result changed and still need recomputing
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS dirty_matches (
+        match_id INTEGER PRIMARY KEY,
+        FOREIGN KEY(match_id) REFERENCES matches(id)
+    )
+    """)
+
+def _player_stats(cursor):
+    # Win/loss totals, streaks and pairwise records, maintained by stats.py
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS player_stats (
+        player_id INTEGER PRIMARY KEY,
+        wins INTEGER NOT NULL DEFAULT 0,
+        losses INTEGER NOT NULL DEFAULT 0,
+        streak INTEGER NOT NULL DEFAULT 0,
+        best_streak INTEGER NOT NULL DEFAULT 0,
+        last_date TEXT,
+        last_match INTEGER,
+        FOREIGN KEY(player_id) REFERENCES players(id)
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS player_pairs (
+        player_id INTEGER NOT NULL,
+        other_id INTEGER NOT NULL,
+        games_with INTEGER NOT NULL DEFAULT 0,
+        wins_with INTEGER NOT NULL DEFAULT 0,
+        games_against INTEGER NOT NULL DEFAULT 0,
+        wins_against INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(player_id, other_id),
+        FOREIGN KEY(player_id) REFERENCES players(id),
+        FOREIGN KEY(other_id) REFERENCES players(id)
+    ) WITHOUT ROWID
+    """)
+    # Existing leagues start with their history already counted. The SQL is
+    # a frozen copy of stats.py's rebuild at the time, so this step does the
+    # same thing whatever stats.py later becomes.
+    cursor.execute("""
+    INSERT INTO player_stats
+    WITH results AS (
+        SELECT tp.player_id AS pid, t.is_winner AS won, m.date AS date, m.id AS match_id,
+               ROW_NUMBER() OVER (PARTITION BY tp.player_id ORDER BY m.date, m.id) AS n,
+               ROW_NUMBER() OVER (PARTITION BY tp.player_id, t.is_winner ORDER BY m.date, m.id) AS k
+        FROM team_players tp
+        JOIN teams t ON t.id = tp.team_id
+        JOIN matches m ON m.id = t.match_id
+        WHERE t.is_winner IS NOT NULL
+    ),
+    runs AS (
+        SELECT pid, won, COUNT(*) AS length, MAX(n), date, match_id,
+               ROW_NUMBER() OVER (PARTITION BY pid ORDER BY MAX(n) DESC) AS recent
+        FROM results GROUP BY pid, won, n - k
+    )
+    SELECT pid, SUM(CASE WHEN won THEN length ELSE 0 END), SUM(CASE WHEN won THEN 0 ELSE length END),
+           MAX(CASE WHEN recent = 1 THEN CASE WHEN won THEN length ELSE -length END END),
+           MAX(CASE WHEN won THEN length ELSE 0 END),
+           MAX(CASE WHEN recent = 1 THEN date END), MAX(CASE WHEN recent = 1 THEN match_id END)
+    FROM runs GROUP BY pid
+    """)
+    cursor.execute("""
+    INSERT INTO player_pairs
+    SELECT a.player_id, b.player_id,
+           SUM(ta.id = tb.id), SUM(ta.id = tb.id AND ta.is_winner),
+           SUM(ta.id != tb.id), SUM(ta.id != tb.id AND ta.is_winner)
+    FROM team_players a
+    JOIN teams ta ON ta.id = a.team_id
+    JOIN teams tb ON tb.match_id = ta.match_id
+    JOIN team_players b ON b.team_id = tb.id AND b.player_id != a.player_id
+    WHERE ta.is_winner IS NOT NULL AND tb.is_winner IS NOT NULL
+    GROUP BY a.player_id, b.player_id
+    """)
+
+def _settings(cursor):
+    # League-wide options every process reads, e.g. the rating period
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """)
+
+# (version, description, step) — append only, never edit a released step
+MIGRATIONS = [
+    (1, "baseline schema", _baseline),
+    (2, "indexes on join columns, unique team_players", _join_indexes),
+    (3, "per-match rating history", _rating_history),
+    (4, "dirty matches for incremental recompute", _dirty_matches),
+    (5, "player stats and pairwise records", _player_stats),
+    (6, "league settings", _settings),
+]
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(path=DB, verbose=False):
+    conn = sqlite3.connect(path, isolation_level=None)
+    cursor = conn.cursor()
+    try:
+        for version, description, step in MIGRATIONS:
+            if version <= schema_version(conn):
+                continue
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                step(cursor)
+                cursor.execute(f"PRAGMA user_version = {version}")
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            if verbose:
+                print(f"Applied migration {version}: {description}")
+        return schema_version(conn)
+    finally:
+        conn.close()
+
+#endregion
+
+#region QUERY PLANS
+
+# The lookups behind get_team_players, set_match_result and the match screens
+HOT_QUERIES = [
+    ("team roster", """
+        SELECT players.id, players.name FROM players
+        JOIN team_players ON players.id = team_players.player_id
+        WHERE team_players.team_id = ? ORDER BY players.name
+    """, (1,)),
+    ("losing roster", """
+        SELECT player_id FROM team_players
+        WHERE team_id != ? AND team_id IN (SELECT id FROM teams WHERE match_id = ?)
+    """, (1, 1)),
+    ("match teams", "SELECT id, is_winner FROM teams WHERE match_id = ?", (1,)),
+    ("player teams", "SELECT team_id FROM team_players WHERE player_id = ?", (1,)),
+    ("matches by date", "SELECT id, date FROM matches ORDER BY date", ()),
+    ("rating as of", """
+        SELECT rh.rating_after FROM rating_history rh JOIN matches m ON m.id = rh.match_id
+        WHERE rh.player_id = ? AND m.date <= ? ORDER BY m.date DESC, m.id DESC LIMIT 1
+    """, (1, "2000-01-01")),
+]
+
+def query_plans(path=DB):
+    plans = {}
+    with sqlite3.connect(path) as conn:
+        for name, sql, params in HOT_QUERIES:
+            try:
+                plans[name] = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            except sqlite3.OperationalError as e:
+                # table added by a later migration
+                plans[name] = [str(e)]
+    return plans
+
+def print_plans(plans):
+    for name, steps in plans.items():
+        print(f"  {name}:")
+        for step in steps:
+            print(f"    {step}")
+
+#endregion
+
+def create_db(path=DB):
+    return migrate(path)
 
 if __name__ == "__main__":
-    create_db()
+    parser = argparse.ArgumentParser(description="Create or upgrade the league database.")
+    parser.add_argument("--db", default=DB)
+    parser.add_argument("--plans", action="store_true", help="show query plans before and after migrating")
+    args = parser.parse_args()
+
+    if args.plans:
+        with sqlite3.connect(args.db) as conn:
+            fresh = schema_version(conn) == 0 and not conn.execute("SELECT 1 FROM sqlite_master").fetchone()
+        if not fresh:
+            print("Before:")
+            print_plans(query_plans(args.db))
+
+    version = migrate(args.db, verbose=True)
+    print(f"{args.db} is at schema version {version}.")
+
+    if args.plans:
+        print("After:")
+        print_plans(query_plans(args.db))
@@ -0,0 +1,177 @@
+import os
+
+import numpy as np
+
+import glicko
+import main
+
+# Monte Carlo forecasts for the rest of a season. Every simulated season
+# starts from the players' current rating/rd/vol and plays `matches` games
+# between random teams drawn from the pool. Each result is sampled from the
+# teams' Glicko-2 expected score and applied the way update_glicko2 applies
+# it (every winner rated against every loser), for a whole batch of seasons
+# at once with glicko.rate. Batches run on a process pool; each batch seeds
+# from its own child of one SeedSequence, so results depend on the seed and
+# batch size but not on the number of workers.
+
+BATCH = 1000      # seasons simulated together in one array pass
+TEAM_SIZE = 6
+RANKS = 100       # finishing places counted one by one; lower ones are pooled
+
+#region SEASONS
+
+def _rosters(rng, seasons, n, size):
+    # (seasons, size) distinct player indexes per row, in random order. Small
+    # pools clash too often to redraw, so they take the smallest random keys.
+    if n < 8 * size:
+        return rng.permuted(np.argpartition(rng.random((seasons, n)), size - 1, axis=1)[:, :size], axis=1)
+    rosters = rng.integers(0, n, size=(seasons, size))
+    while True:
+        ordered = np.sort(rosters, axis=1)
+        clash = (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+        if not clash.any():
+            return rosters
+        rosters[clash] = rng.integers(0, n, size=(clash.sum(), size))
+
+def _play(mu, phi, sigma, rosters, team1_wins):
+    # Rate one match in every season. rosters is (S, 2T), team 1 first;
+    # mu/phi/sigma are (S, N) and updated in place.
+    seasons, width = rosters.shape
+    t = width // 2
+    rows = np.arange(seasons)[:, None]
+    m, p, s = mu[rows, rosters], phi[rows, rosters], sigma[rows, rosters]
+    # each player's opponents are the other team, in the other team's order
+    opp_mu = np.concatenate([m[:, t:], m[:, :t]], axis=1)
+    opp_phi = np.concatenate([p[:, t:], p[:, :t]], axis=1)
+    won = np.concatenate([np.repeat(team1_wins[:, None], t, axis=1), np.repeat(~team1_wins[:, None], t, axis=1)], axis=1)
+
+    opp_mu = np.repeat(opp_mu.reshape(seasons, 2, 1, t), t, axis=2).reshape(-1, t)
+    opp_phi = np.repeat(opp_phi.reshape(seasons, 2, 1, t), t, axis=2).reshape(-1, t)
+    scores = np.repeat(won.reshape(-1, 1), t, axis=1).astype(float)
+    mu_p, phi_p, sigma_p, _ = glicko.rate(m.ravel(), p.ravel(), s.ravel(), opp_mu, opp_phi, scores)
+    mu[rows, rosters], phi[rows, rosters], sigma[rows, rosters] = (
+        mu_p.reshape(seasons, width), phi_p.reshape(seasons, width), sigma_p.reshape(seasons, width)
+    )
+
+def _team1_expected(mu, phi, rosters):
+    # Mean E over every team 1 / team 2 pair, as predict.team_win_probability
+    t = rosters.shape[1] // 2
+    rows = np.arange(len(rosters))[:, None]
+    m, p = mu[rows, rosters], phi[rows, rosters]
+    e = glicko.E(m[:, :t, None], m[:, None, t:], p[:, None, t:])
+    return e.mean(axis=(1, 2))
+
+def _simulate_batch(task):
+    # One batch of seasons. Returns (rank_counts (N, ranks + 1), summed final
+    # ratings (N,), first overtake per pair as counts (P, matches + 1) where
+    # the last column is "not within the season").
+    mu0, phi0, sigma0, seasons, matches, team_size, ranks, pairs, seed = task
+    rng = np.random.default_rng(seed)
+    n = len(mu0)
+    mu = np.repeat(mu0[None, :], seasons, axis=0)
+    phi = np.repeat(phi0[None, :], seasons, axis=0)
+    sigma = np.repeat(sigma0[None, :], seasons, axis=0)
+
+    never = matches
+    first = np.full((seasons, len(pairs)), never)
+    for match in range(matches):
+        rosters = _rosters(rng, seasons, n, 2 * team_size)
+        team1_wins = rng.random(seasons) < _team1_expected(mu, phi, rosters)
+        _play(mu, phi, sigma, rosters, team1_wins)
+        if len(pairs):
+            ahead = mu[:, pairs[:, 0]] > mu[:, pairs[:, 1]]
+            first[(first == never) & ahead] = match
+
+    # place 0 is the top of the table; ties keep the lower index ahead
+    place = np.empty((seasons, n), dtype=np.int64)
+    place[np.arange(seasons)[:, None], np.argsort(-mu, axis=1, kind="stable")] = np.arange(n)
+    place = np.minimum(place, ranks)
+    rank_counts = np.bincount((np.arange(n) * (ranks + 1) + place).ravel(), minlength=n * (ranks + 1))
+    overtakes = np.bincount((np.arange(len(pairs)) * (matches + 1) + first).ravel(), minlength=len(pairs) * (matches + 1))
+    return (rank_counts.reshape(n, ranks + 1), glicko.from_mu(mu).sum(axis=0),
+            overtakes.reshape(len(pairs), matches + 1))
+
+#endregion
+
+def simulate_season(player_ids=None, seasons=10000, matches=200, team_size=TEAM_SIZE, overtakes=None,
+                    seed=0, workers=None, batch=BATCH, conn=None):
+    # Forecast the table after `matches` more games. player_ids is the pool
+    # teams are drawn from (default: everyone); overtakes is a list of
+    # (chaser, leader) id pairs, by default each player and the one just
+    # above them now. Returns a dict:
+    #   ids            pool ids, best current rating first
+    #   rank_counts    (N, ranks + 1) seasons finishing in each place, the
+    #                  last column pooling every place below `ranks`
+    #   mean_rating    (N,) average final rating
+    #   overtakes      [(chaser, leader, p, median)]: chance the chaser is
+    #                  rated above the leader after some match this season,
+    #                  and the median match count it takes (None when it
+    #                  happens in under half the seasons)
+    conn = conn or main.get_connection()
+    if player_ids is None:
+        rows = conn.execute("SELECT id, rating, rd, vol FROM players").fetchall()
+    else:
+        player_ids = list(dict.fromkeys(player_ids))
+        rows = conn.execute(
+            f"SELECT id, rating, rd, vol FROM players WHERE id IN ({','.join('?' * len(player_ids))})", player_ids
+        ).fetchall()
+        missing = set(player_ids) - {row[0] for row in rows}
+        if missing:
+            raise ValueError(f"unknown players: {sorted(missing)}")
+    if len(rows) < 2 * team_size:
+        raise ValueError(f"need at least {2 * team_size} players for {team_size}-a-side matches")
+
+    rows.sort(key=lambda row: (-row[1], row[0]))
+    ids = [row[0] for row in rows]
+    state = np.array([row[1:] for row in rows], dtype=float)
+    mu0, phi0, sigma0 = glicko.to_mu(state[:, 0]), glicko.to_phi(state[:, 1]), state[:, 2]
+
+    index = {pid: i for i, pid in enumerate(ids)}
+    if overtakes is None:
+        pairs = np.array([(i + 1, i) for i in range(len(ids) - 1)], dtype=np.int64).reshape(-1, 2)
+    else:
+        unknown = {pid for pair in overtakes for pid in pair} - index.keys()
+        if unknown:
+            raise ValueError(f"overtake players not in the pool: {sorted(unknown)}")
+        pairs = np.array([(index[a], index[b]) for a, b in overtakes], dtype=np.int64).reshape(-1, 2)
+
+    ranks = min(RANKS, len(ids))
+    sizes = [min(batch, seasons - start) for start in range(0, seasons, batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(mu0, phi0, sigma0, size, matches, team_size, ranks, pairs, s) for size, s in zip(sizes, seeds)]
+
+    if workers is None:
+        workers = min(len(tasks), os.cpu_count() or 1)
+    if workers > 1:
+        from leagues import process_pool
+        with process_pool(workers) as executor:
+            parts = list(executor.map(_simulate_batch, tasks))
+    else:
+        parts = [_simulate_batch(task) for task in tasks]
+
+    rank_counts = sum(part[0] for part in parts)
+    mean_rating = sum(part[1] for part in parts) / seasons
+    first = sum(part[2] for part in parts)
+    overtake_rows = []
+    for (a, b), counts in zip(pairs.tolist(), first):
+        within = counts[:-1].cumsum()
+        median = int(np.searchsorted(within, seasons / 2)) + 1 if within[-1] >= seasons / 2 else None
+        overtake_rows.append((ids[a], ids[b], float(within[-1] / seasons), median))
+    return {
+        "ids": ids,
+        "seasons": seasons,
+        "rank_counts": rank_counts,
+        "mean_rating": mean_rating,
+        "overtakes": overtake_rows,
+    }
+
+def finish_odds(result, places=1):
+    # {player id: chance of finishing in the top `places`}
+    top = result["rank_counts"][:, :places].sum(axis=1) / result["seasons"]
+    return dict(zip(result["ids"], top.tolist()))
+
+def expected_place(result):
+    # {player id: mean finishing place, 1 = top}; pooled places count as ranks + 1
+    counts = result["rank_counts"]
+    places = np.arange(1, counts.shape[1] + 1)
+    return dict(zip(result["ids"], ((counts * places).sum(axis=1) / result["seasons"]).tolist()))
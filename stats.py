@@ -0,0 +1,324 @@
+import main
+from instrument import measured
+
+# Win/loss summaries kept alongside the match history so nothing has to join
+# teams x team_players x teams to answer them:
+#
+#   player_stats   per player: wins, losses, the current streak (+3 is three
+#                  wins in a row, -2 two losses), the longest winning streak,
+#                  and the (date, id) of the last decided match the streak
+#                  counts up to
+#   player_pairs   per ordered pair of players who met: games and wins
+#                  together, games and wins of player_id against other_id
+#
+# Only decided matches count, rated or not. Writers take a before() of the
+# match, change it, then pass that to update(), which applies the difference.
+# Streaks extend in place when a result lands after the player's last one
+# and are re-read from the history otherwise; bulk writers can collect those
+# players and re-read them once at the end (add_results, reread_streaks).
+
+ID_BATCH = 500  # player ids per IN (...) lookup
+
+#region BUILD
+
+# Streaks as runs of equal results per player in (date, id) order: n - k is
+# constant along a run, where n numbers all of a player's results and k only
+# those with the same outcome
+_RUNS = """
+    WITH results AS (
+        SELECT tp.player_id AS pid, t.is_winner AS won, m.date AS date, m.id AS match_id,
+               ROW_NUMBER() OVER (PARTITION BY tp.player_id ORDER BY m.date, m.id) AS n,
+               ROW_NUMBER() OVER (PARTITION BY tp.player_id, t.is_winner ORDER BY m.date, m.id) AS k
+        FROM team_players tp
+        JOIN teams t ON t.id = tp.team_id
+        JOIN matches m ON m.id = t.match_id
+        WHERE t.is_winner IS NOT NULL {where}
+    ),
+    runs AS (
+        -- date and match_id come from the run's last row, the one with MAX(n)
+        SELECT pid, won, COUNT(*) AS length, MAX(n), date, match_id,
+               ROW_NUMBER() OVER (PARTITION BY pid ORDER BY MAX(n) DESC) AS recent
+        FROM results GROUP BY pid, won, n - k
+    )
+    SELECT pid, SUM(CASE WHEN won THEN length ELSE 0 END), SUM(CASE WHEN won THEN 0 ELSE length END),
+           MAX(CASE WHEN recent = 1 THEN CASE WHEN won THEN length ELSE -length END END),
+           MAX(CASE WHEN won THEN length ELSE 0 END),
+           MAX(CASE WHEN recent = 1 THEN date END), MAX(CASE WHEN recent = 1 THEN match_id END)
+    FROM runs GROUP BY pid
+"""
+
+_PAIRS = """
+    SELECT a.player_id, b.player_id,
+           SUM(ta.id = tb.id), SUM(ta.id = tb.id AND ta.is_winner),
+           SUM(ta.id != tb.id), SUM(ta.id != tb.id AND ta.is_winner)
+    FROM team_players a
+    JOIN teams ta ON ta.id = a.team_id
+    JOIN teams tb ON tb.match_id = ta.match_id
+    JOIN team_players b ON b.team_id = tb.id AND b.player_id != a.player_id
+    WHERE ta.is_winner IS NOT NULL AND tb.is_winner IS NOT NULL
+    GROUP BY a.player_id, b.player_id
+"""
+
+def fill(cur, stats_table="player_stats", pairs_table="player_pairs"):
+    # Recompute both tables from the match history
+    cur.execute(f"DELETE FROM {stats_table}")
+    cur.execute(f"DELETE FROM {pairs_table}")
+    cur.execute(f"INSERT INTO {stats_table} {_RUNS.format(where='')}")
+    cur.execute(f"INSERT INTO {pairs_table} {_PAIRS}")
+
+@measured
+def rebuild_stats(conn=None):
+    # Returns (players, pairs) written
+    with main.transaction(conn) as conn:
+        cur = conn.cursor()
+        fill(cur)
+        main.on_commit(conn, lambda path=main.DB: main.invalidate_player_cache(path))
+        return (cur.execute("SELECT COUNT(*) FROM player_stats").fetchone()[0],
+                cur.execute("SELECT COUNT(*) FROM player_pairs").fetchone()[0])
+
+@measured
+def check_stats(conn=None):
+    # Rows where the maintained tables differ from a fresh rebuild, as
+    # {"player_stats": n, "player_pairs": n}. The rebuild goes into temp
+    # tables inside a read transaction that is rolled back, not through
+    # main.transaction(), so writers are not held up and the league's write
+    # generation stays where it is.
+    conn = conn or main.get_connection()
+    own = not conn.in_transaction
+    conn.execute("BEGIN" if own else "SAVEPOINT check_stats")
+    try:
+        cur = conn.cursor()
+        cur.execute("CREATE TEMP TABLE stats_check AS SELECT * FROM player_stats WHERE 0")
+        cur.execute("CREATE TEMP TABLE pairs_check AS SELECT * FROM player_pairs WHERE 0")
+        fill(cur, "temp.stats_check", "temp.pairs_check")
+        counts = {}
+        for table, check in (("player_stats", "temp.stats_check"), ("player_pairs", "temp.pairs_check")):
+            counts[table], = cur.execute(f"""
+                SELECT COUNT(*) FROM (
+                    SELECT * FROM (SELECT * FROM main.{table} EXCEPT SELECT * FROM {check})
+                    UNION ALL
+                    SELECT * FROM (SELECT * FROM {check} EXCEPT SELECT * FROM main.{table})
+                )
+            """).fetchone()
+        return counts
+    finally:
+        if own:
+            conn.execute("ROLLBACK")
+        else:
+            conn.execute("ROLLBACK TO check_stats")
+            conn.execute("RELEASE check_stats")
+
+#endregion
+
+#region INCREMENTAL
+
+def before(cur, match_id):
+    # The match as the tables currently count it: (date, {pid: won}), with
+    # an empty dict while it has no result
+    rows = cur.execute("""
+        SELECT m.date, t.is_winner, tp.player_id
+        FROM matches m
+        JOIN teams t ON t.match_id = m.id
+        JOIN team_players tp ON tp.team_id = t.id
+        WHERE m.id = ?
+    """, (match_id,)).fetchall()
+    if not rows or any(is_winner is None for _, is_winner, _ in rows):
+        return None, {}
+    return rows[0][0], {pid: bool(is_winner) for _, is_winner, pid in rows}
+
+def update(cur, match_id, old):
+    # Apply the difference between `old` (from before()) and the match now.
+    # Returns True when anything changed.
+    match_date, new = before(cur, match_id)
+    match_date = match_date or old[0]
+    if old[1] == new:
+        return False
+    _apply(cur, [(match_date, match_id, old[1], new)])
+    return True
+
+def add_results(cur, results, stale=None):
+    # Newly decided matches as (match_id, date, winners, losers), for bulk
+    # writers that insert results without going through set_match_result.
+    # With a `stale` set, players whose streaks need re-reading from the
+    # history are added to it instead; pass it to reread_streaks when done.
+    changes = [
+        (match_date, match_id, {}, {**dict.fromkeys(losers, False), **dict.fromkeys(winners, True)})
+        for match_id, match_date, winners, losers in results
+    ]
+    _apply(cur, changes, stale, _result_pairs([new for _, _, _, new in changes]))
+
+def reread_streaks(cur, pids):
+    _reread(cur, sorted(pids))
+
+def _pair_counts(result, sign, pairs):
+    # result is {pid: won}; adds sign x its pair counts into pairs
+    for a, won in result.items():
+        for b, other_won in result.items():
+            if a == b:
+                continue
+            counts = pairs.setdefault((a, b), [0, 0, 0, 0])
+            if won == other_won:
+                counts[0] += sign
+                counts[1] += sign * won
+            else:
+                counts[2] += sign
+                counts[3] += sign * won
+
+def _result_pairs(results):
+    # _pair_counts for many new {pid: won} results at once, with NumPy: a
+    # thousand six-a-side matches make 132,000 pair increments. Returns
+    # (player, other, games with, wins with, games against, wins against)
+    # rows in key order.
+    import numpy as np
+
+    pids, won, sizes = [], [], []
+    for result in results:
+        pids.extend(result)
+        won.extend(result.values())
+        sizes.append(len(result))
+    if not pids:
+        return []
+    pids, won, sizes = np.array(pids, dtype=np.int64), np.array(won, dtype=bool), np.array(sizes, dtype=np.int64)
+    # every entry once per player of its match, beside that player
+    repeat = np.repeat(sizes, sizes)
+    left = np.repeat(np.arange(len(pids)), repeat)
+    walk = np.arange(len(left)) - np.repeat(np.cumsum(repeat) - repeat, repeat)
+    right = np.repeat(np.repeat(np.cumsum(sizes) - sizes, sizes), repeat) + walk
+    left, right = left[left != right], right[left != right]
+
+    span = int(pids.max()) + 1
+    keys, index = np.unique(pids[left] * span + pids[right], return_inverse=True)
+    together, wins = won[left] == won[right], won[left]
+    counts = [np.bincount(index, weights=w, minlength=len(keys)).astype(np.int64).tolist()
+              for w in (together, together & wins, ~together, ~together & wins)]
+    return list(zip((keys // span).tolist(), (keys % span).tolist(), *counts))
+
+def _apply(cur, changes, stale=None, pairs=None):
+    # pairs: the changes' pair rows when the caller has already counted them
+    counted, totals, appended, reread = {}, {}, {}, set()
+    for match_date, match_id, old, new in changes:
+        if pairs is None:
+            _pair_counts(old, -1, counted)
+            _pair_counts(new, 1, counted)
+        for pid in old.keys() | new.keys():
+            if old.get(pid) == new.get(pid):
+                continue
+            wins, losses = totals.get(pid, (0, 0))
+            for result, sign in ((old.get(pid), -1), (new.get(pid), 1)):
+                if result is not None:
+                    wins, losses = (wins + sign, losses) if result else (wins, losses + sign)
+            totals[pid] = (wins, losses)
+            if pid in old:
+                reread.add(pid)
+            else:
+                appended.setdefault(pid, []).append((match_date, match_id, new[pid]))
+
+    if pairs is None:
+        pairs = [(a, b, *counts) for (a, b), counts in counted.items() if any(counts)]
+    cur.executemany("""
+        INSERT INTO player_pairs (player_id, other_id, games_with, wins_with, games_against, wins_against)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (player_id, other_id) DO UPDATE SET
+            games_with = games_with + excluded.games_with,
+            wins_with = wins_with + excluded.wins_with,
+            games_against = games_against + excluded.games_against,
+            wins_against = wins_against + excluded.wins_against
+    """, pairs)
+    cur.executemany(
+        "DELETE FROM player_pairs WHERE player_id = ? AND other_id = ? AND games_with = 0 AND games_against = 0",
+        [(a, b) for a, b, games_with, _, games_against, _ in pairs if games_with < 0 or games_against < 0]
+    )
+
+    # streaks: extend in place when every new result comes after the last one
+    current = _current(cur, list(totals))
+    streaks = []
+    for pid, results in appended.items():
+        if pid in reread or (stale is not None and pid in stale):
+            continue
+        results.sort()
+        streak, best, last_date, last_match = current.get(pid, (0, 0, "", 0))
+        if (results[0][0], results[0][1]) <= (last_date, last_match):
+            reread.add(pid)
+            continue
+        for last_date, last_match, won in results:
+            streak = (max(streak, 0) + 1) if won else (min(streak, 0) - 1)
+            best = max(best, streak)
+        streaks.append((pid, streak, best, last_date, last_match))
+
+    cur.executemany("""
+        INSERT INTO player_stats (player_id, wins, losses, streak, best_streak, last_date, last_match)
+        VALUES (?, ?, ?, 0, 0, NULL, NULL)
+        ON CONFLICT (player_id) DO UPDATE SET wins = wins + excluded.wins, losses = losses + excluded.losses
+    """, [(pid, wins, losses) for pid, (wins, losses) in totals.items()])
+    cur.executemany(
+        "UPDATE player_stats SET streak = ?, best_streak = ?, last_date = ?, last_match = ? WHERE player_id = ?",
+        [(streak, best, last_date, last_match, pid) for pid, streak, best, last_date, last_match in streaks]
+    )
+    if stale is None:
+        _reread(cur, sorted(reread))
+    else:
+        stale.update(reread)
+    cur.execute("DELETE FROM player_stats WHERE wins = 0 AND losses = 0")
+
+def _current(cur, pids):
+    current = {}
+    for i in range(0, len(pids), ID_BATCH):
+        batch = pids[i:i + ID_BATCH]
+        for pid, *row in cur.execute(f"""
+            SELECT player_id, streak, best_streak, last_date, last_match FROM player_stats
+            WHERE player_id IN ({','.join('?' * len(batch))})
+        """, batch):
+            current[pid] = tuple(row)
+    return current
+
+def _reread(cur, pids):
+    # Streaks of these players walked from their whole history in (date, id)
+    # order; one ordered scan is cheaper than the runs in _RUNS. Anyone left
+    # with no results is not found here; _apply drops their row.
+    for i in range(0, len(pids), ID_BATCH):
+        batch = pids[i:i + ID_BATCH]
+        streaks = {}
+        for pid, won, match_date, match_id in cur.execute(f"""
+            SELECT tp.player_id, t.is_winner, m.date, m.id
+            FROM team_players tp
+            JOIN teams t ON t.id = tp.team_id
+            JOIN matches m ON m.id = t.match_id
+            WHERE t.is_winner IS NOT NULL AND tp.player_id IN ({','.join('?' * len(batch))})
+            ORDER BY tp.player_id, m.date, m.id
+        """, batch):
+            streak, best, _, _ = streaks.get(pid, (0, 0, None, None))
+            streak = (max(streak, 0) + 1) if won else (min(streak, 0) - 1)
+            streaks[pid] = (streak, max(best, streak), match_date, match_id)
+        cur.executemany(
+            "UPDATE player_stats SET streak = ?, best_streak = ?, last_date = ?, last_match = ? WHERE player_id = ?",
+            [(streak, best, last_date, last_match, pid) for pid, (streak, best, last_date, last_match) in streaks.items()]
+        )
+
+#endregion
+
+#region READ
+
+@measured
+def get_player_stats(conn=None):
+    # {player_id: (wins, losses, streak, best_streak)} for everyone who has a result
+    conn = conn or main.get_connection()
+    return {pid: tuple(row) for pid, *row in conn.execute(
+        "SELECT player_id, wins, losses, streak, best_streak FROM player_stats"
+    )}
+
+@measured
+def get_pair_stats(player_id, conn=None):
+    # (other_id, name, games_with, wins_with, games_against, wins_against)
+    # for everyone player_id has played with or against, most games first
+    conn = conn or main.get_connection()
+    return conn.execute("""
+        SELECT pp.other_id, p.name, pp.games_with, pp.wins_with, pp.games_against, pp.wins_against
+        FROM player_pairs pp JOIN players p ON p.id = pp.other_id
+        WHERE pp.player_id = ?
+        ORDER BY pp.games_with + pp.games_against DESC, p.name
+    """, (player_id,)).fetchall()
+
+def format_streak(streak):
+    return f"{'W' if streak > 0 else 'L'}{abs(streak)}" if streak else ""
+
+#endregion
@@ -1,27 +1,60 @@
-import sqlite3
+import json
+import os
+import time
 import tkinter as tk
 from datetime import date
-from tkinter import messagebox, ttk
+from tkinter import messagebox, simpledialog, ttk
 
+import instrument
+import main
 from main import (
     add_player,
-    add_player_to_team,
-    create_match,
-    create_team,
+    check_date,
+    get_leaderboard_snapshot,
+    get_match_teams,
+    get_matches,
+    get_matches_page,
+    get_player_names,
     get_players,
+    get_rating_period,
     get_team_players,
+    record_match,
+    search_players,
     set_match_result,
+    set_rating_period,
     set_team_players,
 )
+from leagues import DEFAULT_DB, create_league, current_league, list_leagues, use_default, use_league
+from setup.db_setup import migrate
+from stats import format_streak, get_player_stats
+from ui.virtual import VirtualTreeview
+from ui.worker import DbWorker
 
-DB = "league.db"
+STARTED = time.perf_counter()
 
 root = tk.Tk()
 root.title("6-a-Side League")
 root.geometry("1280x960")
 
 #region FRAME SWITCHING
+# Pages are built on their first visit: @page(frame) registers the function
+# that fills the frame and switch runs it once, so startup costs the same
+# however big the league is.
+builders = {}
+
+def page(frame):
+    def register(build):
+        builders[frame] = build
+        return build
+    return register
+
+def built(frame):
+    return frame not in builders
+
 def switch(frame):
+    build = builders.pop(frame, None)
+    if build:
+        build()
     frame.tkraise()
 
 frames = [tk.Frame(root) for _ in range(6)]
@@ -33,69 +66,191 @@ root.grid_rowconfigure(0, weight=1)
 root.grid_columnconfigure(0, weight=1)
 #endregion
 
+#region BACKGROUND WORK
+# All database and rating work runs on the worker thread; the status bar and
+# cursor show when something is in flight.
+status_bar = tk.Label(root, text="", anchor="w")
+status_bar.grid(row=1, column=0, sticky="ew")
+
+def show_busy(busy):
+    status_bar.config(text="Working..." if busy else "")
+    root.config(cursor="watch" if busy else "")
+
+worker = DbWorker(root, on_busy=show_busy)
+# first job: bring an older league file up to the current schema, then
+# build the player search index in the background
+worker.submit(lambda: migrate(main.DB), on_done=lambda _: main.warm_search_index())
+#endregion
+
+#region LEAGUES
+# The League menu switches every page to another league's database. The
+# switch runs on the worker so it lands between, never during, other jobs.
+menu_bar = tk.Menu(root)
+league_menu = tk.Menu(menu_bar, tearoff=0)
+menu_bar.add_cascade(label="League", menu=league_menu)
+root.config(menu=menu_bar)
+league_var = tk.StringVar(value=current_league() or "")
+
+def build_league_menu():
+    league_menu.delete(0, tk.END)
+    league_menu.add_radiobutton(label=f"Default ({os.path.basename(DEFAULT_DB)})", variable=league_var, value="",
+                                command=lambda: switch_league(""))
+    for name in list_leagues():
+        league_menu.add_radiobutton(label=name, variable=league_var, value=name, command=lambda n=name: switch_league(n))
+    league_menu.add_separator()
+    league_menu.add_command(label="New League...", command=new_league)
+    league_menu.add_command(label="Rating Period...", command=edit_rating_period)
+
+def switch_league(name):
+    # "" is the default league
+    def done(_):
+        league_var.set(name)
+        root.title(f"6-a-Side League - {name}" if name else "6-a-Side League")
+        main.warm_search_index()
+        team1.clear()
+        team2.clear()
+        update_team_labels()
+        refresh_players()
+        switch(add_player_frame)
+
+    if name:
+        worker.submit(use_league, name, on_done=done)
+    else:
+        worker.submit(use_default, on_done=done)
+
+def new_league():
+    name = simpledialog.askstring("New League", "League name:", parent=root)
+    if not name:
+        return
+
+    def done(_):
+        build_league_menu()
+        switch_league(name)
+
+    worker.submit(create_league, name, on_done=done)
+
+def edit_rating_period():
+    # Stored with the league, so the CLI and server rate it the same way
+    def ask(current):
+        value = simpledialog.askstring("Rating Period", "day, week, a match count, or off:",
+                                       initialvalue=str(current or "off"), parent=root)
+        if value is not None:
+            worker.submit(set_rating_period, value, on_done=lambda _: refresh_players())
+
+    worker.submit(get_rating_period, on_done=ask)
+
+build_league_menu()
+if league_var.get():
+    root.title(f"6-a-Side League - {league_var.get()}")
+#endregion
+
 #region PAGE 1: ADD PLAYER
-tk.Label(add_player_frame, text="Add Player", font=("Arial", 16)).pack(pady=10)
-entry_name = tk.Entry(add_player_frame)
-entry_full_name = tk.Entry(add_player_frame)
-entry_name.pack(pady=5)
-entry_full_name.pack(pady=5)
+@page(add_player_frame)
+def build_add_player():
+    global entry_name, entry_full_name
+    tk.Label(add_player_frame, text="Add Player", font=("Arial", 16)).pack(pady=10)
+    entry_name = tk.Entry(add_player_frame)
+    entry_full_name = tk.Entry(add_player_frame)
+    entry_name.pack(pady=5)
+    entry_full_name.pack(pady=5)
+
+    tk.Button(add_player_frame, text="Add", command=add_player_ui).pack(pady=10)
+    tk.Button(add_player_frame, text="Go to Matches", command=lambda: switch(match_frame)).pack(pady=5)
+    tk.Button(add_player_frame, text="View Matches", command=lambda: [switch(view_matches_frame), refresh_view_matches()]).pack(pady=5)
+    tk.Button(add_player_frame, text="Set Match Result", command=lambda: [switch(set_result_frame), refresh_matches()]).pack(pady=5)
+    tk.Button(add_player_frame, text="Player Rankings",
+              command=lambda: [switch(player_rank_frame), refresh_player_rankings()]).pack(pady=5)
 
 def add_player_ui():
     name = entry_name.get()
     full_name = entry_full_name.get()
     if not name:
         return
-    add_player(name, full_name)
-    entry_name.delete(0, tk.END)
-    entry_full_name.delete(0, tk.END)
-    messagebox.showinfo("Done", f"Player '{name}' added.")
-    refresh_players()
 
-tk.Button(add_player_frame, text="Add", command=add_player_ui).pack(pady=10)
-tk.Button(add_player_frame, text="Go to Matches", command=lambda: switch(match_frame)).pack(pady=5)
-tk.Button(add_player_frame, text="View Matches", command=lambda: [refresh_view_matches(), switch(view_matches_frame)]).pack(pady=5)
-tk.Button(add_player_frame, text="Set Match Result", command=lambda: [refresh_matches(), switch(set_result_frame)]).pack(pady=5)
-tk.Button(add_player_frame, text="Player Rankings",
-          command=lambda: [refresh_player_rankings(), switch(player_rank_frame)]).pack(pady=5)
+    def done(_):
+        entry_name.delete(0, tk.END)
+        entry_full_name.delete(0, tk.END)
+        messagebox.showinfo("Done", f"Player '{name}' added.")
+        refresh_players()
+
+    worker.submit(add_player, name, full_name, on_done=done)
 #endregion
 
 #region PAGE 2: CREATE MATCH
-tk.Label(match_frame, text="Create Match", font=("Arial", 16)).pack(pady=10)
-match_date = tk.Entry(match_frame)
-match_date.insert(0, str(date.today()))
-match_date.pack(pady=5)
+@page(match_frame)
+def build_match():
+    global match_date
+    tk.Label(match_frame, text="Create Match", font=("Arial", 16)).pack(pady=10)
+    match_date = tk.Entry(match_frame)
+    match_date.insert(0, str(date.today()))
+    match_date.pack(pady=5)
 
-def start_match():
-    m_id = create_match(match_date.get())
-    begin_team_selection(m_id)
+    tk.Button(match_frame, text="Next: Pick Teams", command=start_match).pack(pady=20)
+    tk.Button(match_frame, text="Back", command=lambda: switch(add_player_frame)).pack()
 
-tk.Button(match_frame, text="Next: Pick Teams", command=start_match).pack(pady=20)
-tk.Button(match_frame, text="Back", command=lambda: switch(add_player_frame)).pack()
+def start_match():
+    try:
+        begin_team_selection(check_date(match_date.get().strip()))
+    except ValueError as e:
+        messagebox.showerror("Error", str(e))
 #endregion
 
 #region PAGE 3: TEAM SELECTION
-tk.Label(team_pick_frame, text="Pick Teams", font=("Arial", 16)).pack(pady=10)
-
-players_list = ttk.Treeview(team_pick_frame, columns=("id", "name", "elo"), show="headings", height=12)
-players_list.heading("id", text="ID")
-players_list.heading("name", text="Name")
-players_list.heading("elo", text="ELO")
-players_list.pack(pady=10)
-
 team1, team2 = [], []
 
+@page(team_pick_frame)
+def build_team_pick():
+    global player_filter, players_list, lbl_team1, lbl_team2, lbl_odds
+    tk.Label(team_pick_frame, text="Pick Teams", font=("Arial", 16)).pack(pady=10)
+
+    # typing in the search box narrows the list as you go
+    player_filter = tk.StringVar()
+    filter_row = tk.Frame(team_pick_frame)
+    tk.Label(filter_row, text="Search:").pack(side="left")
+    tk.Entry(filter_row, textvariable=player_filter, width=30).pack(side="left")
+    filter_row.pack()
+
+    players_box = tk.Frame(team_pick_frame)
+    players_scroll = ttk.Scrollbar(players_box, orient="vertical")
+    players_list = VirtualTreeview(players_box, scrollbar=players_scroll, columns=("id", "name", "elo"),
+                                   show="headings", height=12)
+    players_list.heading("id", text="ID")
+    players_list.heading("name", text="Name")
+    players_list.heading("elo", text="ELO")
+    players_scroll.pack(side="right", fill="y")
+    players_list.pack()
+    players_box.pack(pady=10)
+    player_filter.trace_add("write", lambda *_: refresh_players())
+
+    lbl_team1 = tk.Label(team_pick_frame, text="Team 1: []")
+    lbl_team1.pack()
+    lbl_team2 = tk.Label(team_pick_frame, text="Team 2: []")
+    lbl_team2.pack()
+
+    tk.Button(team_pick_frame, text="Add to Team 1", command=lambda: add_to_team(team1)).pack(pady=5)
+    tk.Button(team_pick_frame, text="Add to Team 2", command=lambda: add_to_team(team2)).pack(pady=5)
+    tk.Button(team_pick_frame, text="Balance Teams", command=balance_teams).pack(pady=5)
+
+    save_row = tk.Frame(team_pick_frame)
+    save_row.pack(pady=20)
+    tk.Button(save_row, text="Save Teams", command=finalize_teams).pack(side="left")
+    lbl_odds = tk.Label(save_row, text="")
+    lbl_odds.pack(side="left", padx=10)
+
 def refresh_players():
-    players_list.delete(*players_list.get_children())
-    for pid, name, rating in get_players():
-        players_list.insert("", "end", values=(pid, name, round(rating)))
+    if not built(team_pick_frame):
+        return
+
+    def draw(players):
+        players_list.set_rows([(pid, name, round(rating)) for pid, name, rating in players])
 
-refresh_players()
+    worker.submit(search_players, player_filter.get(), on_done=draw, key="players")
 
 def add_to_team(team):
-    sel = players_list.focus()
-    if not sel:
+    row = players_list.focused_row()
+    if row is None:
         return
-    pid, name, rating = players_list.item(sel)["values"]
+    pid, name, rating = row
     if pid in team1 or pid in team2:
         messagebox.showwarning("Oops", "Player already selected.")
         return
@@ -103,35 +258,63 @@ def add_to_team(team):
     update_team_labels()
 
 def update_team_labels():
-    def names(team):
-        if not team:
-            return []
-        with sqlite3.connect(DB) as conn:
-            return [name for (name,) in conn.execute(
-                "SELECT name FROM players WHERE id IN (%s)" % ",".join("?"*len(team)), team
-            )]
-    lbl_team1.config(text="Team 1: " + ", ".join(names(team1)))
-    lbl_team2.config(text="Team 2: " + ", ".join(names(team2)))
-
-lbl_team1 = tk.Label(team_pick_frame, text="Team 1: []")
-lbl_team1.pack()
-lbl_team2 = tk.Label(team_pick_frame, text="Team 2: []")
-lbl_team2.pack()
-
-tk.Button(team_pick_frame, text="Add to Team 1", command=lambda: add_to_team(team1)).pack(pady=5)
-tk.Button(team_pick_frame, text="Add to Team 2", command=lambda: add_to_team(team2)).pack(pady=5)
+    if not built(team_pick_frame):
+        return
+    picked1, picked2 = list(team1), list(team2)
+
+    def draw(names):
+        names1, names2 = names
+        lbl_team1.config(text="Team 1: " + ", ".join(names1))
+        lbl_team2.config(text="Team 2: " + ", ".join(names2))
+
+    worker.submit(lambda: (get_player_names(picked1), get_player_names(picked2)), on_done=draw, key="team_labels")
+    refresh_odds()
+
+def refresh_odds():
+    if not team1 or not team2:
+        lbl_odds.config(text="")
+        return
+
+    def find():
+        from predict import predict_match
+        return predict_match(list(team1), list(team2))
+
+    def draw(pred):
+        gain1 = sum(pred["team1_wins"][pid] for pid in team1) / len(team1)
+        gain2 = sum(pred["team2_wins"][pid] for pid in team2) / len(team2)
+        lbl_odds.config(text=f"Team 1 {pred['team1']:.0%} (win: {gain1:+.0f} each)  -  "
+                             f"Team 2 {1 - pred['team1']:.0%} (win: {gain2:+.0f} each)")
+
+    worker.submit(find, on_done=draw, key="odds")
+
+def balance_teams():
+    # Split the highlighted players (or everyone already picked) into the two
+    # teams closest to an even match; from more than two full teams, pick
+    # who plays
+    pool = [row[0] for row in players_list.selected_rows()] or team1 + team2
+    if len(pool) < 2:
+        messagebox.showwarning("Oops", "Select the available players first.")
+        return
+
+    def find():
+        from matchmaking import balanced_teams
+        from simulate import TEAM_SIZE
+        return balanced_teams(pool, TEAM_SIZE if len(pool) > 2 * TEAM_SIZE else None, count=1, workers=1)
+
+    def done(candidates):
+        p, first, second = candidates[0]
+        team1[:], team2[:] = first, second
+        update_team_labels()
+        messagebox.showinfo("Balanced", f"Team 1 win chance: {p:.0%}")
+
+    worker.submit(find, on_done=done)
 
 def finalize_teams():
-    team1_id = create_team(current_match_id, None)
-    team2_id = create_team(current_match_id, None)
-    for p in team1:
-        add_player_to_team(team1_id, p)
-    for p in team2:
-        add_player_to_team(team2_id, p)
-    messagebox.showinfo("Done", "Teams saved. You can set the result later.")
-    reset_team_selection()
+    def done(_):
+        messagebox.showinfo("Done", "Teams saved. You can set the result later.")
+        reset_team_selection()
 
-tk.Button(team_pick_frame, text="Save Teams", command=finalize_teams).pack(pady=20)
+    worker.submit(record_match, current_match_date, list(team1), list(team2), on_done=done)
 
 def reset_team_selection():
     team1.clear()
@@ -139,108 +322,113 @@ def reset_team_selection():
     update_team_labels()
     switch(add_player_frame)
 
-def begin_team_selection(match_id):
-    global current_match_id
-    current_match_id = match_id
-    refresh_players()
+def begin_team_selection(match_date):
+    global current_match_date
+    current_match_date = match_date
     switch(team_pick_frame)
+    refresh_players()
 #endregion
 
 #region PAGE 4: SET MATCH RESULT
-tk.Label(set_result_frame, text="Set Match Result", font=("Arial", 16)).pack(pady=10)
-
-match_list = ttk.Treeview(set_result_frame, columns=("id", "date"), show="headings", height=10)
-match_list.heading("id", text="ID")
-match_list.heading("date", text="Date")
-match_list.pack(pady=10)
-
-team_list = ttk.Treeview(set_result_frame, columns=("id", "players"), show="headings", height=5)
-team_list.heading("id", text="ID")
-team_list.heading("players", text="Players")
-team_list.pack(pady=10)
+@page(set_result_frame)
+def build_set_result():
+    global match_list, team_list
+    tk.Label(set_result_frame, text="Set Match Result", font=("Arial", 16)).pack(pady=10)
+
+    match_box = tk.Frame(set_result_frame)
+    match_scroll = ttk.Scrollbar(match_box, orient="vertical")
+    match_list = VirtualTreeview(match_box, scrollbar=match_scroll, columns=("id", "date"), show="headings", height=10)
+    match_list.heading("id", text="ID")
+    match_list.heading("date", text="Date")
+    match_scroll.pack(side="right", fill="y")
+    match_list.pack()
+    match_box.pack(pady=10)
+    match_list.bind("<<RowSelect>>", refresh_teams)
+
+    team_list = ttk.Treeview(set_result_frame, columns=("id", "players"), show="headings", height=5)
+    team_list.heading("id", text="ID")
+    team_list.heading("players", text="Players")
+    team_list.pack(pady=10)
+
+    tk.Button(set_result_frame, text="Set Selected Team as Winner", command=select_winner).pack(pady=10)
+    tk.Button(set_result_frame, text="Back", command=lambda: switch(add_player_frame)).pack(pady=5)
 
 def refresh_matches():
-    match_list.delete(*match_list.get_children())
-    with sqlite3.connect(DB) as conn:
-        for mid, mdate in conn.execute("SELECT id, date FROM matches ORDER BY date"):
-            match_list.insert("", "end", values=(mid, mdate))
+    worker.submit(get_matches, on_done=match_list.set_rows, key="matches")
 
 def refresh_teams(event=None):
-    sel = match_list.focus()
-    if not sel:
+    row = match_list.focused_row()
+    if row is None:
         return
-    match_id = match_list.item(sel)["values"][0]
+    match_id = row[0]
     team_list.delete(*team_list.get_children())
-    with sqlite3.connect(DB) as conn:
-        teams = conn.execute("SELECT id FROM teams WHERE match_id = ?", (match_id,)).fetchall()
-        for tid, in teams:
-            players = [name for (name,) in conn.execute(
-                "SELECT p.name FROM players p JOIN team_players tp ON p.id = tp.player_id WHERE tp.team_id = ?", (tid,)
-            )]
-            team_list.insert("", "end", values=(tid, ", ".join(players)))
 
-match_list.bind("<<TreeviewSelect>>", refresh_teams)
+    def draw(teams):
+        team_list.delete(*team_list.get_children())
+        for tid, players in teams:
+            team_list.insert("", "end", values=(tid, players))
+
+    # clicking through matches quickly only draws the last one selected
+    worker.submit(get_match_teams, match_id, on_done=draw, key="match_teams")
 
 def select_winner():
-    match_sel = match_list.focus()
+    match_row = match_list.focused_row()
     team_sel = team_list.focus()
-    if not match_sel or not team_sel:
+    if match_row is None or not team_sel:
         messagebox.showwarning("Oops", "Select a match and a team")
         return
-    match_id = match_list.item(match_sel)["values"][0]
+    match_id = match_row[0]
     winning_team_id = team_list.item(team_sel)["values"][0]
-    set_match_result(match_id, winning_team_id)
-    messagebox.showinfo("Done", "Match result set and ELO updated.")
-    refresh_teams()
 
-tk.Button(set_result_frame, text="Set Selected Team as Winner", command=select_winner).pack(pady=10)
-tk.Button(set_result_frame, text="Back", command=lambda: switch(add_player_frame)).pack(pady=5)
+    def done(_):
+        messagebox.showinfo("Done", "Match result set and ELO updated.")
+        refresh_teams()
+
+    worker.submit(set_match_result, match_id, winning_team_id, on_done=done)
 #endregion
 
 #region PAGE 5: VIEW MATCHES
-view_matches_frame = tk.Frame(root)
-view_matches_frame.grid(row=0, column=0, sticky="nsew")
-# add hidden columns for team IDs
-matches_list = ttk.Treeview(
-    view_matches_frame,
-    columns=("id", "date", "team1_names", "team2_names", "result", "team1_id", "team2_id"),
-    show="headings",
-    height=15
-)
-# visible columns
-matches_list.heading("id", text="Match ID")
-matches_list.heading("date", text="Date")
-matches_list.heading("team1_names", text="Team 1 Players")
-matches_list.heading("team2_names", text="Team 2 Players")
-matches_list.heading("result", text="Result")
-
-# hidden columns for internal use
-matches_list.column("team1_id", width=0, stretch=False)
-matches_list.column("team2_id", width=0, stretch=False)
-matches_list.pack(pady=10, fill="both", expand=True)
+@page(view_matches_frame)
+def build_view_matches():
+    global matches_list
+    matches_scroll = ttk.Scrollbar(view_matches_frame, orient="vertical")
+    # add hidden columns for team IDs
+    matches_list = VirtualTreeview(
+        view_matches_frame,
+        scrollbar=matches_scroll,
+        on_scroll=on_matches_scroll,
+        columns=("id", "date", "team1_names", "team2_names", "result", "team1_id", "team2_id"),
+        show="headings",
+        height=15
+    )
+    # visible columns
+    matches_list.heading("id", text="Match ID")
+    matches_list.heading("date", text="Date")
+    matches_list.heading("team1_names", text="Team 1 Players")
+    matches_list.heading("team2_names", text="Team 2 Players")
+    matches_list.heading("result", text="Result")
+
+    # hidden columns for internal use
+    matches_list.column("team1_id", width=0, stretch=False)
+    matches_list.column("team2_id", width=0, stretch=False)
+    matches_scroll.pack(side="right", fill="y")
+    matches_list.pack(pady=10, fill="both", expand=True)
+
+    tk.Button(view_matches_frame, text="Back", command=lambda: switch(add_player_frame)).pack(pady=10)
+    ttk.Button(view_matches_frame, text="Edit Team Players", command=open_edit_team_players_popup).pack(pady=5)
 
 def open_edit_team_players_popup():
-    selected = matches_list.selection()
+    selected = matches_list.selected_rows()
     if not selected:
         messagebox.showerror("Error", "Select a match first.")
         return
 
-    match_values = matches_list.item(selected[0])["values"]
-    match_id = match_values[0]
-    match_date = match_values[1]
+    match_values = selected[0]
     team1_names = match_values[2]
     team2_names = match_values[3]
-    result = match_values[4]
     team1_id = match_values[5]
     team2_id = match_values[6]
-    
-   
 
-    if result not in (None, "Pending"):
-     messagebox.showerror("Error", "Cannot edit players after match result is set.")
-     return
-
-    
     # choose which team to edit
     win = tk.Toplevel(root)
     win.title("Select Team")
@@ -252,25 +440,43 @@ def open_edit_team_players_popup():
 def open_team_editor(team_id, parent_win): 
     parent_win.destroy()
 
+    worker.submit(
+        lambda: (get_players(), get_team_players(team_id)),
+        on_done=lambda data: show_team_editor(team_id, *data),
+    )
+
+def show_team_editor(team_id, all_players, current_players):
     win = tk.Toplevel(root)
     win.title(f"Edit Team {team_id}")
     win.geometry("500x400")
 
-    # get data
-    all_players = get_players()         
-    current_players = get_team_players(team_id)
-    current_ids = {p[0] for p in current_players}
+    # the lists show names; ids are kept alongside in the same order
+    right_ids = [p[0] for p in current_players]
+    left_ids = []
+
+    search_var = tk.StringVar()
+    tk.Entry(win, textvariable=search_var).pack(fill="x", padx=10, pady=(10, 0))
 
     # UI lists
     left_list = tk.Listbox(win, selectmode=tk.MULTIPLE)
     right_list = tk.Listbox(win, selectmode=tk.MULTIPLE)
 
-    for p in all_players:
-        if p[0] not in current_ids:
-            left_list.insert(tk.END, f"{p[0]} - {p[1]}")
+    def fill_left(players):
+        if not win.winfo_exists():
+            return
+        players = [p for p in players if p[0] not in right_ids]
+        left_ids[:] = [p[0] for p in players]
+        left_list.delete(0, tk.END)
+        for p in players:
+            left_list.insert(tk.END, p[1])
+
+    def refresh_left(*_):
+        worker.submit(search_players, search_var.get(), on_done=fill_left, key="team_editor")
 
     for p in current_players:
-        right_list.insert(tk.END, f"{p[0]} - {p[1]}")
+        right_list.insert(tk.END, p[1])
+    fill_left(all_players)
+    search_var.trace_add("write", refresh_left)
 
     left_list.pack(side="left", fill="both", expand=True, padx=10, pady=10)
     right_list.pack(side="right", fill="both", expand=True, padx=10, pady=10)
@@ -278,92 +484,128 @@ def open_team_editor(team_id, parent_win):
     # move buttons
     def add():
         for index in left_list.curselection()[::-1]:
-            item = left_list.get(index)
+            right_ids.append(left_ids.pop(index))
+            right_list.insert(tk.END, left_list.get(index))
             left_list.delete(index)
-            right_list.insert(tk.END, item)
 
     def remove():
         for index in right_list.curselection()[::-1]:
-            item = right_list.get(index)
+            left_ids.append(right_ids.pop(index))
+            left_list.insert(tk.END, right_list.get(index))
             right_list.delete(index)
-            left_list.insert(tk.END, item)
 
     ttk.Button(win, text=">>", command=add).place(relx=0.47, rely=0.3)
     ttk.Button(win, text="<<", command=remove).place(relx=0.47, rely=0.5)
 
     # save
     def save():
-        new_ids = []
-        for i in range(right_list.size()):
-            pid = int(right_list.get(i).split(" - ")[0])
-            new_ids.append(pid)
+        def done(_):
+            win.destroy()
+            messagebox.showinfo("Saved", "Team players updated successfully.")
 
-        set_team_players(team_id, new_ids)
-        win.destroy()
-        messagebox.showinfo("Saved", "Team players updated successfully.")
+        worker.submit(set_team_players, team_id, list(right_ids), on_done=done)
 
     ttk.Button(win, text="Save", command=save).pack(pady=10)
 
-tk.Button(view_matches_frame, text="Back", command=lambda: switch(add_player_frame)).pack(pady=10)
-edit_players_btn = ttk.Button(view_matches_frame, text="Edit Team Players", command=open_edit_team_players_popup)
-edit_players_btn.pack(pady=5)
+MATCH_PAGE_SIZE = 100
+matches_page = {"after": None, "done": True, "loading": False}
 
 def refresh_view_matches():
-    matches_list.delete(*matches_list.get_children())  # this is the Treeview in view_matches_frame
-    with sqlite3.connect(DB) as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT id, date FROM matches ORDER BY date")
-        for match_id, match_date in cur.fetchall():
-            # get teams
-            cur.execute("SELECT id, is_winner FROM teams WHERE match_id = ?", (match_id,))
-            teams = cur.fetchall()
-            if len(teams) == 2:
-                t1_id, t1_win = teams[0]
-                t2_id, t2_win = teams[1]
-                # get player names
-                t1_players = [name for (name,) in conn.execute(
-                    "SELECT p.name FROM players p JOIN team_players tp ON p.id = tp.player_id WHERE tp.team_id = ?", (t1_id,)
-                )]
-                t2_players = [name for (name,) in conn.execute(
-                    "SELECT p.name FROM players p JOIN team_players tp ON p.id = tp.player_id WHERE tp.team_id = ?", (t2_id,)
-                )]
-                # determine result
-                if t1_win is None:
-                    result = "Pending"
-                else:
-                    result = "Team 1 Win" if t1_win else "Team 2 Win"
-                matches_list.insert("", "end", values=(match_id, match_date, ", ".join(t1_players), ", ".join(t2_players), result,t1_id, t2_id))
-            else:
-                matches_list.insert("", "end", values=(match_id, match_date, "", "", "Pending",t1_id,t2_id))
-
-
+    matches_list.set_rows([])
+    matches_page.update(after=None, done=False, loading=False)
+    load_more_matches()
+
+def load_more_matches():
+    # append the next page; the scroll handler asks for more near the bottom.
+    # A refresh supersedes any page still in flight (same worker key).
+    if matches_page["done"] or matches_page["loading"]:
+        return
+    matches_page["loading"] = True
+    worker.submit(get_matches_page, matches_page["after"], MATCH_PAGE_SIZE, on_done=draw_matches_page, key="view_matches")
+
+def draw_matches_page(rows):
+    matches_list.append_rows([
+        (match_id, match_date, t1_names, t2_names, "Pending" if winner is None else f"Team {winner} Win", t1_id or "", t2_id or "")
+        for match_id, match_date, t1_id, t1_names, t2_id, t2_names, winner in rows
+    ])
+    if rows:
+        matches_page["after"] = (rows[-1][1], rows[-1][0])
+    matches_page.update(done=len(rows) < MATCH_PAGE_SIZE, loading=False)
+
+def on_matches_scroll(first, last):
+    if last > 0.9:
+        root.after_idle(load_more_matches)
 #endregion
 
 #region PAGE 6: PLAYER RANKINGS
-player_rank_frame = tk.Frame(root)
-player_rank_frame.grid(row=0, column=0, sticky="nsew")
-tk.Label(player_rank_frame, text="Player Rankings", font=("Arial", 16)).pack(pady=10)
-
-player_tree = ttk.Treeview(player_rank_frame, columns=("id", "name", "rating"), show="headings", height=20)
-player_tree.heading("id", text="ID")
-player_tree.heading("name", text="Name")
-player_tree.heading("rating", text="Rating")
-player_tree.pack(pady=10, fill="both", expand=True)
-
-tk.Button(player_rank_frame, text="Back", command=lambda: switch(add_player_frame)).pack(pady=10)
+@page(player_rank_frame)
+def build_player_rank():
+    global player_tree
+    tk.Label(player_rank_frame, text="Player Rankings", font=("Arial", 16)).pack(pady=10)
+
+    rank_box = tk.Frame(player_rank_frame)
+    rank_scroll = ttk.Scrollbar(rank_box, orient="vertical")
+    player_tree = VirtualTreeview(rank_box, scrollbar=rank_scroll, columns=("id", "name", "rating", "wins", "losses", "streak"),
+                                  show="headings", height=20)
+    player_tree.heading("id", text="ID")
+    player_tree.heading("name", text="Name")
+    player_tree.heading("rating", text="Rating")
+    player_tree.heading("wins", text="W")
+    player_tree.heading("losses", text="L")
+    player_tree.heading("streak", text="Streak")
+    for column in ("wins", "losses", "streak"):
+        player_tree.column(column, width=60, anchor="center")
+    rank_scroll.pack(side="right", fill="y")
+    player_tree.pack(fill="both", expand=True)
+    rank_box.pack(pady=10, fill="both", expand=True)
+
+    tk.Button(player_rank_frame, text="Back", command=lambda: switch(add_player_frame)).pack(pady=10)
+
+rankings_version = None
+
+def load_rankings(since):
+    # results move the cache version too, so stats are only read for a redraw
+    version, players = get_leaderboard_snapshot(since)
+    return version, players, (None if players is None else get_player_stats())
 
 def refresh_player_rankings():
-    player_tree.delete(*player_tree.get_children())
-    players = get_players()  # returns (id, name, rating)
-    # sort descending by rating
-    players.sort(key=lambda x: x[2], reverse=True)
-    for pid, name, rating in players:
-        player_tree.insert("", "end", values=(pid, name, round(rating)))
+    def draw(snapshot):
+        global rankings_version
+        rankings_version, players, stats = snapshot
+        if players is None:  # unchanged since the last draw
+            return
+        rows = []
+        for pid, name, rating in players:
+            wins, losses, streak, _ = stats.get(pid, (0, 0, 0, 0))
+            rows.append((pid, name, round(rating), wins, losses, format_streak(streak)))
+        player_tree.set_rows(rows)
+
+    worker.submit(load_rankings, rankings_version, on_done=draw, key="rankings")
 #endregion
 
-
-
 #region START APP
+# Startup is timed from the first line after the imports to the first page
+# being built (startup_ms) and drawn (first_paint_ms). The timings go to the
+# instrument stats; with LEAGUE_UI_STARTUP=path they are also written there
+# as JSON and the app quits, which is how bench/run.py times it.
+STARTUP_FILE = os.environ.get("LEAGUE_UI_STARTUP")
+
+def report_startup(startup):
+    first_paint = time.perf_counter() - STARTED
+    instrument.record("ui.startup", startup)
+    instrument.record("ui.first_paint", first_paint)
+    if STARTUP_FILE:
+        with open(STARTUP_FILE, "w") as f:
+            json.dump({"startup_ms": 1000 * startup, "first_paint_ms": 1000 * first_paint}, f)
+        root.destroy()
+
+def on_first_expose(event):
+    add_player_frame.unbind("<Expose>")
+    # the redraw is itself an idle callback queued ahead of this one
+    root.after_idle(report_startup, startup)
+
 switch(add_player_frame)
+startup = time.perf_counter() - STARTED
+add_player_frame.bind("<Expose>", on_first_expose)
 root.mainloop()
-#endregion
\ No newline at end of file
+#endregion
@@ -0,0 +1,156 @@
+from tkinter import ttk
+
+BUFFER = 100  # rows kept inserted above and below the ones in view
+
+# Tk event state bits for a click or key that adds to the selection rather
+# than replacing it
+SHIFT, CONTROL = 0x0001, 0x0004
+
+
+def window(first, shown, total, buffer=BUFFER):
+    # Rows [lo, hi) to insert so `shown` rows from `first` are in view with
+    # up to `buffer` more on either side; also returns `first` clamped
+    first = max(0, min(first, total - shown))
+    return max(0, first - buffer), min(total, first + shown + buffer), first
+
+
+class VirtualTreeview(ttk.Treeview):
+    # A Treeview over a list of value tuples that only ever holds a window of
+    # them: the rows in view plus BUFFER either side, so filling it costs the
+    # same for 100 rows or 100k. Scrolling inside the window is the
+    # Treeview's own; coming within half a buffer of either edge re-centres
+    # the window. The scrollbar, selection and focus work over the whole
+    # list, and item ids are row indexes as strings.
+    #
+    # Bind <<RowSelect>> rather than <<TreeviewSelect>>: the window moving
+    # under the selection is not a selection change, and replacing the
+    # <<TreeviewSelect>> binding would stop the selection being tracked.
+
+    def __init__(self, master, scrollbar=None, on_scroll=None, buffer=BUFFER, **kw):
+        super().__init__(master, **kw)
+        self.rows = []
+        self.buffer = buffer
+        self.scrollbar = scrollbar
+        self.on_scroll = on_scroll    # called with (first, last) over the whole list
+        self._lo = self._hi = 0       # rows currently inserted
+        self._first, self._shown = 0, int(self.cget("height"))
+        self._selected = set()
+        self._focus = None
+        self._replace = False
+        self._recentre = False
+        self.configure(yscrollcommand=self._on_view)
+        if scrollbar is not None:
+            scrollbar.configure(command=self._scroll)
+        self.bind("<<TreeviewSelect>>", self._on_select, add="+")
+        self.bind("<ButtonPress-1>", self._on_press, add="+")
+        self.bind("<KeyPress>", self._on_press, add="+")
+
+    #region ROWS
+
+    def set_rows(self, rows):
+        # Replace the whole list, clearing the selection; the view stays
+        # where it was if the new list is long enough
+        self.rows = list(rows)
+        self._selected.clear()
+        self._focus = None
+        self.delete(*self.get_children())
+        self._lo = self._hi = 0
+        self._show(self._first)
+
+    def append_rows(self, rows):
+        self.rows.extend(rows)
+        self._show(self._first)
+
+    def focused_row(self):
+        focus = self.focus()
+        if focus:
+            self._focus = int(focus)
+        return None if self._focus is None else self.rows[self._focus]
+
+    def selected_rows(self):
+        return [self.rows[i] for i in sorted(self._selected)]
+
+    #endregion
+
+    #region WINDOW
+
+    def _show(self, first):
+        # Insert the window around row `first` and scroll it to the top
+        self._recentre = False
+        lo, hi, first = window(first, self._shown, len(self.rows), self.buffer)
+        if (lo, hi) != (self._lo, self._hi):
+            focus = self.focus()
+            if focus:
+                self._focus = int(focus)
+            keep_lo, keep_hi = max(lo, self._lo), min(hi, self._hi)
+            if keep_lo >= keep_hi:
+                keep_lo = keep_hi = lo
+            self.delete(*(str(i) for i in range(self._lo, self._hi) if not keep_lo <= i < keep_hi))
+            for i in range(lo, keep_lo):
+                self.insert("", i - lo, iid=str(i), values=self.rows[i])
+            for i in range(keep_hi, hi):
+                self.insert("", "end", iid=str(i), values=self.rows[i])
+            # rows kept keep their selection; new ones take it from the list
+            added = [str(i) for i in self._selected if lo <= i < keep_lo or keep_hi <= i < hi]
+            if added:
+                self.selection_add(added)
+            if self._focus is not None and lo <= self._focus < hi:
+                self.focus(str(self._focus))
+            self._lo, self._hi = lo, hi
+        if hi > lo:
+            self.yview_moveto((first - lo) / (hi - lo))
+        else:
+            self._report(0, 0)
+
+    def _on_view(self, first, last):
+        # The Treeview's own yscrollcommand, in fractions of the window
+        count = self._hi - self._lo
+        top = self._lo + round(float(first) * count)
+        bottom = self._lo + round(float(last) * count)
+        self._first, self._shown = top, max(1, bottom - top)
+        near_top = self._lo > 0 and top - self._lo < self.buffer // 2
+        near_bottom = self._hi < len(self.rows) and self._hi - bottom < self.buffer // 2
+        if (near_top or near_bottom) and not self._recentre:
+            self._recentre = True
+            self.after_idle(lambda: self._show(self._first))
+        self._report(top, bottom)
+
+    def _report(self, top, bottom):
+        total = len(self.rows)
+        first, last = (top / total, bottom / total) if total else (0.0, 1.0)
+        if self.scrollbar is not None:
+            self.scrollbar.set(first, last)
+        if self.on_scroll is not None:
+            self.on_scroll(first, last)
+
+    def _scroll(self, *args):
+        # Scrollbar command: drags jump the window, arrows and paging scroll
+        # inside it and re-centre from _on_view
+        if args[0] == "moveto":
+            self._show(round(float(args[1]) * len(self.rows)))
+        else:
+            self.yview(*args)
+
+    #endregion
+
+    #region SELECTION
+
+    def _on_press(self, event):
+        self._replace = not event.state & (SHIFT | CONTROL)
+
+    def _on_select(self, event):
+        focus = self.focus()
+        if focus:
+            self._focus = int(focus)
+        shown = {int(iid) for iid in self.selection()}
+        inside = {i for i in self._selected if self._lo <= i < self._hi}
+        if shown == inside:  # the window moved, the selection did not
+            return
+        if self._replace:
+            self._selected = shown
+        else:
+            self._selected = (self._selected - inside) | shown
+        self._replace = False
+        self.event_generate("<<RowSelect>>")
+
+    #endregion
@@ -0,0 +1,67 @@
+import queue
+import threading
+from tkinter import messagebox
+
+
+class DbWorker:
+    # Runs main.py calls on one background thread and hands results back to
+    # the Tk thread. One thread keeps writes serialized and gives the worker
+    # its own cached SQLite connection; Tk is only touched from _poll, which
+    # runs on the mainloop via root.after.
+
+    def __init__(self, root, on_busy=None, poll_ms=20):
+        self.root = root
+        self.on_busy = on_busy
+        self.poll_ms = poll_ms
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._latest = {}
+        self._pending = 0
+        threading.Thread(target=self._run, name="db-worker", daemon=True).start()
+        root.after(poll_ms, self._poll)
+
+    def submit(self, fn, *args, on_done=None, on_error=None, key=None):
+        # With a key, only the newest job for that key delivers its result:
+        # older ones are skipped if not started yet and dropped if they finish
+        # late. Use keys for refreshes only, never for writes.
+        generation = None
+        if key is not None:
+            generation = self._latest[key] = self._latest.get(key, 0) + 1
+        self._pending += 1
+        self._set_busy()
+        self._jobs.put((fn, args, on_done, on_error, key, generation))
+
+    def _is_stale(self, key, generation):
+        return key is not None and self._latest.get(key) != generation
+
+    def _run(self):
+        while True:
+            fn, args, on_done, on_error, key, generation = self._jobs.get()
+            if self._is_stale(key, generation):
+                self._results.put((None, None, key, generation))
+                continue
+            try:
+                self._results.put((on_done, fn(*args), key, generation))
+            except Exception as e:
+                self._results.put((on_error or self._show_error, e, key, generation))
+
+    def _poll(self):
+        try:
+            while True:
+                callback, value, key, generation = self._results.get_nowait()
+                self._pending -= 1
+                if callback is not None and not self._is_stale(key, generation):
+                    callback(value)
+        except queue.Empty:
+            pass
+        finally:
+            self._set_busy()
+            self.root.after(self.poll_ms, self._poll)
+
+    def _set_busy(self):
+        if self.on_busy:
+            self.on_busy(self._pending > 0)
+
+    @staticmethod
+    def _show_error(error):
+        messagebox.showerror("Error", str(error))